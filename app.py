@@ -1,28 +1,221 @@
-from flask import Flask, render_template, request, jsonify, session, redirect
+from flask import Flask, Response, g, has_request_context, render_template, request, jsonify, session, redirect, stream_template, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+import click
+from sqlalchemy import MetaData, Table, bindparam, case, delete, event, func, insert, inspect, or_, select, text, true, tuple_, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.schema import CreateTable, DropTable
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import date, datetime, timedelta
 import hashlib
+import shutil
+import tempfile
+import gzip
+import sqlite3
+import sys
+import logging
+import logging.handlers
+import hmac
 import uuid
 import os
+import io
+import csv
+import json
+import math
+import queue
+import re
+import threading
+import time
+import atexit
+import zlib
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import brotli
+except ImportError:  # optional - the landing page is then served gzip-only
+    brotli = None
+
+try:
+    import redis
+except ImportError:  # optional - only needed for RATE_LIMIT_REDIS_URL
+    redis = None
+
+# ============ LOGGING ============
+# Request paths log through a bounded queue; a listener thread does the
+# actual stdout writes. If the queue is full the record is dropped (and
+# counted) rather than blocking the request.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging():
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    handler = DroppingQueueHandler(log_queue)
+    logger = logging.getLogger('tradepass')
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger, handler
+
+log, log_handler = setup_logging()
+
+# ============ DATABASE CONFIG ============
+# DATABASE_URL selects the backend (Railway/Heroku style), defaulting to the
+# local SQLite file. Each gunicorn worker imports the app itself, so every
+# worker gets its own engine and connection pool.
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 15))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 300))
+
+def database_url(url=None):
+    """Database URL from the environment, or the local SQLite file"""
+    url = url or os.environ.get('DATABASE_URL', 'sqlite:///tradepass.db')
+    # Old postgres:// scheme and bare postgresql:// both mean psycopg2 here
+    # (it's what requirements.txt installs)
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            return 'postgresql+psycopg2://' + url[len(scheme):]
+    return url
+
+def engine_options(url):
+    """Engine options for the backend: busy timeout for SQLite, a pool for Postgres"""
+    if url.startswith('sqlite'):
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT}}
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True
+    }
+
+# Admin pages, exports and the analytics API read through a second engine
+# with its own pool, so a slow report can't take the connections - or hold
+# the locks - that /, /track and the ingest writer need. On SQLite it opens
+# the same WAL file read-only and wraps each checkout in one BEGIN, so a page
+# reads a single snapshot while writers carry on committing. On Postgres
+# READ_DATABASE_URL can point it at a replica. READ_SEPARATE=0 reads through
+# the primary engine again.
+READ_DATABASE_URL = os.environ.get('READ_DATABASE_URL')
+READ_SEPARATE = os.environ.get('READ_SEPARATE', '1') == '1'
+READ_POOL_SIZE = int(os.environ.get('READ_POOL_SIZE', 3))
+READ_MAX_OVERFLOW = int(os.environ.get('READ_MAX_OVERFLOW', 5))
+
+def read_database_url(url):
+    """URL for the read engine, or None when reads can't be split off (in-memory SQLite)"""
+    if READ_DATABASE_URL:
+        return database_url(READ_DATABASE_URL)
+    parsed = make_url(url)
+    if parsed.get_backend_name() != 'sqlite':
+        return url
+    if parsed.database in (None, '', ':memory:') or parsed.query.get('mode') == 'memory':
+        return None
+    if parsed.query.get('uri'):
+        return parsed.update_query_dict({'mode': 'ro'}).render_as_string(hide_password=False)
+    return parsed.set(
+        database=f"file:{parsed.database}",
+        query=dict(parsed.query, mode='ro', uri='true')
+    ).render_as_string(hide_password=False)
+
+def read_engine_options(url):
+    """Like engine_options(), with the read pool's size and read-only/snapshot settings"""
+    options = engine_options(url)
+    options.update(pool_size=READ_POOL_SIZE, max_overflow=READ_MAX_OVERFLOW)
+    if not url.startswith('sqlite'):
+        options.update(isolation_level='REPEATABLE READ', execution_options={'postgresql_readonly': True})
+    return options
+
+def snapshot_reads(engine):
+    """Make every SQLite transaction on `engine` an explicit BEGIN, i.e. one read snapshot"""
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    # pysqlite only BEGINs before writes; take over so reads get a transaction too
+    @event.listens_for(engine, 'connect')
+    def _driver_autocommit(dbapi_conn, connection_record):
+        dbapi_conn.isolation_level = None
+    
+    @event.listens_for(engine, 'begin')
+    def _begin_snapshot(conn):
+        conn.exec_driver_sql('BEGIN')
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    """WAL lets readers run alongside the writer; NORMAL sync is safe under WAL"""
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-16000')
+    # Only takes effect on a new file (or after a VACUUM); lets the archive
+    # job hand freed pages back with incremental_vacuum
+    cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    cursor.close()
 
 # ============ INIT APP ============
 app = Flask(__name__)
 app.secret_key = 'tradepass-secret-key-2024-change-this-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///tradepass.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+READ_URL = read_database_url(app.config['SQLALCHEMY_DATABASE_URI']) if READ_SEPARATE else None
+if READ_URL:
+    app.config['SQLALCHEMY_BINDS'] = {'read': dict(read_engine_options(READ_URL), url=READ_URL)}
+
+# /static assets (logo etc.) can be cached by browsers and CDNs
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 30 * 86400))
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_MAX_AGE
+
+# Behind Railway's proxy remote_addr is the proxy; trust N X-Forwarded-For hops.
+# Defaults to Railway's one hop when deployed there (it sets
+# RAILWAY_ENVIRONMENT_NAME): with 0 every client would share the proxy's IP,
+# and with it one visitor id and one rate-limit bucket.
+ON_RAILWAY = bool(os.environ.get('RAILWAY_ENVIRONMENT_NAME') or os.environ.get('RAILWAY_ENVIRONMENT'))
+PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 1 if ON_RAILWAY else 0))
+if PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS)
 
 db = SQLAlchemy(app)
+if READ_URL:
+    with app.app_context():
+        snapshot_reads(db.engines['read'])
+
+def read_engine():
+    """Engine for admin and analytics reads (the primary engine if reads aren't split)"""
+    return db.engines['read'] if READ_URL else db.engine
 
 # ============ DATABASE MODELS ============
 class Visitor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    visitor_id = db.Column(db.String(20))
-    ip_hash = db.Column(db.String(64))
-    user_agent = db.Column(db.Text)
-    referrer = db.Column(db.Text)
+    visitor_id = db.Column(db.String(20), unique=True, index=True)
+    ip_hash = db.Column(db.String(64), unique=True, index=True)
+    # Interned: the same few hundred strings repeat across almost every row
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('user_agent.id'))
+    referrer_id = db.Column(db.Integer, db.ForeignKey('referrer.id'))
     source = db.Column(db.String(50))
-    first_visit = db.Column(db.DateTime, default=datetime.utcnow)
-    last_visit = db.Column(db.DateTime, default=datetime.utcnow)
+    first_visit = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Derived from the visit log by refresh_visitor_profiles(), so it trails
+    # the latest page view by up to PROFILE_REFRESH_SECONDS
+    last_visit = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Relationship
     clicks = db.relationship('Click', backref='visitor', lazy=True)
@@ -32,8 +225,101 @@ class Click(db.Model):
     visitor_id = db.Column(db.String(20), db.ForeignKey('visitor.visitor_id'))
     ip_hash = db.Column(db.String(64))
     plan = db.Column(db.String(20))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     click_id = db.Column(db.String(36))
+    # Client-generated event ID from /track/batch, so retried beacons count once
+    idempotency_key = db.Column(db.String(64), unique=True, index=True)
+    
+    __table_args__ = (
+        db.Index('ix_click_visitor_id_timestamp', 'visitor_id', 'timestamp'),
+        db.Index('ix_click_plan_timestamp', 'plan', 'timestamp'),
+    )
+
+class UserAgent(db.Model):
+    """Distinct User-Agent strings, classified once when first seen.
+    
+    Looked up by digest (sha1 of the value) so the unique index stays small
+    however long the strings get.
+    """
+    __tablename__ = 'user_agent'
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(40), unique=True, index=True, nullable=False)
+    value = db.Column(db.Text, nullable=False)
+    family = db.Column(db.String(30))
+    device = db.Column(db.String(20))
+
+class Referrer(db.Model):
+    """Distinct referrer URLs, looked up by digest like UserAgent"""
+    __tablename__ = 'referrer'
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(40), unique=True, index=True, nullable=False)
+    value = db.Column(db.Text, nullable=False)
+
+class DailyRollup(db.Model):
+    """Visitor and click counters per day/source/plan, kept in step with the raw tables.
+    
+    New visitors count under their first_visit day with plan ''. Clicks count
+    under the click day, the clicking visitor's source and the plan.
+    """
+    __tablename__ = 'daily_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    source = db.Column(db.String(50), primary_key=True)
+    plan = db.Column(db.String(20), primary_key=True)
+    visitors = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+
+class HourlyRollup(db.Model):
+    """Same counters as DailyRollup at hour resolution, for the traffic API"""
+    __tablename__ = 'hourly_rollup'
+    hour = db.Column(db.DateTime, primary_key=True)
+    source = db.Column(db.String(50), primary_key=True)
+    plan = db.Column(db.String(20), primary_key=True)
+    visitors = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+
+class UniqueSketch(db.Model):
+    """HyperLogLog sketch (zlib-compressed registers) of the visitor IDs seen
+    per day, source and plan. kind is 'visitors' (page views, plan '') or
+    'clickers' (buy clicks)."""
+    __tablename__ = 'unique_sketch'
+    kind = db.Column(db.String(10), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    source = db.Column(db.String(50), primary_key=True)
+    plan = db.Column(db.String(20), primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+class IdSequence(db.Model):
+    __tablename__ = 'id_sequence'
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False)
+
+class ArchiveSegment(db.Model):
+    """An NDJSON segment written by the archive job; cutoff is its retention boundary"""
+    __tablename__ = 'archive_segment'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    path = db.Column(db.String(500), nullable=False)
+    cutoff = db.Column(db.DateTime, nullable=False)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class VisitPartition(db.Model):
+    """One day of the visit log. The visits themselves are in their own
+    visit_YYYYMMDD table, so expiring a day is a DROP TABLE.
+    
+    profiled_id is the highest visit id already folded into Visitor.last_visit;
+    a partition is sealed once its day is over and fully folded.
+    """
+    __tablename__ = 'visit_partition'
+    day = db.Column(db.Date, primary_key=True)
+    profiled_id = db.Column(db.Integer, nullable=False, default=0)
+    sealed = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 # ============ ADMIN CREDENTIALS ============
 # Load environment variables
@@ -46,31 +332,223 @@ def hash_ip(ip):
     """Hash IP address for privacy"""
     return hashlib.sha256(ip.encode()).hexdigest()[:16]
 
+class LRUCache:
+    """Thread-safe LRU map with a per-entry TTL and hit/miss/eviction counters"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()  # key -> (value, expires_at)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+    
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and item[1] < time.monotonic():
+                del self.data[key]
+                self.stats['expirations'] += 1
+                item = None
+            if item is None:
+                self.stats['misses'] += 1
+                return None
+            self.data.move_to_end(key)
+            self.stats['hits'] += 1
+            return item[0]
+    
+    def put(self, key, value):
+        self.put_many({key: value})
+    
+    def put_many(self, items):
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            for key, value in items.items():
+                self.data[key] = (value, expires)
+                self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def invalidate(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+    
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+    
+    def snapshot(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(
+            self.stats,
+            size=len(self.data),
+            maxsize=self.maxsize,
+            hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else 0.0
+        )
+
+# ip_hash -> visitor_id for returning visitors. Paths that delete or re-key
+# a visitor invalidate its entry here; the TTL bounds how long another
+# process's changes (e.g. a merge run by upgrade-db) can go unseen, and every
+# ingest flush re-caches its visitors as stored.
+VISITOR_CACHE_SIZE = int(os.environ.get('VISITOR_CACHE_SIZE', 50000))
+VISITOR_CACHE_TTL = float(os.environ.get('VISITOR_CACHE_TTL', 3600))
+visitor_cache = LRUCache(VISITOR_CACHE_SIZE, VISITOR_CACHE_TTL)
+
+class BlockAllocator:
+    """Unique integers from a named row in id_sequence.
+    
+    Each process reserves block_size numbers with one UPDATE and hands them
+    out from memory, so IDs never collide across threads or workers and the
+    database is only hit once per block. Unused numbers in a block are lost
+    when the process exits, which leaves gaps but never duplicates.
+    """
+    
+    def __init__(self, name, block_size, engine=None):
+        self.name = name
+        self.block_size = block_size
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.current = 0
+        self.limit = 0
+    
+    def next(self):
+        with self.lock:
+            if self.current >= self.limit:
+                self._reserve()
+            value = self.current
+            self.current += 1
+            return value
+    
+    def _reserve(self):
+        engine = self.engine or db.engine
+        seq = IdSequence.__table__
+        with engine.begin() as conn:
+            # The UPDATE holds the row (or SQLite write) lock until commit,
+            # so the value read back belongs to this block only
+            conn.execute(
+                update(seq)
+                .where(seq.c.name == self.name)
+                .values(next_value=seq.c.next_value + self.block_size)
+            )
+            limit = conn.execute(
+                select(seq.c.next_value).where(seq.c.name == self.name)
+            ).scalar()
+        if limit is None:
+            raise RuntimeError(f"id_sequence '{self.name}' is not initialized - run upgrade-db")
+        self.limit = limit
+        self.current = limit - self.block_size
+
+VISITOR_ID_BLOCK = int(os.environ.get('VISITOR_ID_BLOCK', 50))
+visitor_numbers = BlockAllocator('visitor', VISITOR_ID_BLOCK)
+
 def get_visitor_id():
     """Generate unique visitor ID"""
-    count = Visitor.query.count()
-    return f"V{1000 + count + 1}"
+    return f"V{visitor_numbers.next()}"
 
-def detect_source(referrer):
-    """Detect traffic source from referrer"""
-    if not referrer or referrer == '':
-        return 'direct'
+def cached_visitor(ip_hash):
+    """Visitor ID from memory (queued or recently seen), or None - never touches the DB"""
+    return ingest.pending.get(ip_hash) or visitor_cache.get(ip_hash)
+
+def resolve_visitor(ip_hash):
+    """Return (visitor_id, is_new) for an IP hash, allocating an ID for new visitors"""
+    visitor_id = cached_visitor(ip_hash)
+    if visitor_id:
+        return visitor_id, False
     
-    ref = referrer.lower()
-    if 'instagram' in ref:
-        return 'instagram'
-    elif 'youtube.com' in ref or 'youtu.be' in ref:
-        return 'youtube'
-    elif 'facebook.com' in ref or 'fb.com' in ref:
-        return 'facebook'
-    elif 'whatsapp' in ref:
-        return 'whatsapp'
-    elif 'tiktok' in ref:
-        return 'tiktok'
-    elif 'telegram' in ref or 't.me' in ref:
-        return 'telegram'
-    else:
+    row = db.session.query(Visitor.visitor_id).filter_by(ip_hash=ip_hash).first()
+    if row:
+        visitor_cache.put(ip_hash, row.visitor_id)
+        return row.visitor_id, False
+    
+    # Allocated outside ingest.lock: a block refill is a DB write, and every
+    # put() in the process would queue behind it. If another thread wins the
+    # race for this ip_hash, our number is just a gap.
+    visitor_id = get_visitor_id()
+    with ingest.lock:
+        pending = ingest.pending.get(ip_hash)
+        if pending:
+            return pending, False
+        ingest.pending[ip_hash] = visitor_id
+        return visitor_id, True
+
+# Referrer host -> traffic source. A host matches an entry if it equals it
+# or ends in ".<entry>" (m.facebook.com, l.instagram.com), so lookalikes such
+# as notfacebook.com, or a 't.me' somewhere in a path, no longer match.
+# Android app referrers (android-app://com.instagram.android/) carry the
+# package name as the host. Extend with REFERRER_SOURCES, e.g.
+# "lnkd.in=linkedin,linkedin.com=linkedin".
+REFERRER_DOMAINS = {
+    'instagram.com': 'instagram',
+    'com.instagram.android': 'instagram',
+    'youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'com.google.android.youtube': 'youtube',
+    'facebook.com': 'facebook',
+    'fb.com': 'facebook',
+    'fb.me': 'facebook',
+    'com.facebook.katana': 'facebook',
+    'whatsapp.com': 'whatsapp',
+    'wa.me': 'whatsapp',
+    'com.whatsapp': 'whatsapp',
+    'tiktok.com': 'tiktok',
+    'com.zhiliaoapp.musically': 'tiktok',
+    't.me': 'telegram',
+    'telegram.me': 'telegram',
+    'telegram.org': 'telegram',
+    'org.telegram.messenger': 'telegram',
+}
+REFERRER_DOMAINS.update(
+    (domain.strip().lower(), source.strip().lower())
+    for domain, _, source in (
+        entry.partition('=') for entry in os.environ.get('REFERRER_SOURCES', '').split(',') if '=' in entry
+    )
+)
+
+# utm_source values accepted as-is or via a short alias. Anything else falls
+# back to the referrer, so arbitrary tags can't add source values.
+UTM_SOURCE_ALIASES = {'ig': 'instagram', 'fb': 'facebook', 'yt': 'youtube', 'wa': 'whatsapp', 'tg': 'telegram'}
+KNOWN_SOURCES = frozenset(REFERRER_DOMAINS.values())
+REFERRER_CACHE_SIZE = int(os.environ.get('REFERRER_CACHE_SIZE', 4096))
+
+def source_for_host(host):
+    """Source for a hostname, by its longest matching REFERRER_DOMAINS suffix"""
+    host = host.rstrip('.')
+    while host:
+        source = REFERRER_DOMAINS.get(host)
+        if source:
+            return source
+        host = host.partition('.')[2]
+    return None
+
+def source_for_utm(value):
+    value = (value or '').strip().lower()
+    if value in KNOWN_SOURCES:
+        return value
+    return UTM_SOURCE_ALIASES.get(value) or source_for_host(value)
+
+@lru_cache(maxsize=REFERRER_CACHE_SIZE)
+def classify_referrer(referrer):
+    """Source for a referrer URL: its utm_source, else its host"""
+    try:
+        referrer = referrer.strip()
+        parts = urlsplit(referrer if '://' in referrer else '//' + referrer)
+        host = parts.hostname
+    except ValueError:
         return 'other'
+    if parts.query and 'utm_source=' in parts.query:
+        source = source_for_utm(parse_qs(parts.query).get('utm_source', [''])[0])
+        if source:
+            return source
+    return (host and source_for_host(host)) or 'other'
+
+def detect_source(referrer, utm_source=None):
+    """Detect traffic source from the landing page's utm_source or the referrer"""
+    source = source_for_utm(utm_source) if utm_source else None
+    if source:
+        return source
+    if not referrer:
+        return 'direct'
+    return classify_referrer(referrer)
 
 def time_ago(dt):
     """Convert datetime to human readable time ago"""
@@ -93,6 +571,1297 @@ def check_admin():
     """Check if admin is logged in"""
     return session.get('admin_logged_in') == True
 
+# ============ STRING INTERNING ============
+# User-Agent and referrer strings are stored once in their lookup tables and
+# referenced by id. The writer maps strings to ids through an LRU cache, so a
+# batch of events from known browsers/referrers needs no lookup query.
+INTERN_CACHE_SIZE = int(os.environ.get('INTERN_CACHE_SIZE', 20000))
+
+# Crawlers, link-preview fetchers, uptime checkers and scripts. Also used by
+# the traffic filter to keep them out of the visitor/click tables.
+BOT_USER_AGENT = re.compile(
+    r'(?i)^$|bot\b|crawl|spider|slurp|curl/|wget/|python-requests|aiohttp|go-http-client|headless'
+    r'|uptime|pingdom|monitor|lighthouse|facebookexternalhit|preview'
+)
+
+# (family, pattern) - first match wins, so in-app browsers and derivatives
+# come before the engines they embed
+USER_AGENT_FAMILIES = [('Bot', BOT_USER_AGENT)] + [(family, re.compile(pattern)) for family, pattern in (
+    ('Instagram', r'Instagram'),
+    ('Facebook', r'FBAN|FBAV|FB_IAB'),
+    ('WhatsApp', r'WhatsApp'),
+    ('Edge', r'Edg(e|A|iOS)?/'),
+    ('Opera', r'OPR/|Opera'),
+    ('Samsung Internet', r'SamsungBrowser'),
+    ('Firefox', r'Firefox/|FxiOS'),
+    ('Chrome', r'Chrome/|CriOS'),
+    ('Safari', r'Safari/'),
+)]
+USER_AGENT_DEVICES = [(device, re.compile(pattern)) for device, pattern in (
+    ('tablet', r'iPad|Tablet|^(?=.*Android)(?!.*Mobile)'),
+    ('mobile', r'Mobi|iPhone|iPod|Android'),
+)]
+
+def parse_user_agent(value):
+    """(family, device) for a User-Agent string"""
+    family = next((name for name, pattern in USER_AGENT_FAMILIES if pattern.search(value)), 'Other')
+    if family == 'Bot':
+        return family, 'bot'
+    device = next((name for name, pattern in USER_AGENT_DEVICES if pattern.search(value)), 'desktop')
+    return family, device
+
+def string_digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+class StringInterner:
+    """Maps strings to ids in a lookup table (UserAgent/Referrer), inserting
+    the ones it hasn't seen. `describe` adds derived columns to new rows."""
+    
+    def __init__(self, model, describe=None, cache_size=INTERN_CACHE_SIZE):
+        self.model = model
+        self.describe = describe
+        self.cache = LRUCache(cache_size, 86400)
+    
+    def ids(self, conn, values):
+        """{value: id} for the non-empty strings in values, creating missing rows"""
+        result = {}
+        missing = set()
+        for value in values:
+            if not value:
+                continue
+            cached = self.cache.get(value)
+            if cached is None:
+                missing.add(value)
+            else:
+                result[value] = cached
+        if not missing:
+            return result
+        
+        table = self.model.__table__
+        digests = {string_digest(value): value for value in missing}
+        found = self._lookup(conn, digests)
+        self.cache.put_many(found)
+        result.update(found)
+        
+        new_rows = [
+            dict(digest=digest, value=value, **(self.describe(value) if self.describe else {}))
+            for digest, value in digests.items() if value not in found
+        ]
+        if new_rows:
+            # Another worker may insert the same string first - its row wins.
+            # Not cached yet: the caller's transaction could still roll back
+            conn.execute(
+                dialect_insert(table, conn).on_conflict_do_nothing(index_elements=[table.c.digest]),
+                new_rows
+            )
+            result.update(self._lookup(conn, {row['digest']: row['value'] for row in new_rows}))
+        return result
+    
+    def _lookup(self, conn, digests):
+        table = self.model.__table__
+        return {
+            digests[digest]: row_id
+            for row_id, digest in conn.execute(
+                select(table.c.id, table.c.digest).where(table.c.digest.in_(list(digests)))
+            )
+        }
+
+def _describe_user_agent(value):
+    family, device = parse_user_agent(value)
+    return {'family': family, 'device': device}
+
+user_agents = StringInterner(UserAgent, _describe_user_agent)
+referrers = StringInterner(Referrer)
+
+# ============ EVENT INGESTION ============
+# Page views and buy clicks are queued and written by a background thread in
+# batches, so a request never waits on a commit.
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 0.5))
+INGEST_PUT_TIMEOUT = float(os.environ.get('INGEST_PUT_TIMEOUT', 0.05))
+PROFILE_REFRESH_SECONDS = float(os.environ.get('PROFILE_REFRESH_SECONDS', 60))
+
+# A batch that fails to commit (database locked or down) is retried with
+# backoff; if it still fails it is appended to a dead-letter file, one NDJSON
+# event per line, and written back later. Events already answered with 200
+# are never just dropped. Each process spills to its own file; replay claims
+# a file by renaming it, so any worker can pick up another's (or a previous
+# deploy's) spill. A crash between a replayed commit and removing the file
+# replays that file again.
+INGEST_RETRIES = int(os.environ.get('INGEST_RETRIES', 3))
+INGEST_RETRY_BACKOFF = float(os.environ.get('INGEST_RETRY_BACKOFF', 0.5))
+INGEST_REPLAY_INTERVAL = float(os.environ.get('INGEST_REPLAY_INTERVAL', 30))
+INGEST_DEAD_LETTER_DIR = os.environ.get('INGEST_DEAD_LETTER_DIR', os.path.join(app.instance_path, 'dead-letter'))
+
+_STOP = object()
+
+def make_event(kind, ip_hash, visitor_id, plan=None, key=None):
+    """Build a queued visit/click event from the current request"""
+    return build_event(
+        kind, ip_hash, visitor_id,
+        request.user_agent.string, request.referrer, request.args.get('utm_source'),
+        plan=plan, key=key
+    )
+
+def build_event(kind, ip_hash, visitor_id, user_agent, referrer, utm_source=None, plan=None, key=None):
+    """Build a queued visit/click event from raw request fields"""
+    return {
+        'type': kind,
+        'ip_hash': ip_hash,
+        'visitor_id': visitor_id,
+        'user_agent': user_agent,
+        'referrer': referrer,
+        'source': detect_source(referrer, utm_source),
+        'plan': plan,
+        'click_id': str(uuid.uuid4())[:8] if kind == 'click' else None,
+        'key': key,
+        'at': datetime.utcnow()
+    }
+
+def encode_event(event):
+    return json.dumps(dict(event, at=event['at'].isoformat()))
+
+def decode_event(line):
+    event = json.loads(line)
+    event['at'] = datetime.fromisoformat(event['at'])
+    return event
+
+def lookup_visitors(ip_hashes):
+    """{ip_hash: (visitor_id, source)} for the stored visitors among ip_hashes"""
+    return {
+        row.ip_hash: (row.visitor_id, row.source)
+        for row in db.session.execute(
+            select(Visitor.ip_hash, Visitor.visitor_id, Visitor.source)
+            .where(Visitor.ip_hash.in_(list(ip_hashes)))
+        )
+    }
+
+def stored_event_keys(keys):
+    """The subset of click idempotency keys already in the database"""
+    if not keys:
+        return set()
+    return set(db.session.execute(
+        select(Click.idempotency_key).where(Click.idempotency_key.in_(list(keys)))
+    ).scalars())
+
+def write_events(events):
+    """Write a batch of events (and their rollup counters) in one transaction.
+    
+    Page views only ever append to the visit log - no visitor row is
+    updated here. Returns {ip_hash: visitor_id} for every visitor in the
+    batch as stored.
+    """
+    visitor_table, click_table = Visitor.__table__, Click.__table__
+    ensure_visit_partitions({e['at'].date() for e in events if e['type'] == 'visit'})
+    stored = lookup_visitors({e['ip_hash'] for e in events})
+    
+    # Unknown visitors are created from their first event in the batch
+    new_visitors = {}
+    for e in events:
+        if e['ip_hash'] not in stored and e['ip_hash'] not in new_visitors:
+            new_visitors[e['ip_hash']] = {
+                'visitor_id': e['visitor_id'],
+                'ip_hash': e['ip_hash'],
+                'user_agent': e['user_agent'],
+                'referrer': e['referrer'],
+                'source': e['source'],
+                'first_visit': e['at'],
+                'last_visit': e['at']
+            }
+    
+    inserted = set()
+    if new_visitors:
+        agent_ids = user_agents.ids(db.session, {row['user_agent'] for row in new_visitors.values()})
+        referrer_ids = referrers.ids(db.session, {row['referrer'] for row in new_visitors.values()})
+        for row in new_visitors.values():
+            row['user_agent_id'] = agent_ids.get(row.pop('user_agent'))
+            row['referrer_id'] = referrer_ids.get(row.pop('referrer'))
+        stmt = dialect_insert(visitor_table, db.session).on_conflict_do_nothing(
+            index_elements=[visitor_table.c.ip_hash]
+        )
+        db.session.execute(stmt, list(new_visitors.values()))
+        # Another worker may have created the same visitor first - its row wins
+        stored.update(lookup_visitors(new_visitors))
+        inserted = {h for h, row in new_visitors.items() if stored[h][0] == row['visitor_id']}
+    
+    deltas = {}
+    for ip_hash in inserted:
+        row = new_visitors[ip_hash]
+        add_rollup_delta(deltas, row['first_visit'], row['source'], None, visitors=1)
+    
+    # Clicks whose idempotency key is already stored (or repeated in this
+    # batch) were delivered before
+    seen_keys = stored_event_keys({e['key'] for e in events if e['key']})
+    
+    visits = []
+    clicks = []
+    sketches = {}
+    for e in events:
+        visitor_id, source = stored[e['ip_hash']]
+        if e['type'] == 'visit':
+            visits.append({'visitor_id': visitor_id, 'source': e['source'], 'at': e['at']})
+            add_to_sketch(sketches, 'visitors', e['at'], e['source'], None, visitor_id)
+        elif e['key'] is None or e['key'] not in seen_keys:
+            if e['key']:
+                seen_keys.add(e['key'])
+            clicks.append({
+                'visitor_id': visitor_id,
+                'ip_hash': e['ip_hash'],
+                'plan': e['plan'],
+                'timestamp': e['at'],
+                'click_id': e['click_id'],
+                'idempotency_key': e['key'],
+                'source': source
+            })
+    
+    append_visits(db.session, visits)
+    if clicks:
+        # The unique key still guards against another worker racing us;
+        # RETURNING says which keyed clicks went in (unkeyed ones always do)
+        inserted_keys = set(db.session.execute(
+            dialect_insert(click_table, db.session).on_conflict_do_nothing(
+                index_elements=[click_table.c.idempotency_key]
+            ).returning(click_table.c.idempotency_key),
+            [{k: v for k, v in click.items() if k != 'source'} for click in clicks]
+        ).scalars())
+        for click in clicks:
+            if click['idempotency_key'] is None or click['idempotency_key'] in inserted_keys:
+                add_rollup_delta(deltas, click['timestamp'], click['source'], click['plan'], clicks=1)
+                add_to_sketch(sketches, 'clickers', click['timestamp'], click['source'], click['plan'], click['visitor_id'])
+    
+    apply_rollup_deltas(db.session, deltas)
+    merge_sketches(db.session, sketches)
+    db.session.commit()
+    return {ip_hash: visitor_id for ip_hash, (visitor_id, source) in stored.items()}
+
+class EventIngest:
+    """Bounded write-behind queue drained by one background writer thread.
+    
+    The writer flushes when a batch reaches INGEST_BATCH_SIZE events or
+    INGEST_FLUSH_INTERVAL seconds after its first event, whichever is first.
+    When the queue is full, put() blocks briefly and then writes the event
+    inline, so producers slow down instead of dropping events. Batches that
+    can't be written go to the dead-letter file (see INGEST_RETRIES).
+    """
+    
+    def __init__(self, maxsize, batch_size, flush_interval):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}  # ip_hash -> visitor_id for visitors not written yet
+        self.thread = None
+        self.next_profile_refresh = 0.0
+        self.next_replay = 0.0
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'flushes': 0,
+            'inline_writes': 0,
+            'errors': 0,
+            'retries': 0,
+            'dead_lettered': 0,
+            'replayed': 0,
+            'profile_refreshes': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+    
+    def start(self):
+        # Lock-free once the writer is running - this is on every request's path
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+                self.thread.start()
+    
+    def put(self, event):
+        """Queue an event, writing it inline if the queue stays full"""
+        self.start()
+        try:
+            self.queue.put(event, timeout=INGEST_PUT_TIMEOUT)
+            self.stats['enqueued'] += 1
+        except queue.Full:
+            self.stats['inline_writes'] += 1
+            # A request thread can't sit out the backoff - spill straight away
+            self.flush([event], retries=0)
+    
+    def try_put(self, event):
+        """Queue an event without blocking; False if the queue is full"""
+        self.start()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            return False
+        self.stats['enqueued'] += 1
+        return True
+    
+    def stop(self, timeout=10):
+        """Flush everything still queued and stop the writer"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+        
+        # Writer not running (or didn't finish): drain what's left here
+        leftover = []
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is not _STOP:
+                leftover.append(event)
+        if leftover:
+            self.flush(leftover)
+    
+    def flush(self, batch, retries=INGEST_RETRIES):
+        """Write a batch, retrying with backoff; returns False if it was dead-lettered instead"""
+        started = time.perf_counter()
+        try:
+            for attempt in range(retries + 1):
+                if attempt:
+                    self.stats['retries'] += 1
+                    time.sleep(INGEST_RETRY_BACKOFF * 2 ** (attempt - 1))
+                if self._write(batch):
+                    break
+            else:
+                self.spill(batch)
+                return False
+        finally:
+            # Committed (or spilled) visitors are no longer pending
+            with self.lock:
+                for event in batch:
+                    if self.pending.get(event['ip_hash']) == event['visitor_id']:
+                        del self.pending[event['ip_hash']]
+        
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stats['written'] += len(batch)
+        self.stats['flushes'] += 1
+        self.stats['last_flush_ms'] = round(elapsed, 2)
+        self.stats['max_flush_ms'] = round(max(self.stats['max_flush_ms'], elapsed), 2)
+        self.stats['total_flush_ms'] += elapsed
+        return True
+    
+    def _write(self, batch):
+        with self.flush_lock, app.app_context():
+            try:
+                visitor_cache.put_many(write_events(batch))
+                return True
+            except Exception as e:
+                db.session.rollback()
+                self.stats['errors'] += 1
+                log.error(f"❌ Ingest flush failed ({len(batch)} events): {str(e)}")
+                return False
+    
+    def spill(self, batch):
+        """Append events to this process's dead-letter file, to be replayed later"""
+        path = os.path.join(INGEST_DEAD_LETTER_DIR, f"events-{os.getpid()}.ndjson")
+        try:
+            os.makedirs(INGEST_DEAD_LETTER_DIR, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(''.join(encode_event(event) + '\n' for event in batch))
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            log.critical(f"🚨 Lost {len(batch)} events - dead-letter write failed: {str(e)}")
+            return
+        self.stats['dead_lettered'] += len(batch)
+        self.next_replay = min(self.next_replay, time.monotonic() + INGEST_REPLAY_INTERVAL)
+        log.error(f"📥 {len(batch)} events saved to {path} for replay")
+    
+    def replay_dead_letters(self):
+        """Write back spilled events from every worker's dead-letter files"""
+        self.next_replay = float('inf')
+        try:
+            names = sorted(os.listdir(INGEST_DEAD_LETTER_DIR))
+        except FileNotFoundError:
+            return
+        
+        for name in names:
+            path = os.path.join(INGEST_DEAD_LETTER_DIR, name)
+            if name.endswith('.replay'):
+                # Left by a replay that died; take it over only if its process is gone
+                if _process_alive(int(name.split('.')[-2])):
+                    continue
+            elif not name.endswith('.ndjson'):
+                continue
+            claimed = os.path.join(INGEST_DEAD_LETTER_DIR, f"{name.split('.')[0]}.{os.getpid()}.replay")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue  # another worker claimed it first
+            
+            events = []
+            with open(claimed, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        events.append(decode_event(line))
+                    except ValueError:
+                        log.error(f"❌ Skipping unreadable dead-letter line in {name}")
+            for i in range(0, len(events), self.batch_size):
+                if not self._write(events[i:i + self.batch_size]):
+                    # Still failing: back into our own file for the next round
+                    self.spill(events[i:])
+                    os.remove(claimed)
+                    return
+            os.remove(claimed)
+            self.stats['replayed'] += len(events)
+            if events:
+                log.info(f"📤 Replayed {len(events)} dead-lettered events from {name}")
+    
+    def refresh_profiles(self):
+        """Fold new visit log rows into Visitor.last_visit"""
+        self.next_profile_refresh = time.monotonic() + PROFILE_REFRESH_SECONDS
+        with self.flush_lock, app.app_context():
+            try:
+                # Tomorrow's partition is made ahead of time, not by the first visit after midnight
+                today = datetime.utcnow().date()
+                ensure_visit_partitions({today, today + timedelta(days=1)})
+                refresh_visitor_profiles(db.session)
+                db.session.commit()
+                self.stats['profile_refreshes'] += 1
+            except Exception as e:
+                db.session.rollback()
+                self.stats['errors'] += 1
+                log.error(f"❌ Visitor profile refresh failed: {str(e)}")
+    
+    def snapshot(self):
+        flushes = self.stats['flushes']
+        return dict(
+            self.stats,
+            queue_depth=self.queue.qsize(),
+            pending_visitors=len(self.pending),
+            avg_flush_ms=round(self.stats['total_flush_ms'] / flushes, 2) if flushes else 0.0,
+            total_flush_ms=round(self.stats['total_flush_ms'], 2)
+        )
+    
+    def _run(self):
+        self.replay_dead_letters()
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self.flush(batch)
+            if time.monotonic() >= self.next_replay:
+                self.replay_dead_letters()
+            if stopping or time.monotonic() >= self.next_profile_refresh:
+                self.refresh_profiles()
+            if stopping:
+                return
+    
+    def _collect(self):
+        """Block for the next batch; returns (events, stop_requested)"""
+        batch = []
+        try:
+            event = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch, False
+        
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if event is _STOP:
+                return batch, True
+            batch.append(event)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                return batch, False
+            try:
+                event = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, False
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+ingest = EventIngest(INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL)
+atexit.register(ingest.stop)
+
+# ============ ROLLUPS ============
+def dialect_insert(table, conn):
+    """INSERT for the session's/connection's dialect, so on_conflict_* upserts are available"""
+    bind = conn.get_bind() if hasattr(conn, 'get_bind') else conn
+    if bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table)
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    return sqlite_insert(table)
+
+# Deltas are collected per (hour, source, plan); daily_rollup gets the same
+# counters summed per day
+def add_rollup_delta(deltas, at, source, plan, visitors=0, clicks=0):
+    key = (at.replace(minute=0, second=0, microsecond=0), source or '', plan or '')
+    counts = deltas.setdefault(key, [0, 0])
+    counts[0] += visitors
+    counts[1] += clicks
+
+def daily_totals(hourly):
+    """Sum (hour, source, plan) counters into (day, source, plan)"""
+    daily = {}
+    for (hour, source, plan), (visitors, clicks) in hourly.items():
+        counts = daily.setdefault((hour.date(), source, plan), [0, 0])
+        counts[0] += visitors
+        counts[1] += clicks
+    return daily
+
+ROLLUP_TABLES = (
+    # (table, bucket column, hourly counters -> this table's counters)
+    (HourlyRollup.__table__, 'hour', lambda hourly: hourly),
+    (DailyRollup.__table__, 'day', daily_totals),
+)
+
+def _upsert_counters(conn, table, bucket, counts):
+    stmt = dialect_insert(table, conn)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c[bucket], table.c.source, table.c.plan],
+        set_={
+            'visitors': table.c.visitors + stmt.excluded.visitors,
+            'clicks': table.c.clicks + stmt.excluded.clicks
+        }
+    )
+    conn.execute(stmt, [
+        {bucket: key, 'source': source, 'plan': plan, 'visitors': v, 'clicks': c}
+        for (key, source, plan), (v, c) in counts.items()
+    ])
+
+def apply_rollup_deltas(conn, deltas):
+    """Add hourly counter deltas to hourly_rollup and daily_rollup, one upsert per key"""
+    if not deltas:
+        return
+    for table, bucket, convert in ROLLUP_TABLES:
+        _upsert_counters(conn, table, bucket, convert(deltas))
+
+def hour_bucket(column, conn):
+    """SQL expression truncating a timestamp to its hour"""
+    if conn.dialect.name == 'postgresql':
+        return func.date_trunc('hour', column)
+    return func.strftime('%Y-%m-%d %H:00:00', column)
+
+def _as_datetime(value):
+    # strftime() comes back as a string on SQLite, date_trunc() as a datetime on Postgres
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def archive_watermark(conn):
+    """Rows before this time may have been archived; their rollups are final"""
+    return conn.execute(select(func.max(ArchiveSegment.cutoff))).scalar()
+
+def _rollup_range(table, bucket, since):
+    if since is None:
+        return true()
+    return table.c[bucket] >= (since.date() if bucket == 'day' else since)
+
+def compute_rollups(conn, since=None):
+    """Recompute hourly rollup counters from the raw Visitor/Click rows at or after `since`"""
+    counts = {}
+    visitor_hour = hour_bucket(Visitor.first_visit, conn)
+    for hour, source, n in conn.execute(
+        select(visitor_hour, Visitor.source, func.count(Visitor.id))
+        .where(Visitor.first_visit >= since if since else true())
+        .group_by(visitor_hour, Visitor.source)
+    ):
+        add_rollup_delta(counts, _as_datetime(hour), source, None, visitors=n)
+    
+    click_hour = hour_bucket(Click.timestamp, conn)
+    for hour, source, plan, n in conn.execute(
+        select(click_hour, Visitor.source, Click.plan, func.count(Click.id))
+        .select_from(Click)
+        .outerjoin(Visitor, Visitor.visitor_id == Click.visitor_id)
+        .where(Click.timestamp >= since if since else true())
+        .group_by(click_hour, Visitor.source, Click.plan)
+    ):
+        add_rollup_delta(counts, _as_datetime(hour), source, plan, clicks=n)
+    return counts
+
+def stored_rollups(conn, table, bucket, since=None):
+    return {
+        (row[0], row.source, row.plan): [row.visitors, row.clicks]
+        for row in conn.execute(select(table.c[bucket], table.c.source, table.c.plan,
+                                       table.c.visitors, table.c.clicks)
+                                .where(_rollup_range(table, bucket, since)))
+    }
+
+def rebuild_rollups(conn):
+    """Replace the rollup tables with counters recomputed from raw rows.
+    
+    Rollups from before the archive watermark are kept as they are: their
+    raw rows may be gone, and those buckets can no longer change.
+    """
+    since = archive_watermark(conn)
+    # Delete first: on SQLite this takes the write lock, so the ingest
+    # writer can't add deltas between the recount and the insert
+    for table, bucket, convert in ROLLUP_TABLES:
+        conn.execute(table.delete().where(_rollup_range(table, bucket, since)))
+    counts = compute_rollups(conn, since)
+    apply_rollup_deltas(conn, counts)
+    traffic_cache.clear()
+    return len(counts)
+
+def rollup_mismatches(conn):
+    """(table, key, stored, expected) for every rollup row after the archive
+    watermark that disagrees with raw data"""
+    since = archive_watermark(conn)
+    hourly = compute_rollups(conn, since)
+    mismatches = []
+    for table, bucket, convert in ROLLUP_TABLES:
+        stored = stored_rollups(conn, table, bucket, since)
+        expected = convert(hourly)
+        mismatches.extend(
+            (table.name, key, stored.get(key, [0, 0]), expected.get(key, [0, 0]))
+            for key in sorted(set(stored) | set(expected), key=str)
+            if stored.get(key, [0, 0]) != expected.get(key, [0, 0])
+        )
+    return mismatches
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the rollup tables from the raw visitor/click tables"""
+    with db.engine.begin() as conn:
+        rows = rebuild_rollups(conn)
+    print(f"✅ Rebuilt {rows} rollup rows")
+
+@app.cli.command('check-rollups')
+def check_rollups_command():
+    """Compare the rollup tables against counts from the raw tables"""
+    with db.engine.connect() as conn:
+        mismatches = rollup_mismatches(conn)
+    
+    for table, key, stored, expected in mismatches:
+        print(f"❌ {table} {key}: stored visitors/clicks {stored}, raw {expected}")
+    if mismatches:
+        raise SystemExit(1)
+    print("✅ Rollups match raw data")
+
+# ============ DASHBOARD STATS ============
+PLAN_PRICES = {'plan_99': 99, 'plan_149': 149, 'plan_199': 199}
+
+def visitor_click_count():
+    """Correlated click count per visitor row (served by the (visitor_id, timestamp) index)"""
+    return (
+        select(func.count(Click.id))
+        .where(Click.visitor_id == Visitor.visitor_id)
+        .scalar_subquery()
+    )
+
+def dashboard_counters(conn, now=None):
+    """Stat cards and plan breakdown, from one GROUP BY over daily_rollup"""
+    now = now or datetime.utcnow()
+    rollup = DailyRollup.__table__.c
+    plan_counts = {}
+    total_visitors = today_visitors = today_clicks = 0
+    for plan, visitors, clicks, visitors_today, clicks_today in conn.execute(
+        select(
+            rollup.plan,
+            func.sum(rollup.visitors),
+            func.sum(rollup.clicks),
+            func.sum(case((rollup.day == now.date(), rollup.visitors), else_=0)),
+            func.sum(case((rollup.day == now.date(), rollup.clicks), else_=0))
+        ).group_by(rollup.plan)
+    ):
+        total_visitors += visitors
+        today_visitors += visitors_today
+        today_clicks += clicks_today
+        if clicks:
+            plan_counts[plan] = clicks
+    total_clicks = sum(plan_counts.values())
+    
+    conversion_rate = round((total_clicks / total_visitors * 100), 1) if total_visitors > 0 else 0
+    
+    top_plan = "No clicks yet"
+    named_counts = {plan: count for plan, count in plan_counts.items() if plan}
+    if named_counts:
+        plan, count = max(named_counts.items(), key=lambda item: item[1])
+        top_plan = f"{plan.replace('plan_', '₹')} ({count} clicks)"
+    
+    plan_stats = []
+    for plan, price in PLAN_PRICES.items():
+        count = plan_counts.get(plan, 0)
+        plan_stats.append({
+            'plan': plan.replace('plan_', '₹'),
+            'count': count,
+            'percentage': round((count / total_clicks * 100), 1) if total_clicks > 0 else 0,
+            'revenue': f"₹{count * price:,}"
+        })
+    
+    return {
+        'stats': {
+            'total_visitors': total_visitors,
+            'total_clicks': total_clicks,
+            'today_visitors': today_visitors,
+            'today_clicks': today_clicks,
+            'conversion_rate': conversion_rate,
+            'top_plan': top_plan
+        },
+        'plan_stats': plan_stats
+    }
+
+def dashboard_stats(now=None, engine=None):
+    """Everything admin_dashboard() shows, in four queries against one read snapshot"""
+    now = now or datetime.utcnow()
+    with (engine or read_engine()).connect() as conn:
+        return _dashboard_stats(conn, now)
+
+def _dashboard_stats(conn, now):
+    counters = dashboard_counters(conn, now)
+    
+    # Recent visitors with their click counts
+    recent_visitors = [{
+        'visitor_id': row.visitor_id,
+        'time': row.last_visit.strftime('%H:%M'),
+        'time_ago': time_ago(row.last_visit),
+        'source': row.source,
+        'clicks': row.clicks
+    } for row in conn.execute(
+        select(Visitor.visitor_id, Visitor.last_visit, Visitor.source, visitor_click_count().label('clicks'))
+        .order_by(Visitor.last_visit.desc()).limit(5)
+    )]
+    
+    recent_clicks = [{
+        'plan': row.plan,
+        'visitor_id': row.visitor_id,
+        'time_ago': time_ago(row.timestamp),
+        'ip_hash': row.ip_hash[:8] + '...'
+    } for row in conn.execute(
+        select(Click.plan, Click.visitor_id, Click.timestamp, Click.ip_hash)
+        .order_by(Click.timestamp.desc()).limit(5)
+    )]
+    
+    return {
+        'stats': counters['stats'],
+        'recent_visitors': recent_visitors,
+        'recent_clicks': recent_clicks,
+        'plan_stats': counters['plan_stats'],
+        # Where the live feed should pick up from, so nothing between this
+        # render and the EventSource connecting is missed
+        'live_cursor': encode_feed_cursor(feed_position(conn))
+    }
+
+# ============ LANDING PAGE CACHE ============
+class CachedPage:
+    """A template with no per-request variables, rendered once and kept in
+    memory as identity, gzip and (with the brotli package) br variants.
+    
+    Responses carry an ETag/Last-Modified and answer conditional GETs with
+    304. They are marked no-cache, so browsers revalidate instead of reusing
+    the page silently - every GET / still has to reach home() to be tracked.
+    """
+    
+    def __init__(self, template):
+        self.template = template
+        self.lock = threading.Lock()
+        self.variants = None
+        self.etag = None
+        self.last_modified = None
+    
+    def _build(self):
+        body = render_template(self.template).encode('utf-8')
+        variants = {'identity': body, 'gzip': gzip.compress(body, 9)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=11)
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.last_modified = datetime.utcnow().replace(microsecond=0)
+        self.variants = variants
+    
+    def ensure_built(self):
+        # In debug mode re-render every time so template edits show up
+        if self.variants is None or app.debug:
+            with self.lock:
+                if self.variants is None or app.debug:
+                    self._build()
+    
+    def negotiate(self, accept_encodings):
+        """Best stored encoding for a parsed Accept-Encoding header"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding] > 0:
+                return encoding
+        return 'identity'
+    
+    def response(self):
+        self.ensure_built()
+        encoding = self.negotiate(request.accept_encodings)
+        resp = Response(self.variants[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            resp.headers['Content-Encoding'] = encoding
+        resp.vary.add('Accept-Encoding')
+        resp.set_etag(f"{self.etag}-{encoding}")
+        resp.last_modified = self.last_modified
+        resp.cache_control.no_cache = True
+        return resp.make_conditional(request)
+
+landing_page = CachedPage('public/home.html')
+
+# ============ BATCH TRACKING ============
+TRACK_BATCH_MAX = 50
+TRACK_EVENT_TYPES = {'click'}  # engagement event types get added here
+
+# Keys this worker has already queued; the unique column is the real guard
+recent_event_keys = LRUCache(100000, 86400)
+
+def valid_batch_event(event):
+    """Shape check for one /track/batch event"""
+    return (
+        isinstance(event, dict)
+        and event.get('type') in TRACK_EVENT_TYPES
+        and isinstance(event.get('id'), str) and 0 < len(event['id']) <= 64
+        and isinstance(event.get('plan'), str) and 0 < len(event['plan']) <= 20
+    )
+
+# ============ METRICS ============
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Every gunicorn worker counts only its own requests, and a scrape lands on
+# whichever worker accepts it - so served as-is the counters would jump
+# between workers' values and Prometheus would see resets. Instead each
+# worker writes its samples to METRICS_DIR/<master pid>/<pid>.json every
+# METRICS_DUMP_INTERVAL seconds (and when it answers a scrape), and
+# /admin/metrics sums the files of all workers under the same master. A dead
+# worker's file is kept so its counts never disappear (its gauges are
+# dropped); a restart of the master starts a fresh directory. Set
+# METRICS_DIR= (empty) to serve per-process values.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'tradepass-metrics'))
+METRICS_DUMP_INTERVAL = float(os.environ.get('METRICS_DUMP_INTERVAL', 5))
+
+class MetricsRegistry:
+    """Counters and histograms, rendered as Prometheus text.
+    
+    Values are recorded per process and summed across the workers of one
+    server on render (see METRICS_DIR).
+    """
+    
+    def __init__(self, directory=None, dump_interval=METRICS_DUMP_INTERVAL):
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.dumper_pid = None
+        self.lock = threading.Lock()
+        self.types = {}
+        self.help = {}
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [per-bucket counts, sum, count]
+        self.buckets = {}
+        self.collectors = []  # callables returning [(name, type, help, labels, value)]
+    
+    def counter(self, name, description):
+        self.types[name] = 'counter'
+        self.help[name] = description
+    
+    def histogram(self, name, description, buckets):
+        self.types[name] = 'histogram'
+        self.help[name] = description
+        self.buckets[name] = buckets
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._start_dumper()
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets[name]
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+        self._start_dumper()
+    
+    def _start_dumper(self):
+        """Start this process's dump thread (once per process - workers fork)"""
+        if self.directory and self.dumper_pid != os.getpid():
+            with self.lock:
+                if self.dumper_pid == os.getpid():
+                    return
+                self.dumper_pid = os.getpid()
+            threading.Thread(target=self._dump_loop, name='metrics-dump', daemon=True).start()
+    
+    def _dump_loop(self):
+        while True:
+            time.sleep(self.dump_interval)
+            try:
+                self.dump()
+            except Exception as e:
+                log.warning(f"⚠️ Metrics dump failed: {e}")
+    
+    def samples(self):
+        """This process's counters, histograms and collector samples, JSON-serialisable"""
+        with self.lock:
+            counters = [[name, labels, value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, labels, list(h[0]), h[1], h[2]] for (name, labels), h in self.histograms.items()]
+        collected = [
+            [name, kind, description, tuple(sorted(labels.items())), value]
+            for collect in self.collectors
+            for name, kind, description, labels, value in collect()
+        ]
+        return {'counters': counters, 'histograms': histograms, 'collected': collected}
+    
+    def worker_dir(self):
+        return os.path.join(self.directory, str(os.getppid()))
+    
+    def dump(self):
+        """Write this process's samples where the other workers' scrapes can read them"""
+        os.makedirs(self.worker_dir(), exist_ok=True)
+        path = os.path.join(self.worker_dir(), f"{os.getpid()}.json")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.samples(), f)
+        os.replace(path + '.tmp', path)
+    
+    def remove_stale_dirs(self):
+        """Drop the files of servers (masters) that are no longer running"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.isdigit() and int(name) != os.getppid() and not _process_alive(int(name)):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+    
+    def merged_samples(self):
+        """Samples summed over every worker of this server (just this process without a directory)"""
+        if not self.directory:
+            return self.samples()
+        self.dump()
+        
+        counters, histograms, collected = {}, {}, {}
+        for name in sorted(os.listdir(self.worker_dir())):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.worker_dir(), name), encoding='utf-8') as f:
+                    worker = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(int(name[:-len('.json')]))
+            for metric, labels, value in worker['counters']:
+                key = (metric, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for metric, labels, counts, total, count in worker['histograms']:
+                key = (metric, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+            for metric, kind, description, labels, value in worker['collected']:
+                if kind == 'gauge' and not alive:
+                    continue
+                key = (metric, tuple(map(tuple, labels)))
+                previous = collected.get(key, (kind, description, 0))
+                collected[key] = (kind, description, previous[2] + value)
+        return {
+            'counters': [[metric, labels, value] for (metric, labels), value in counters.items()],
+            'histograms': [[metric, labels, *h] for (metric, labels), h in histograms.items()],
+            'collected': [[metric, kind, description, labels, value]
+                          for (metric, labels), (kind, description, value) in collected.items()]
+        }
+    
+    def render(self):
+        samples = self.merged_samples()
+        lines = []
+        
+        def fmt(name, labels, value):
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+        
+        def header(name, kind, description):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        counters = sorted(((name, labels), value) for name, labels, value in samples['counters'])
+        histograms = sorted(
+            (((name, labels), (counts, total, count)) for name, labels, counts, total, count in samples['histograms']),
+            key=lambda item: item[0]
+        )
+        
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                header(name, 'counter', self.help[name])
+                seen.add(name)
+            lines.append(fmt(name, labels, value))
+        
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in seen:
+                header(name, 'histogram', self.help[name])
+                seen.add(name)
+            for bound, bucket_count in zip(self.buckets[name], counts):
+                lines.append(fmt(f"{name}_bucket", labels + (('le', bound),), bucket_count))
+            lines.append(fmt(f"{name}_bucket", labels + (('le', '+Inf'),), count))
+            lines.append(fmt(f"{name}_sum", labels, round(total, 6)))
+            lines.append(fmt(f"{name}_count", labels, count))
+        
+        for name, kind, description, labels, value in samples['collected']:
+            if name not in seen:
+                header(name, kind, description)
+                seen.add(name)
+            lines.append(fmt(name, labels, value))
+        
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry(METRICS_DIR or None)
+if metrics.directory:
+    metrics.remove_stale_dirs()
+metrics.counter('tradepass_requests_total', 'HTTP requests by route, method and status')
+metrics.histogram('tradepass_request_seconds', 'Request latency by route', LATENCY_BUCKETS)
+metrics.histogram('tradepass_request_sql_queries', 'SQL statements per request by route', QUERY_COUNT_BUCKETS)
+metrics.counter('tradepass_sql_queries_total', 'SQL statements by route (background for the ingest writer)')
+metrics.counter('tradepass_sql_seconds_total', 'Time spent in SQL statements by route')
+metrics.counter('tradepass_sql_slow_queries_total', f'SQL statements slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms)')
+metrics.counter('tradepass_db_commits_total', 'Database commits')
+
+def _route_label():
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return 'background'
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+
+@app.after_request
+def _record_request_metrics(response):
+    if 'request_started' in g:
+        route = _route_label()
+        metrics.inc('tradepass_requests_total', route=route, method=request.method, status=response.status_code)
+        metrics.observe('tradepass_request_seconds', time.perf_counter() - g.request_started, route=route)
+        metrics.observe('tradepass_request_sql_queries', g.sql_queries, route=route)
+    return response
+
+# The read engine keeps admin reports off the writer's connections and locks,
+# but a report still runs on one of the worker's threads and shares its CPU
+# and GIL with / and /track. Each worker runs at most ADMIN_READ_SLOTS reports
+# at once (0 = no cap). Up to ADMIN_READ_QUEUE more wait ADMIN_READ_WAIT
+# seconds for a slot, and the rest get 503 + Retry-After. So reports hold at
+# most SLOTS + QUEUE threads; keep that below gunicorn's --threads. The slot
+# goes back at teardown, which for streamed pages and exports
+# (stream_with_context) only runs once the last chunk is sent or the client
+# goes away, so a long export keeps dashboard rebuilds waiting; more slots
+# fix that at the cost of /track latency (bench.py read-isolation). A
+# dashboard served from its cache, or a 304, doesn't need a slot.
+ADMIN_READ_SLOTS = int(os.environ.get('ADMIN_READ_SLOTS', 1))
+ADMIN_READ_QUEUE = int(os.environ.get('ADMIN_READ_QUEUE', 1))
+ADMIN_READ_WAIT = float(os.environ.get('ADMIN_READ_WAIT', 2))
+# admin_dashboard takes its slot itself, and only when it has to rebuild
+ADMIN_READ_ENDPOINTS = {
+    'admin_export', 'admin_traffic', 'admin_visits', 'admin_uniques', 'admin_attribution',
+    'admin_visitors', 'admin_clicks',
+}
+
+class ReadSlots:
+    """Semaphore with a bounded number of waiters, each waiting at most `wait` seconds"""
+    
+    def __init__(self, slots, queue, wait):
+        self.slots = threading.BoundedSemaphore(slots)
+        self.queue = threading.BoundedSemaphore(queue) if queue else None
+        self.wait = wait
+    
+    def acquire(self):
+        if self.slots.acquire(blocking=False):
+            return True
+        if self.queue is None or not self.queue.acquire(blocking=False):
+            return False
+        try:
+            return self.slots.acquire(timeout=self.wait)
+        finally:
+            self.queue.release()
+    
+    def release(self):
+        self.slots.release()
+
+admin_read_slots = ReadSlots(ADMIN_READ_SLOTS, ADMIN_READ_QUEUE, ADMIN_READ_WAIT) if ADMIN_READ_SLOTS else None
+metrics.counter('tradepass_admin_reads_rejected_total', 'Admin reports turned away because every ADMIN_READ_SLOTS slot stayed busy')
+
+def take_admin_read_slot():
+    """Hold one of this worker's report slots until the request ends; False if none freed up in time"""
+    if admin_read_slots is None:
+        return True
+    if not admin_read_slots.acquire():
+        metrics.inc('tradepass_admin_reads_rejected_total', route=_route_label())
+        return False
+    g.admin_read_slot = True
+    return True
+
+def admin_reads_busy():
+    return Response('Too many admin reports running, retry shortly\n', status=503,
+                    mimetype='text/plain', headers={'Retry-After': '1'})
+
+@app.before_request
+def _take_admin_read_slot():
+    if request.endpoint in ADMIN_READ_ENDPOINTS and not take_admin_read_slot():
+        return admin_reads_busy()
+
+@app.teardown_request
+def _release_admin_read_slot(exc):
+    if g.pop('admin_read_slot', False):
+        admin_read_slots.release()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query_metrics(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    route = _route_label()
+    metrics.inc('tradepass_sql_queries_total', route=route)
+    metrics.inc('tradepass_sql_seconds_total', elapsed, route=route)
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.inc('tradepass_sql_slow_queries_total', route=route)
+        log.warning(f"🐢 Slow query ({elapsed * 1000:.1f} ms, {route}): {' '.join(statement.split())[:500]}")
+
+@event.listens_for(Engine, 'commit')
+def _count_commit(conn):
+    metrics.inc('tradepass_db_commits_total')
+
+def _collect_runtime_gauges():
+    """Ingest queue, visitor cache and logger state at scrape time"""
+    ingest_stats = ingest.snapshot()
+    cache_stats = visitor_cache.snapshot()
+    return [
+        ('tradepass_ingest_queue_depth', 'gauge', 'Events waiting in the ingest queue', {}, ingest_stats['queue_depth']),
+        ('tradepass_ingest_events_total', 'counter', 'Events written by the ingest writer', {}, ingest_stats['written']),
+        ('tradepass_ingest_inline_writes_total', 'counter', 'Events written inline because the queue was full', {}, ingest_stats['inline_writes']),
+        ('tradepass_ingest_flush_errors_total', 'counter', 'Failed ingest flushes', {}, ingest_stats['errors']),
+        ('tradepass_ingest_dead_lettered_total', 'counter', 'Events spilled to the dead-letter file after failed writes', {}, ingest_stats['dead_lettered']),
+        ('tradepass_ingest_replayed_total', 'counter', 'Dead-lettered events written back', {}, ingest_stats['replayed']),
+        ('tradepass_ingest_flushes_total', 'counter', 'Ingest flushes', {}, ingest_stats['flushes']),
+        ('tradepass_ingest_flush_seconds_total', 'counter', 'Time spent in ingest flushes', {}, round(ingest_stats['total_flush_ms'] / 1000, 6)),
+        ('tradepass_visitor_cache_lookups_total', 'counter', 'Visitor cache lookups by result', {'result': 'hit'}, cache_stats['hits']),
+        ('tradepass_visitor_cache_lookups_total', 'counter', 'Visitor cache lookups by result', {'result': 'miss'}, cache_stats['misses']),
+        ('tradepass_visitor_cache_evictions_total', 'counter', 'Visitor cache LRU evictions', {}, cache_stats['evictions']),
+        ('tradepass_visitor_cache_size', 'gauge', 'Entries in the visitor cache', {}, cache_stats['size']),
+        ('tradepass_log_records_dropped_total', 'counter', 'Log records dropped because the log queue was full', {}, log_handler.dropped),
+    ]
+
+metrics.collectors.append(_collect_runtime_gauges)
+
+# ============ TRAFFIC FILTER ============
+# Runs before resolve_visitor(), so dropped traffic costs no database I/O:
+# bots by User-Agent, per-ip_hash token buckets for visits and clicks, and
+# repeats of the same plan click from one IP within CLICK_DEDUPE_SECONDS.
+# Buckets live in process memory (per gunicorn worker) unless
+# RATE_LIMIT_REDIS_URL points them at a shared Redis. They are keyed on the
+# client IP, which is only the real client when PROXY_FIX_HOPS matches the
+# proxies in front of the app - otherwise all traffic shares one bucket.
+VISIT_RATE_BURST = float(os.environ.get('VISIT_RATE_BURST', 30))
+VISIT_RATE_PER_SEC = float(os.environ.get('VISIT_RATE_PER_SEC', 0.5))
+CLICK_RATE_BURST = float(os.environ.get('CLICK_RATE_BURST', 20))
+CLICK_RATE_PER_SEC = float(os.environ.get('CLICK_RATE_PER_SEC', 0.2))
+CLICK_DEDUPE_SECONDS = float(os.environ.get('CLICK_DEDUPE_SECONDS', 5))
+RATE_LIMIT_KEYS = int(os.environ.get('RATE_LIMIT_KEYS', 100000))
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL')
+
+class TokenBuckets:
+    """Per-key token buckets in process memory; the least recently used keys
+    are forgotten beyond maxsize (a forgotten key starts with a full bucket)"""
+    
+    def __init__(self, name, rate, burst, maxsize=RATE_LIMIT_KEYS):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self.lock = threading.Lock()
+    
+    def allow(self, key, cost=1):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+            return allowed
+
+class RedisTokenBuckets(TokenBuckets):
+    """The same buckets kept in Redis, shared by every worker and instance.
+    
+    Fails open: if Redis is unreachable, traffic is let through rather than
+    tracking going down with it.
+    """
+    
+    SCRIPT = """
+    local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return allowed
+    """
+    
+    def __init__(self, name, rate, burst, url):
+        super().__init__(name, rate, burst)
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05)
+        self.script = self.client.register_script(self.SCRIPT)
+    
+    def allow(self, key, cost=1):
+        try:
+            return bool(self.script(keys=[f"tradepass:rate:{self.name}:{key}"],
+                                    args=[self.rate, self.burst, cost, time.time()]))
+        except redis.RedisError as e:
+            log.warning(f"⚠️ Rate limit store unavailable, allowing: {e}")
+            return True
+
+def make_buckets(name, rate, burst):
+    if RATE_LIMIT_REDIS_URL:
+        if redis is None:
+            raise RuntimeError('RATE_LIMIT_REDIS_URL is set but the redis package is not installed')
+        return RedisTokenBuckets(name, rate, burst, RATE_LIMIT_REDIS_URL)
+    return TokenBuckets(name, rate, burst)
+
+rate_limits = {'visit': make_buckets('visit', VISIT_RATE_PER_SEC, VISIT_RATE_BURST)}
+# Every /track/batch event type gets its own buckets at the click rates
+rate_limits.update(
+    (kind, make_buckets(kind, CLICK_RATE_PER_SEC, CLICK_RATE_BURST)) for kind in sorted(TRACK_EVENT_TYPES | {'click'})
+)
+click_dedupe = LRUCache(RATE_LIMIT_KEYS, CLICK_DEDUPE_SECONDS)  # (ip_hash, plan) -> True
+
+metrics.counter('tradepass_filtered_events_total', 'Visits/clicks dropped before reaching the database, by reason')
+
+def filter_event(kind, ip_hash, plan=None):
+    """None if a visit/click from the current request should be recorded, else why it is dropped"""
+    return drop_reason(kind, ip_hash, request.user_agent.string, plan)
+
+def drop_reason(kind, ip_hash, user_agent, plan=None):
+    """None if a visit/click should be recorded, else why it is dropped"""
+    if BOT_USER_AGENT.search(user_agent or ''):
+        reason = 'bot'
+    elif kind == 'click' and click_dedupe.get((ip_hash, plan)) is not None:
+        reason = 'duplicate'
+    elif kind in rate_limits and not rate_limits[kind].allow(ip_hash):
+        reason = 'rate_limit'
+    else:
+        if kind == 'click':
+            click_dedupe.put((ip_hash, plan), True)
+        return None
+    metrics.inc('tradepass_filtered_events_total', kind=kind, reason=reason)
+    return reason
+
 # ============ PUBLIC ROUTES ============
 @app.route('/')
 def home():
@@ -100,31 +1869,17 @@ def home():
     ip = request.remote_addr or '127.0.0.1'
     ip_hash = hash_ip(ip)
     
-    # Check if visitor already exists
-    visitor = Visitor.query.filter_by(ip_hash=ip_hash).first()
+    # Bots and rapid reloads still get the page, just aren't recorded
+    if filter_event('visit', ip_hash):
+        return landing_page.response()
     
-    if visitor:
-        # Update last visit time
-        visitor.last_visit = datetime.utcnow()
-        db.session.commit()
-        visitor_id = visitor.visitor_id
-    else:
-        # Create new visitor
-        visitor_id = get_visitor_id()
-        new_visitor = Visitor(
-            visitor_id=visitor_id,
-            ip_hash=ip_hash,
-            user_agent=request.user_agent.string,
-            referrer=request.referrer,
-            source=detect_source(request.referrer),
-            first_visit=datetime.utcnow(),
-            last_visit=datetime.utcnow()
-        )
-        db.session.add(new_visitor)
-        db.session.commit()
+    # Every page view lands in the visit log; new visitors are created by the writer
+    visitor_id, is_new = resolve_visitor(ip_hash)
+    event = make_event('visit', ip_hash, visitor_id)
+    ingest.put(event)
     
-    print(f"👤 Visitor tracked: {visitor_id} from {detect_source(request.referrer)}")
-    return render_template('public/home.html')
+    log.info(f"👤 Visitor tracked: {visitor_id} from {event['source']}")
+    return landing_page.response()
 
 @app.route('/track', methods=['POST'])
 def track_click():
@@ -138,50 +1893,27 @@ def track_click():
         ip = request.remote_addr or '127.0.0.1'
         ip_hash = hash_ip(ip)
         
-        # Find visitor
-        visitor = Visitor.query.filter_by(ip_hash=ip_hash).first()
+        dropped = filter_event('click', ip_hash, plan)
+        if dropped == 'rate_limit':
+            return jsonify({'success': False, 'error': 'Too many requests'}), 429
+        if dropped:
+            return jsonify({'success': True, 'plan': plan, 'message': 'Click ignored'})
         
-        if visitor:
-            # Create click record
-            click = Click(
-                visitor_id=visitor.visitor_id,
-                ip_hash=ip_hash,
-                plan=plan,
-                click_id=str(uuid.uuid4())[:8]
-            )
-            db.session.add(click)
-            db.session.commit()
-            
-            print(f"🖱️ Buy click: {visitor.visitor_id} -> {plan}")
+        # Find visitor (or allocate one - the writer creates it with the click)
+        visitor_id, is_new = resolve_visitor(ip_hash)
+        ingest.put(make_event('click', ip_hash, visitor_id, plan=plan))
+        
+        if not is_new:
+            log.info(f"🖱️ Buy click: {visitor_id} -> {plan}")
             
             return jsonify({
                 'success': True,
-                'visitor_id': visitor.visitor_id,
+                'visitor_id': visitor_id,
                 'plan': plan,
                 'message': 'Click tracked successfully'
             })
         else:
-            # Create visitor first, then track click
-            visitor_id = get_visitor_id()
-            new_visitor = Visitor(
-                visitor_id=visitor_id,
-                ip_hash=ip_hash,
-                user_agent=request.user_agent.string,
-                referrer=request.referrer,
-                source=detect_source(request.referrer)
-            )
-            db.session.add(new_visitor)
-            
-            click = Click(
-                visitor_id=visitor_id,
-                ip_hash=ip_hash,
-                plan=plan,
-                click_id=str(uuid.uuid4())[:8]
-            )
-            db.session.add(click)
-            db.session.commit()
-            
-            print(f"👤➕🖱️ New visitor with click: {visitor_id} -> {plan}")
+            log.info(f"👤➕🖱️ New visitor with click: {visitor_id} -> {plan}")
             
             return jsonify({
                 'success': True,
@@ -191,14 +1923,1322 @@ def track_click():
             })
             
     except Exception as e:
-        print(f"❌ Tracking error: {str(e)}")
+        log.error(f"❌ Tracking error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/track/batch', methods=['POST'])
+def track_batch():
+    """Track a batch of client events (sent with navigator.sendBeacon).
+    
+    Body: {"events": [{"type": "click", "plan": "plan_149", "id": "<uuid>"}, ...]}
+    Each event's id is an idempotency key - a batch that is retried after a
+    lost response is only counted once.
+    """
+    data = request.get_json(force=True, silent=True)
+    events = data.get('events') if isinstance(data, dict) else None
+    if not isinstance(events, list) or not events or len(events) > TRACK_BATCH_MAX:
+        return jsonify({'success': False, 'error': f'Expected 1-{TRACK_BATCH_MAX} events'}), 400
+    
+    # Validate the whole batch up front, then drop repeated keys
+    valid = [e for e in events if valid_batch_event(e)]
+    unique = {e['id']: e for e in valid}
+    fresh = [e for key, e in unique.items() if recent_event_keys.get(key) is None]
+    
+    ip_hash = hash_ip(request.remote_addr or '127.0.0.1')
+    accepted = [e for e in fresh if not filter_event(e['type'], ip_hash, e['plan'])]
+    filtered = len(fresh) - len(accepted)
+    fresh = accepted
+    
+    if fresh:
+        visitor_id, is_new = resolve_visitor(ip_hash)
+        recent_event_keys.put_many({e['id']: True for e in fresh})
+        for e in fresh:
+            ingest.put(make_event(e['type'], ip_hash, visitor_id, plan=e['plan'], key=e['id']))
+        log.info(f"🖱️ Batch: {visitor_id} -> {len(fresh)} events")
+    
+    return jsonify({
+        'success': True,
+        'accepted': len(fresh),
+        'duplicates': len(valid) - len(fresh) - filtered,
+        'filtered': filtered,
+        'rejected': len(events) - len(valid)
+    })
+
 @app.route('/coming-soon')
 def coming_soon():
     """Coming soon page"""
     return "<h1>Coming Soon or technical issue</h1>"
 
+# ============ ADMIN PAGINATION ============
+# The admin lists page with a keyset cursor "<sort timestamp>~<row id>"
+# instead of OFFSET, so every page costs the same no matter how deep it is.
+ADMIN_PAGE_SIZE = 100
+ADMIN_PAGE_MAX = 1000
+ADMIN_STREAM_MAX = 100000
+ADMIN_STREAM_CHUNK = 500
+
+def encode_cursor(sort_value, row_id):
+    return f"{sort_value.isoformat()}~{row_id}"
+
+def decode_cursor(cursor):
+    """Parse a cursor back into (timestamp, id); raises ValueError if malformed"""
+    sort_value, row_id = cursor.split('~')
+    return datetime.fromisoformat(sort_value), int(row_id)
+
+def page_args():
+    """(cursor, limit, stream) from the query string; raises ValueError on bad input"""
+    stream = request.args.get('stream') == '1'
+    cursor = request.args.get('cursor')
+    cursor = decode_cursor(cursor) if cursor else None
+    limit = int(request.args.get('limit', ADMIN_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return cursor, min(limit, ADMIN_STREAM_MAX if stream else ADMIN_PAGE_MAX), stream
+
+def render_page(template, name, rows, stream, limit, sort_key):
+    """Render one page of (row, item) pairs.
+    
+    Normal mode collects the page and passes next_cursor for the following
+    page. Stream mode hands the template a generator, so rows go out as they
+    are read and the page is never held in memory (no next_cursor, since the
+    last row isn't known until the end).
+    """
+    context = dict(logged_in=True, admin_email=session.get('admin_email', 'Admin'))
+    
+    if stream:
+        context[name] = (item for row, item in rows)
+        return Response(stream_template(template, **context))
+    
+    page = list(rows)
+    context[name] = [item for row, item in page]
+    context['next_cursor'] = encode_cursor(*sort_key(page[-1][0])) if len(page) == limit else None
+    return render_template(template, **context)
+
+# ============ DATA EXPORT ============
+# Bulk export for offline analysis. Rows are read in keyset-ordered chunks,
+# each on a short-lived connection, and written out as they are formatted, so
+# memory stays flat however large the tables are. since= filters on
+# last_visit/timestamp; a visitor updated mid-export can appear twice.
+EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN')
+EXPORT_CHUNK = 2000
+
+EXPORT_COLUMNS = {
+    'visitors': (Visitor, Visitor.last_visit, [
+        Visitor.visitor_id, Visitor.ip_hash, Visitor.source, Referrer.value.label('referrer'),
+        UserAgent.value.label('user_agent'), Visitor.first_visit, Visitor.last_visit
+    ]),
+    'clicks': (Click, Click.timestamp, [
+        Click.click_id, Click.visitor_id, Click.ip_hash, Click.plan, Click.timestamp
+    ])
+}
+
+def export_query(kind):
+    """SELECT id + the export columns of `kind`, with interned strings joined back in"""
+    model, sort_col, columns = EXPORT_COLUMNS[kind]
+    query = select(model.id, *columns).select_from(model)
+    if model is Visitor:
+        query = (
+            query.outerjoin(Referrer, Referrer.id == Visitor.referrer_id)
+            .outerjoin(UserAgent, UserAgent.id == Visitor.user_agent_id)
+        )
+    return query
+
+def export_rows(kind, since=None, engine=None):
+    """Yield every row of an export in (sort column, id) order, one chunk at a time"""
+    model, sort_col, columns = EXPORT_COLUMNS[kind]
+    engine = engine or read_engine()
+    cursor = None
+    
+    while True:
+        query = (
+            export_query(kind)
+            .order_by(sort_col, model.id)
+            .limit(EXPORT_CHUNK)
+        )
+        if since:
+            query = query.where(sort_col >= since)
+        if cursor:
+            query = query.where(tuple_(sort_col, model.id) > cursor)
+        
+        with engine.connect() as conn:
+            rows = conn.execute(query).all()
+        yield from rows
+        
+        if len(rows) < EXPORT_CHUNK:
+            return
+        cursor = (getattr(rows[-1], sort_col.key), rows[-1].id)
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def format_csv(kind, rows):
+    """CSV lines (header first), flushed every EXPORT_CHUNK rows"""
+    names = [c.key for c in EXPORT_COLUMNS[kind][2]]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_export_value(getattr(row, name)) for name in names])
+        if i % EXPORT_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def format_ndjson(kind, rows):
+    """One JSON object per line"""
+    names = [c.key for c in EXPORT_COLUMNS[kind][2]]
+    for row in rows:
+        yield json.dumps({name: _export_value(getattr(row, name)) for name in names}) + '\n'
+
+EXPORT_FORMATS = {
+    'csv': (format_csv, 'text/csv'),
+    'ndjson': (format_ndjson, 'application/x-ndjson')
+}
+
+def check_token_auth(token):
+    """Admin session, or 'Authorization: Bearer <token>' for scripts"""
+    if check_admin():
+        return True
+    # Compared as bytes: compare_digest() raises on non-ASCII str
+    auth = request.headers.get('Authorization', '').encode('utf-8')
+    return bool(token) and hmac.compare_digest(auth, f"Bearer {token}".encode('utf-8'))
+
+@app.route('/admin/export/<kind>')
+def admin_export(kind):
+    """Stream visitors or clicks as CSV/NDJSON (?format=csv|ndjson, ?since=ISO time)"""
+    if not check_token_auth(EXPORT_TOKEN):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    fmt = request.args.get('format', 'ndjson')
+    if kind not in EXPORT_COLUMNS or fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': 'Unknown export'}), 404
+    
+    since = request.args.get('since')
+    try:
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid since'}), 400
+    
+    formatter, mimetype = EXPORT_FORMATS[fmt]
+    body = formatter(kind, export_rows(kind, since))
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="tradepass-{kind}.{fmt}"'
+    })
+
+# ============ DATA RETENTION ============
+# Raw clicks older than RETENTION_DAYS are moved to gzipped
+# NDJSON segments (the same format as the NDJSON export) and deleted from
+# the hot tables in small batches, each its own short transaction, so the
+# ingest writer never waits long for the SQLite write lock.
+#
+# The rollups already hold every archived row's counts. Each segment records
+# its cutoff, and rebuild-rollups/check-rollups leave buckets before the
+# latest cutoff alone, so dashboard totals are unchanged by archiving.
+# Visitor rows are never archived: they are the ip_hash -> visitor_id
+# identity that keeps a visitor returning after a year from being counted
+# again, and they are small (user agent and referrer are interned ids).
+# Their page views live in the visit log, whose old days are dropped.
+ARCHIVED_KINDS = ('clicks',)
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 180))
+RETENTION_BATCH = int(os.environ.get('RETENTION_BATCH', 500))
+RETENTION_PAUSE = float(os.environ.get('RETENTION_PAUSE', 0.05))
+RETENTION_VACUUM_PAGES = int(os.environ.get('RETENTION_VACUUM_PAGES', 2000))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+
+def archive_candidates(kind, cutoff):
+    """WHERE clause for rows of `kind` that are old enough to archive"""
+    return EXPORT_COLUMNS[kind][1] < cutoff
+
+def archive_kind(kind, cutoff, engine=None, batch=RETENTION_BATCH, pause=RETENTION_PAUSE):
+    """Move rows of `kind` from before `cutoff` into a new segment file; returns rows moved"""
+    model, sort_col, columns = EXPORT_COLUMNS[kind]
+    engine = engine or db.engine
+    table = model.__table__
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"{kind}-{cutoff:%Y%m%d}-{datetime.utcnow():%Y%m%dT%H%M%S}.ndjson.gz")
+    
+    segment_id = None
+    moved = 0
+    with open(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as out:
+        while True:
+            with engine.begin() as conn:
+                picked = conn.execute(
+                    export_query(kind).where(archive_candidates(kind, cutoff))
+                    .order_by(sort_col, model.id).limit(batch)
+                ).all()
+                if not picked:
+                    break
+                # The delete re-checks the condition and RETURNING says which
+                # rows really went, so only deleted rows reach the archive
+                deleted = set(conn.execute(
+                    delete(table)
+                    .where(table.c.id.in_([row.id for row in picked]), archive_candidates(kind, cutoff))
+                    .returning(table.c.id)
+                ).scalars())
+                rows = [row for row in picked if row.id in deleted]
+                if not rows:
+                    continue
+                
+                if segment_id is None:
+                    # Committed with the first delete, so the rollup watermark
+                    # is in place before any raw row is gone
+                    segment_id = conn.execute(
+                        insert(ArchiveSegment.__table__).values(kind=kind, path=path, cutoff=cutoff, rows=0)
+                    ).inserted_primary_key[0]
+                conn.execute(
+                    update(ArchiveSegment.__table__)
+                    .where(ArchiveSegment.id == segment_id)
+                    .values(rows=ArchiveSegment.rows + len(rows))
+                )
+                
+                for line in format_ndjson(kind, rows):
+                    out.write(line.encode('utf-8'))
+                # On disk before the delete commits
+                out.flush()
+                os.fsync(raw.fileno())
+            
+            moved += len(rows)
+            time.sleep(pause)
+    
+    if segment_id is None:
+        os.remove(path)
+    return moved
+
+def incremental_vacuum(engine=None, pages=RETENTION_VACUUM_PAGES):
+    """Return free SQLite pages to the OS a chunk at a time; returns pages freed"""
+    engine = engine or db.engine
+    if engine.dialect.name != 'sqlite':
+        return 0  # Postgres autovacuum reuses the space
+    freed = 0
+    with engine.connect() as conn:
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            return 0
+        while True:
+            before = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+            if not before:
+                break
+            conn.exec_driver_sql(f'PRAGMA incremental_vacuum({pages})')
+            conn.commit()
+            freed += before - conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+            time.sleep(RETENTION_PAUSE)
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    return freed
+
+@app.cli.command('archive')
+@click.option('--days', default=RETENTION_DAYS, show_default=True, help='Keep raw rows from the last N days')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would be archived')
+@click.option('--convert-vacuum', is_flag=True,
+              help='Run a one-off full VACUUM to switch an existing SQLite file to incremental auto-vacuum')
+def archive_command(days, dry_run, convert_vacuum):
+    """Archive and delete raw clicks (and drop visit log days) older than the retention window"""
+    # Midnight, so the watermark falls on an hourly and daily bucket edge
+    cutoff = datetime.combine(datetime.utcnow().date() - timedelta(days=days), datetime.min.time())
+    
+    # Fold the visit log into last_visit before its old days are dropped
+    with db.engine.begin() as conn:
+        refresh_visitor_profiles(conn)
+    
+    if dry_run:
+        with db.engine.connect() as conn:
+            for kind in ARCHIVED_KINDS:
+                model = EXPORT_COLUMNS[kind][0]
+                count = conn.execute(select(func.count(model.id)).where(archive_candidates(kind, cutoff))).scalar()
+                print(f"📦 {count} {kind} before {cutoff:%Y-%m-%d} would be archived")
+            days = visit_partition_days(conn, end=cutoff.date() - timedelta(days=1))
+            print(f"📦 {len(days)} visit log days before {cutoff:%Y-%m-%d} would be dropped")
+        return
+    
+    for kind in ARCHIVED_KINDS:
+        moved = archive_kind(kind, cutoff)
+        print(f"📦 Archived {moved} {kind} before {cutoff:%Y-%m-%d} to {ARCHIVE_DIR}")
+    with db.engine.begin() as conn:
+        days = drop_visit_partitions(conn, cutoff.date())
+    print(f"📦 Dropped {len(days)} visit log days before {cutoff:%Y-%m-%d}")
+    
+    if convert_vacuum and db.engine.dialect.name == 'sqlite':
+        # Rewrites the whole file under an exclusive lock - run it in a quiet moment
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+        print("🧹 Full VACUUM done, incremental auto-vacuum enabled")
+    print(f"🧹 Freed {incremental_vacuum()} pages")
+
+# ============ TRAFFIC ANALYTICS ============
+# Visits/clicks per hour or day, optionally split by source and/or plan,
+# summed from hourly_rollup/daily_rollup. A bucket is "closed" once it ended
+# more than TRAFFIC_CLOSE_GRACE seconds ago (long enough for the ingest writer
+# to have flushed it); closed buckets never change, so their rows are cached
+# per (bucket, dimensions, start). Open buckets are always read fresh.
+TRAFFIC_MAX_DAYS = int(os.environ.get('TRAFFIC_MAX_DAYS', 400))
+TRAFFIC_CLOSE_GRACE = int(os.environ.get('TRAFFIC_CLOSE_GRACE', 60))
+TRAFFIC_CACHE_SIZE = int(os.environ.get('TRAFFIC_CACHE_SIZE', 50000))
+TRAFFIC_DIMENSIONS = ('source', 'plan')
+TRAFFIC_BUCKETS = {
+    # bucket -> (rollup table, bucket column, step)
+    'hour': (HourlyRollup.__table__, 'hour', timedelta(hours=1)),
+    'day': (DailyRollup.__table__, 'day', timedelta(days=1)),
+}
+
+# The TTL only matters after a rebuild-rollups run in another worker
+traffic_cache = LRUCache(TRAFFIC_CACHE_SIZE, 86400)
+
+def bucket_floor(at, bucket):
+    """Start of the hour/day bucket containing a datetime"""
+    if bucket == 'day':
+        return at.date()
+    return at.replace(minute=0, second=0, microsecond=0)
+
+def bucket_starts(start, end, bucket):
+    """Start of every bucket overlapping [start, end)"""
+    step = TRAFFIC_BUCKETS[bucket][2]
+    t = start.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        t = t.replace(hour=0)
+    while t < end:
+        yield bucket_floor(t, bucket)
+        t += step
+
+def _fetch_buckets(conn, bucket, dims, first, last):
+    """{bucket start: [(dim values..., visits, clicks)]} for first..last, one GROUP BY"""
+    table, column, step = TRAFFIC_BUCKETS[bucket]
+    col = table.c[column]
+    dim_cols = [table.c[d] for d in dims]
+    rows = {}
+    for row in conn.execute(
+        select(col, *dim_cols, func.sum(table.c.visitors), func.sum(table.c.clicks))
+        .where(col >= first, col <= last)
+        .group_by(col, *dim_cols)
+    ):
+        rows.setdefault(row[0], []).append(tuple(row[1:]))
+    return rows
+
+def traffic_series(start, end, bucket='day', dims=(), now=None, engine=None):
+    """[{t, <dims>, visits, clicks}] for every bucket in [start, end)"""
+    now = now or datetime.utcnow()
+    dims = tuple(d for d in TRAFFIC_DIMENSIONS if d in dims)
+    closed_before = bucket_floor(now - timedelta(seconds=TRAFFIC_CLOSE_GRACE), bucket)
+    starts = list(bucket_starts(start, end, bucket))
+    
+    buckets = {}
+    missing = []
+    for t in starts:
+        rows = traffic_cache.get((bucket, dims, t)) if t < closed_before else None
+        if rows is None:
+            missing.append(t)
+        else:
+            buckets[t] = rows
+    
+    if missing:
+        with (engine or read_engine()).connect() as conn:
+            fetched = _fetch_buckets(conn, bucket, dims, missing[0], missing[-1])
+        closed = {}
+        for t in missing:
+            buckets[t] = fetched.get(t, [])
+            if t < closed_before:
+                closed[(bucket, dims, t)] = buckets[t]
+        traffic_cache.put_many(closed)
+    
+    series = []
+    for t in starts:
+        rows = buckets[t] or ([] if dims else [(0, 0)])
+        for row in rows:
+            point = {'t': t.isoformat()}
+            # '' is "no source" / "not a click" in the rollups
+            point.update((d, value or None) for d, value in zip(dims, row))
+            point['visits'], point['clicks'] = row[-2], row[-1]
+            series.append(point)
+    return series
+
+def _parse_traffic_time(value, default):
+    return datetime.fromisoformat(value) if value else default
+
+@app.route('/admin/api/traffic')
+def admin_traffic():
+    """Visits/clicks time series (?start=&end= ISO times, ?bucket=hour|day, ?by=source,plan)"""
+    if not check_token_auth(EXPORT_TOKEN):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    bucket = request.args.get('bucket', 'day')
+    dims = [d for d in request.args.get('by', '').split(',') if d]
+    if bucket not in TRAFFIC_BUCKETS or any(d not in TRAFFIC_DIMENSIONS for d in dims):
+        return jsonify({'success': False, 'error': 'Unknown bucket or dimension'}), 400
+    
+    now = datetime.utcnow()
+    try:
+        end = _parse_traffic_time(request.args.get('end'), now)
+        start = _parse_traffic_time(request.args.get('start'), end - timedelta(days=7))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid start/end'}), 400
+    if start.tzinfo or end.tzinfo:
+        return jsonify({'success': False, 'error': 'Use naive UTC times'}), 400
+    if not start < end or end - start > timedelta(days=TRAFFIC_MAX_DAYS):
+        return jsonify({'success': False, 'error': f'Range must be 0-{TRAFFIC_MAX_DAYS} days'}), 400
+    
+    return jsonify({
+        'success': True,
+        'bucket': bucket,
+        'by': [d for d in TRAFFIC_DIMENSIONS if d in dims],
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'series': traffic_series(start, end, bucket, dims, now=now)
+    })
+
+def _collect_traffic_cache():
+    stats = traffic_cache.snapshot()
+    return [
+        ('tradepass_traffic_cache_lookups_total', 'counter', 'Traffic API closed-bucket cache lookups by result', {'result': 'hit'}, stats['hits']),
+        ('tradepass_traffic_cache_lookups_total', 'counter', 'Traffic API closed-bucket cache lookups by result', {'result': 'miss'}, stats['misses']),
+        ('tradepass_traffic_cache_size', 'gauge', 'Buckets in the traffic API cache', {}, stats['size']),
+    ]
+
+metrics.collectors.append(_collect_traffic_cache)
+
+# ============ VISIT LOG ============
+# Every recorded page view is appended to a per-day table (visit_YYYYMMDD,
+# listed in visit_partition). Inserts are append-only and land at the end of
+# the current day's table; range queries only open the days they cover; and
+# the archive job expires a whole day with DROP TABLE instead of deleting
+# rows. Visitor.last_visit is a profile derived from the log: the ingest
+# writer folds new rows into it every PROFILE_REFRESH_SECONDS, one UPDATE
+# per visitor seen, however many pages they viewed.
+VISITS_MAX_DAYS = int(os.environ.get('VISITS_MAX_DAYS', 400))
+
+# Partition tables are created on demand, never by create_all()
+visit_log = MetaData()
+visit_log_lock = threading.Lock()
+known_partitions = set()  # days whose table this process has already created
+
+def visit_table(day):
+    """The Table for one day of the visit log"""
+    name = f"visit_{day:%Y%m%d}"
+    with visit_log_lock:
+        table = visit_log.tables.get(name)
+        if table is None:
+            table = Table(
+                name, visit_log,
+                db.Column('id', db.Integer, primary_key=True),
+                db.Column('visitor_id', db.String(20), nullable=False),
+                db.Column('source', db.String(50)),
+                db.Column('at', db.DateTime, nullable=False)
+            )
+        return table
+
+def ensure_visit_partitions(days, engine=None):
+    """Create the partitions for `days` that don't exist yet, in their own transaction"""
+    missing = sorted(set(days) - known_partitions)
+    if not missing:
+        return
+    with (engine or db.engine).begin() as conn:
+        # IF NOT EXISTS: another worker may create the same day at the same moment
+        for day in missing:
+            conn.execute(CreateTable(visit_table(day), if_not_exists=True))
+        conn.execute(
+            dialect_insert(VisitPartition.__table__, conn).on_conflict_do_nothing(
+                index_elements=[VisitPartition.__table__.c.day]
+            ),
+            [{'day': day, 'profiled_id': 0, 'sealed': False, 'created_at': datetime.utcnow()} for day in missing]
+        )
+    known_partitions.update(missing)
+
+def append_visits(conn, visits):
+    """Bulk-insert visit rows ({'visitor_id', 'source', 'at'}) into their day partitions"""
+    by_day = {}
+    for row in visits:
+        by_day.setdefault(row['at'].date(), []).append(row)
+    for day, rows in by_day.items():
+        conn.execute(insert(visit_table(day)), rows)
+
+def visit_partition_days(conn, start=None, end=None):
+    """Days with a partition, oldest first, limited to [start, end]"""
+    query = select(VisitPartition.day).order_by(VisitPartition.day)
+    if start is not None:
+        query = query.where(VisitPartition.day >= start)
+    if end is not None:
+        query = query.where(VisitPartition.day <= end)
+    return list(conn.execute(query).scalars())
+
+def refresh_visitor_profiles(conn, now=None):
+    """Fold visit log rows added since the last refresh into Visitor.last_visit;
+    returns the number of visitor rows updated"""
+    visitor_table = Visitor.__table__
+    partitions = VisitPartition.__table__
+    yesterday = (now or datetime.utcnow()).date() - timedelta(days=1)
+    updated = 0
+    for day, profiled_id in conn.execute(
+        select(partitions.c.day, partitions.c.profiled_id)
+        .where(partitions.c.sealed.is_(False)).order_by(partitions.c.day)
+    ).all():
+        table = visit_table(day)
+        # Rows past `top` belong to the next refresh, even if they commit meanwhile
+        top = conn.execute(select(func.max(table.c.id))).scalar() or 0
+        latest = conn.execute(
+            select(table.c.visitor_id, func.max(table.c.at))
+            .where(table.c.id > profiled_id, table.c.id <= top)
+            .group_by(table.c.visitor_id)
+        ).all()
+        if latest:
+            conn.execute(
+                update(visitor_table)
+                .where(visitor_table.c.visitor_id == bindparam('v'))
+                .where(or_(visitor_table.c.last_visit.is_(None), visitor_table.c.last_visit < bindparam('at')))
+                .values(last_visit=bindparam('at')),
+                [{'v': visitor_id, 'at': _as_datetime(at)} for visitor_id, at in latest]
+            )
+            updated += len(latest)
+        # A day that ended before yesterday gets no more writes
+        conn.execute(
+            update(partitions)
+            .where(partitions.c.day == day, partitions.c.profiled_id <= top)
+            .values(profiled_id=top, sealed=day < yesterday)
+        )
+    return updated
+
+def drop_visit_partitions(conn, before):
+    """DROP every visit log day before `before`; returns the days dropped"""
+    days = visit_partition_days(conn, end=before - timedelta(days=1))
+    for day in days:
+        conn.execute(DropTable(visit_table(day), if_exists=True))
+        known_partitions.discard(day)
+    if days:
+        conn.execute(delete(VisitPartition.__table__).where(VisitPartition.day < before))
+    return days
+
+def visits_per_day(conn, start, end, by_source=False):
+    """[{'day', 'visits', 'visitors'(, 'source')}] for each logged day in [start, end]"""
+    rows = []
+    for day in visit_partition_days(conn, start, end):
+        table = visit_table(day)
+        columns = [func.count(), func.count(table.c.visitor_id.distinct())]
+        if by_source:
+            query = select(table.c.source, *columns).group_by(table.c.source).order_by(table.c.source)
+            rows.extend(
+                {'day': day.isoformat(), 'source': source, 'visits': visits, 'visitors': visitors}
+                for source, visits, visitors in conn.execute(query)
+            )
+        else:
+            visits, visitors = conn.execute(select(*columns)).one()
+            rows.append({'day': day.isoformat(), 'visits': visits, 'visitors': visitors})
+    return rows
+
+@app.route('/admin/api/visits')
+def admin_visits():
+    """Page views and unique visitors per day from the visit log (?start=&end= ISO dates, ?by=source)"""
+    if not check_token_auth(EXPORT_TOKEN):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    by = request.args.get('by', '')
+    if by not in ('', 'source'):
+        return jsonify({'success': False, 'error': 'Unknown dimension'}), 400
+    
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid start/end'}), 400
+    if start > end or (end - start).days >= VISITS_MAX_DAYS:
+        return jsonify({'success': False, 'error': f'Range must be 1-{VISITS_MAX_DAYS} days'}), 400
+    
+    with read_engine().connect() as conn:
+        days = visits_per_day(conn, start, end, by_source=bool(by))
+    return jsonify({
+        'success': True,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'by': [by] if by else [],
+        'days': days
+    })
+
+# ============ UNIQUE COUNTS ============
+# Distinct visitors/clickers over any date range, split by source or plan,
+# without COUNT(DISTINCT) over raw rows. The writer adds every visitor ID it
+# stores to a HyperLogLog sketch per (kind, day, source, plan); a range is
+# answered by merging its daily sketches, and merging never double-counts a
+# visitor who came back on several days. Sketches are a few KB at most and
+# outlive the raw rows the archive job removes. They start with this change:
+# days before it have none.
+HLL_PRECISION = 12  # changing it invalidates every stored sketch
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_RANK_BITS = 64 - HLL_PRECISION
+HLL_STANDARD_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+UNIQUES_MAX_DAYS = int(os.environ.get('UNIQUES_MAX_DAYS', 400))
+UNIQUE_KINDS = ('visitors', 'clickers')
+UNIQUE_DIMENSIONS = ('day', 'source', 'plan')
+
+class HyperLogLog:
+    """Fixed-size distinct-count sketch: 2**HLL_PRECISION one-byte registers.
+    
+    The relative standard error is 1.04 / sqrt(registers) = 1.6%, so about
+    95% of estimates are within ±3.3% of the true count (and 99.7% within
+    ±4.9%), from a handful of items up to billions. count() uses Ertl's
+    improved estimator (arXiv:1702.01284), which needs no bias tables and
+    has no error bump where classic HLL switches to linear counting.
+    Merging keeps the register-wise max, which is exactly the sketch of
+    the union.
+    """
+    
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers else bytearray(HLL_REGISTERS)
+    
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = x >> HLL_RANK_BITS
+        rank = HLL_RANK_BITS - (x & ((1 << HLL_RANK_BITS) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+    
+    @classmethod
+    def union(cls, sketches):
+        registers = [sketch.registers for sketch in sketches]
+        if len(registers) < 2:
+            return cls(registers[0] if registers else None)
+        return cls(bytes(map(max, *registers)))
+    
+    def count(self):
+        m = len(self.registers)
+        histogram = [0] * (HLL_RANK_BITS + 2)
+        for rank, registers in Counter(self.registers).items():
+            histogram[rank] = registers
+        if histogram[0] == m:
+            return 0
+        
+        z = m * _hll_tau(1 - histogram[HLL_RANK_BITS + 1] / m)
+        for rank in range(HLL_RANK_BITS, 0, -1):
+            z = 0.5 * (z + histogram[rank])
+        z += m * _hll_sigma(histogram[0] / m)
+        return round(m * m / (2 * math.log(2) * z))
+    
+    def to_bytes(self):
+        # Mostly-empty sketches (a small source on a quiet day) shrink to a few dozen bytes
+        return zlib.compress(bytes(self.registers), 9)
+    
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(zlib.decompress(data))
+
+def _hll_sigma(x):
+    # Correction for empty registers (Ertl 2017, algorithm 6)
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+def _hll_tau(x):
+    # Correction for saturated registers (Ertl 2017, algorithm 6)
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+def add_to_sketch(sketches, kind, at, source, plan, visitor_id):
+    """Add a visitor ID to the pending sketch for its (kind, day, source, plan)"""
+    key = (kind, at.date(), source or '', plan or '')
+    sketch = sketches.get(key)
+    if sketch is None:
+        sketch = sketches[key] = HyperLogLog()
+    sketch.add(visitor_id)
+
+def merge_sketches(conn, sketches):
+    """Merge pending sketches into unique_sketch within the caller's transaction"""
+    if not sketches:
+        return
+    table = UniqueSketch.__table__
+    key_columns = [table.c.kind, table.c.day, table.c.source, table.c.plan]
+    empty = HyperLogLog().to_bytes()
+    
+    # Make sure every row exists, then lock and read-merge-write them, so two
+    # writers merging into the same day can't overwrite each other's registers
+    conn.execute(
+        dialect_insert(table, conn).on_conflict_do_nothing(index_elements=key_columns),
+        [dict(zip(('kind', 'day', 'source', 'plan'), key), registers=empty) for key in sketches]
+    )
+    stored = {
+        (row.kind, row.day, row.source, row.plan): row.registers
+        for row in conn.execute(
+            select(table).where(table.c.day.in_({key[1] for key in sketches})).with_for_update()
+        )
+    }
+    conn.execute(
+        update(table)
+        .where(table.c.kind == bindparam('k'), table.c.day == bindparam('d'),
+               table.c.source == bindparam('s'), table.c.plan == bindparam('p'))
+        .values(registers=bindparam('r')),
+        [
+            {'k': kind, 'd': day, 's': source, 'p': plan,
+             'r': sketch.merge(HyperLogLog.from_bytes(stored[(kind, day, source, plan)])).to_bytes()}
+            for (kind, day, source, plan), sketch in sketches.items()
+        ]
+    )
+
+def unique_counts(conn, kind, start, end, by=None, source=None, plan=None):
+    """{dimension value: estimated distinct visitors} over [start, end] ({None: n} without `by`)"""
+    table = UniqueSketch.__table__
+    query = select(table.c.day, table.c.source, table.c.plan, table.c.registers).where(
+        table.c.kind == kind, table.c.day >= start, table.c.day <= end
+    )
+    if source is not None:
+        query = query.where(table.c.source == source)
+    if plan is not None:
+        query = query.where(table.c.plan == plan)
+    
+    groups = {}
+    for row in conn.execute(query):
+        key = getattr(row, by) if by else None
+        groups.setdefault(key, []).append(HyperLogLog.from_bytes(row.registers))
+    if not by and not groups:
+        return {None: 0}
+    return {key: HyperLogLog.union(sketches).count() for key, sketches in groups.items()}
+
+@app.route('/admin/api/uniques')
+def admin_uniques():
+    """Estimated distinct visitors/clickers (?kind=, ?start=&end= ISO dates, ?by=day|source|plan, ?source=, ?plan=)"""
+    if not check_token_auth(EXPORT_TOKEN):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    kind = request.args.get('kind', 'visitors')
+    by = request.args.get('by') or None
+    if kind not in UNIQUE_KINDS or (by and by not in UNIQUE_DIMENSIONS):
+        return jsonify({'success': False, 'error': 'Unknown kind or dimension'}), 400
+    
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid start/end'}), 400
+    if start > end or (end - start).days >= UNIQUES_MAX_DAYS:
+        return jsonify({'success': False, 'error': f'Range must be 1-{UNIQUES_MAX_DAYS} days'}), 400
+    
+    with read_engine().connect() as conn:
+        counts = unique_counts(conn, kind, start, end, by=by,
+                               source=request.args.get('source'), plan=request.args.get('plan'))
+    result = {
+        'success': True,
+        'kind': kind,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        # Relative error that ~95% of estimates stay within
+        'error_bound': round(2 * HLL_STANDARD_ERROR, 4),
+    }
+    if by:
+        result['by'] = by
+        result['counts'] = [
+            {by: key.isoformat() if isinstance(key, date) else key, 'uniques': n}
+            for key, n in sorted(counts.items())
+        ]
+    else:
+        result['uniques'] = counts[None]
+    return jsonify(result)
+
+# ============ ATTRIBUTION ============
+# Which channel brings the visitors who go on to click which plan. Visitors
+# form cohorts by the day and detect_source() channel of their first visit;
+# a cohort converts on a plan when its visitors click that plan within
+# ATTRIBUTION_WINDOW_DAYS of arriving. Every visitor is in exactly one
+# cohort, so days add up. A cohort day stops changing once its window has
+# passed: closed days are cached, and a report only queries the days that
+# are still open (or not cached yet), with two GROUP BY joins over the
+# whole span - never a query per visitor.
+ATTRIBUTION_WINDOW_DAYS = int(os.environ.get('ATTRIBUTION_WINDOW_DAYS', 7))
+ATTRIBUTION_MAX_DAYS = int(os.environ.get('ATTRIBUTION_MAX_DAYS', 400))
+ATTRIBUTION_CACHE_SIZE = int(os.environ.get('ATTRIBUTION_CACHE_SIZE', 5000))
+
+# The TTL only matters after clicks are re-imported or archived
+attribution_cache = LRUCache(ATTRIBUTION_CACHE_SIZE, 86400)
+
+def clicked_within(conn, days):
+    """SQL condition: the click came 0-`days` days after the visitor's first visit"""
+    if conn.dialect.name == 'sqlite':
+        lag = func.julianday(Click.timestamp) - func.julianday(Visitor.first_visit)
+        return (lag >= 0) & (lag < days)
+    lag = Click.timestamp - Visitor.first_visit
+    return (lag >= timedelta(0)) & (lag < timedelta(days=days))
+
+def _as_date(value):
+    # date() comes back as a string on SQLite
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def _fetch_cohorts(conn, start, end):
+    """{day: ({source: (visitors, clickers)}, {(source, plan): (clickers, clicks)})} for cohort days [start, end]"""
+    arrived = (
+        (Visitor.first_visit >= datetime.combine(start, datetime.min.time()))
+        & (Visitor.first_visit < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    )
+    converted = clicked_within(conn, ATTRIBUTION_WINDOW_DAYS)
+    # One pass over the join: a row per (visitor, plan clicked) - or a single
+    # plan-less row for visitors who never clicked. The first row of each
+    # visitor counts them once towards the cohort and towards "clicked anything"
+    per_visitor = (
+        select(
+            func.date(Visitor.first_visit).label('day'),
+            Visitor.source,
+            Click.plan,
+            func.count(Click.id).label('clicks'),
+            case((func.count(Click.id) > 0, 1), else_=0).label('clicked'),
+            case((func.row_number().over(partition_by=Visitor.id, order_by=Click.plan) == 1, 1), else_=0).label('first')
+        )
+        .select_from(Visitor)
+        .outerjoin(Click, (Click.visitor_id == Visitor.visitor_id) & converted)
+        .where(arrived)
+        .group_by(Visitor.id, Click.plan)
+        .subquery()
+    )
+    days = {}
+    for day, source, plan, visitors, clickers, first_clickers, clicks in conn.execute(
+        select(
+            per_visitor.c.day, per_visitor.c.source, per_visitor.c.plan,
+            func.sum(per_visitor.c.first), func.sum(per_visitor.c.clicked),
+            func.sum(per_visitor.c.first * per_visitor.c.clicked), func.sum(per_visitor.c.clicks)
+        )
+        .group_by(per_visitor.c.day, per_visitor.c.source, per_visitor.c.plan)
+    ):
+        sources, pairs = days.setdefault(_as_date(day), ({}, {}))
+        source = source or ''
+        seen, converted_any = sources.get(source, (0, 0))
+        sources[source] = (seen + int(visitors), converted_any + int(first_clickers))
+        if clickers:
+            pairs[(source, plan or '')] = (int(clickers), int(clicks))
+    return days
+
+def _attribution_row(visitors, clickers, clicks, revenue):
+    return {
+        'visitors': visitors,
+        'clickers': clickers,
+        'clicks': clicks,
+        'conversion_rate': round(clickers / visitors * 100, 2) if visitors else 0,
+        'revenue': revenue
+    }
+
+def attribution_report(start, end, now=None, engine=None):
+    """Per-source, per-plan and per-(source, plan) conversion for visitors who arrived on days [start, end]"""
+    now = now or datetime.utcnow()
+    # Day D is closed once D + 1 + window (and the ingest grace) is in the past
+    closed_before = (now - timedelta(days=ATTRIBUTION_WINDOW_DAYS, seconds=TRAFFIC_CLOSE_GRACE)).date()
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    
+    cohorts = {}
+    missing = []
+    for day in days:
+        cached = attribution_cache.get((day, ATTRIBUTION_WINDOW_DAYS)) if day < closed_before else None
+        if cached is None:
+            missing.append(day)
+        else:
+            cohorts[day] = cached
+    
+    if missing:
+        with (engine or read_engine()).connect() as conn:
+            fetched = _fetch_cohorts(conn, missing[0], missing[-1])
+        closed = {}
+        for day in missing:
+            cohorts[day] = fetched.get(day, ({}, {}))
+            if day < closed_before:
+                closed[(day, ATTRIBUTION_WINDOW_DAYS)] = cohorts[day]
+        attribution_cache.put_many(closed)
+    
+    by_source = {}  # source -> [visitors, clickers, clicks, revenue]
+    by_pair = {}    # (source, plan) -> [clickers, clicks]
+    for day in days:
+        sources, pairs = cohorts[day]
+        for source, (visitors, clickers) in sources.items():
+            totals = by_source.setdefault(source, [0, 0, 0, 0])
+            totals[0] += visitors
+            totals[1] += clickers
+        for key, (clickers, clicks) in pairs.items():
+            counts = by_pair.setdefault(key, [0, 0])
+            counts[0] += clickers
+            counts[1] += clicks
+    
+    by_plan = {}  # plan -> [clickers, clicks]; a visitor has one source, so clickers add up across sources
+    breakdown = []
+    for (source, plan), (clickers, clicks) in sorted(by_pair.items()):
+        revenue = clicks * PLAN_PRICES.get(plan, 0)
+        totals = by_source.setdefault(source, [0, 0, 0, 0])
+        totals[2] += clicks
+        totals[3] += revenue
+        plan_totals = by_plan.setdefault(plan, [0, 0])
+        plan_totals[0] += clickers
+        plan_totals[1] += clicks
+        breakdown.append(dict(
+            {'source': source or None, 'plan': plan or None},
+            **_attribution_row(by_source[source][0], clickers, clicks, revenue)
+        ))
+    
+    total_visitors = sum(totals[0] for totals in by_source.values())
+    return {
+        'window_days': ATTRIBUTION_WINDOW_DAYS,
+        'totals': _attribution_row(total_visitors, *[sum(totals[i] for totals in by_source.values()) for i in (1, 2, 3)]),
+        'sources': [
+            dict({'source': source or None}, **_attribution_row(*totals))
+            for source, totals in sorted(by_source.items(), key=lambda item: -item[1][3])
+        ],
+        'plans': [
+            dict({'plan': plan or None}, **_attribution_row(
+                total_visitors, clickers, clicks, clicks * PLAN_PRICES.get(plan, 0)
+            ))
+            for plan, (clickers, clicks) in sorted(by_plan.items())
+        ],
+        'breakdown': breakdown
+    }
+
+@app.route('/admin/api/attribution')
+def admin_attribution():
+    """Source -> plan conversion for visitors who arrived in ?start=&end= (ISO dates, default last 30 days)"""
+    if not check_token_auth(EXPORT_TOKEN):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid start/end'}), 400
+    if start > end or (end - start).days >= ATTRIBUTION_MAX_DAYS:
+        return jsonify({'success': False, 'error': f'Range must be 1-{ATTRIBUTION_MAX_DAYS} days'}), 400
+    
+    return jsonify(dict(
+        {'success': True, 'start': start.isoformat(), 'end': end.isoformat()},
+        **attribution_report(start, end)
+    ))
+
+def _collect_attribution_cache():
+    stats = attribution_cache.snapshot()
+    return [
+        ('tradepass_attribution_cache_lookups_total', 'counter', 'Attribution report closed-day cache lookups by result', {'result': 'hit'}, stats['hits']),
+        ('tradepass_attribution_cache_lookups_total', 'counter', 'Attribution report closed-day cache lookups by result', {'result': 'miss'}, stats['misses']),
+        ('tradepass_attribution_cache_size', 'gauge', 'Cohort days in the attribution cache', {}, stats['size']),
+    ]
+
+metrics.collectors.append(_collect_attribution_cache)
+
+# ============ LIVE FEED ============
+# Server-sent events for the dashboard. One poller thread per process reads
+# new visitor/click rows (by primary key, so any worker's writes show up) and
+# the rollup counters, serialises them once and appends them to a bounded
+# ring buffer. Every /admin/live stream reads from that shared buffer, so N
+# watchers cost one poll per interval between them.
+#
+# Streams pull from the buffer at their own pace: a slow client only blocks
+# its own socket write, never the poller or other streams. A client that
+# falls behind the buffer is caught up from the database, or told to reload
+# if that is more than LIVE_BACKLOG rows. Event ids are "<visitor row
+# id>-<click row id>" cursors, so EventSource reconnects (Last-Event-ID)
+# resume on any worker.
+#
+# The feed is meant for the ASGI mode (asgi.py), where a stream sits on
+# a2wsgi's thread pool rather than a thread / and /track need. Under gunicorn
+# each open stream holds one of the worker's --threads, so the defaults
+# allow one stream per process. Streams end after LIVE_STREAM_SECONDS and
+# EventSource reconnects on its own (a refused one falls back to reloading).
+# The heartbeat is the only write on a quiet feed, so it is also how soon a
+# closed tab gives its thread back. asgi.py raises these defaults.
+LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 1.0))
+LIVE_BACKLOG = int(os.environ.get('LIVE_BACKLOG', 500))
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 1))
+LIVE_STREAM_SECONDS = int(os.environ.get('LIVE_STREAM_SECONDS', 60))
+LIVE_HEARTBEAT = float(os.environ.get('LIVE_HEARTBEAT', 5))
+LIVE_RETRY_MS = 3000
+
+def feed_position(conn):
+    """(last visitor row id, last click row id)"""
+    return (
+        conn.execute(select(func.max(Visitor.id))).scalar() or 0,
+        conn.execute(select(func.max(Click.id))).scalar() or 0
+    )
+
+def encode_feed_cursor(position):
+    return f"{position[0]}-{position[1]}"
+
+def decode_feed_cursor(value):
+    try:
+        visitor_row, click_row = (int(part) for part in value.split('-'))
+    except (AttributeError, ValueError):
+        return None
+    return visitor_row, click_row
+
+def sse_message(kind, data, event_id=None):
+    lines = [f"event: {kind}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {data}")
+    return '\n'.join(lines) + '\n\n'
+
+def feed_rows_since(conn, position, limit):
+    """(kind, row id, message) for up to `limit` visitors and `limit` clicks added
+    after a position, and whether that was all of them"""
+    visitor_row, click_row = position
+    visits = [
+        ('visit', row.id, sse_message('visit', json.dumps({
+            'visitor_id': row.visitor_id,
+            'source': row.source,
+            'time': row.first_visit.strftime('%H:%M')
+        })))
+        for row in conn.execute(
+            select(Visitor.id, Visitor.visitor_id, Visitor.source, Visitor.first_visit)
+            .where(Visitor.id > visitor_row).order_by(Visitor.id).limit(limit + 1)
+        )
+    ]
+    clicks = [
+        ('click', row.id, sse_message('click', json.dumps({
+            'plan': row.plan,
+            'visitor_id': row.visitor_id,
+            'ip_hash': row.ip_hash[:8] + '...'
+        })))
+        for row in conn.execute(
+            select(Click.id, Click.plan, Click.visitor_id, Click.ip_hash)
+            .where(Click.id > click_row).order_by(Click.id).limit(limit + 1)
+        )
+    ]
+    complete = len(visits) <= limit and len(clicks) <= limit
+    return visits[:limit] + clicks[:limit], complete
+
+def advance(position, kind, row_id):
+    visitor_row, click_row = position
+    if kind == 'visit':
+        return max(visitor_row, row_id), click_row
+    return visitor_row, max(click_row, row_id)
+
+class LiveFeed:
+    """Shared fan-out of new visits, clicks and counters for /admin/live.
+    
+    A poller thread runs while at least one stream is open. Streams keep
+    their own cursor into the ring buffer and wait on a condition for the
+    next poll that found something.
+    """
+    
+    def __init__(self, backlog, poll_interval, max_streams):
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        self.events = deque(maxlen=backlog)  # (kind, row id, message)
+        self.base = None      # position just before the oldest buffered event
+        self.position = None  # position of the newest buffered event
+        self.counters = None  # serialised counters message
+        self.version = 0
+        self.streams = 0
+        self.thread = None
+        self.cond = threading.Condition()
+        self.stats = {'polls': 0, 'poll_errors': 0, 'published': 0, 'rejected': 0, 'catchups': 0, 'resets': 0}
+    
+    def subscribe(self):
+        with self.cond:
+            if self.streams >= self.max_streams:
+                self.stats['rejected'] += 1
+                return False
+            self.streams += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='live-feed', daemon=True)
+                self.thread.start()
+            return True
+    
+    def unsubscribe(self):
+        with self.cond:
+            self.streams -= 1
+    
+    def _run(self):
+        with app.app_context():
+            while True:
+                with self.cond:
+                    if self.streams <= 0:
+                        self.thread = None
+                        return
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.stats['poll_errors'] += 1
+                    log.error(f"❌ Live feed poll failed: {e}")
+                time.sleep(self.poll_interval)
+    
+    def poll(self):
+        """Read rows added since the last poll and publish them with fresh counters"""
+        self.stats['polls'] += 1
+        with read_engine().connect() as conn:
+            position = self.position or feed_position(conn)
+            # Anything past the first maxlen rows of each kind goes out next poll
+            events, _ = feed_rows_since(conn, position, self.events.maxlen)
+            if not events and self.counters is not None:
+                return
+            counters = json.dumps(dashboard_counters(conn))
+        
+        with self.cond:
+            if self.position is None:
+                self.base = self.position = position
+            for kind, row_id, message in events:
+                if len(self.events) == self.events.maxlen:
+                    dropped_kind, dropped_row, _ = self.events[0]
+                    self.base = advance(self.base, dropped_kind, dropped_row)
+                self.events.append((kind, row_id, message))
+                self.position = advance(self.position, kind, row_id)
+            self.counters = counters
+            self.version += 1
+            self.stats['published'] += len(events)
+            self.cond.notify_all()
+    
+    def wait(self, version, timeout):
+        """Block until a poll newer than `version` is published; returns the feed state"""
+        with self.cond:
+            if self.version == version:
+                self.cond.wait(timeout)
+            return self.version, self.base, self.position, list(self.events), self.counters
+    
+    def stream(self, cursor, duration):
+        """SSE text chunks for one client, starting after `cursor`"""
+        yield f"retry: {LIVE_RETRY_MS}\n\n"
+        deadline = time.monotonic() + duration
+        version = 0
+        while True:
+            # Never wait past the deadline, so a stream lasts LIVE_STREAM_SECONDS
+            # rather than up to a heartbeat longer
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            new_version, base, position, events, counters = self.wait(version, min(LIVE_HEARTBEAT, remaining))
+            if new_version == version:
+                if time.monotonic() < deadline:
+                    yield ': keepalive\n\n'
+                continue
+            version = new_version
+            
+            cursor = cursor or position
+            chunk = []
+            if cursor[0] < base[0] or cursor[1] < base[1]:
+                # Fell behind the shared buffer (slow client or reconnect to
+                # a fresh worker): catch up from the database if we can
+                with read_engine().connect() as conn:
+                    missed, complete = feed_rows_since(conn, cursor, self.events.maxlen)
+                if not complete:
+                    self.stats['resets'] += 1
+                    yield sse_message('reset', '{}', encode_feed_cursor(position))
+                    return
+                self.stats['catchups'] += 1
+                events = missed
+            
+            for kind, row_id, message in events:
+                if row_id > (cursor[0] if kind == 'visit' else cursor[1]):
+                    chunk.append(message)
+                    cursor = advance(cursor, kind, row_id)
+            cursor = (max(cursor[0], position[0]), max(cursor[1], position[1]))
+            chunk.append(sse_message('counters', counters, encode_feed_cursor(cursor)))
+            yield ''.join(chunk)
+    
+    def snapshot(self):
+        with self.cond:
+            return dict(
+                self.stats,
+                streams=self.streams,
+                buffered=len(self.events),
+                position=encode_feed_cursor(self.position) if self.position else None
+            )
+
+live_feed = LiveFeed(LIVE_BACKLOG, LIVE_POLL_INTERVAL, LIVE_MAX_STREAMS)
+
+@app.route('/admin/live')
+def admin_live():
+    """SSE stream of new visits, clicks and dashboard counters (?cursor= or Last-Event-ID)"""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    cursor = decode_feed_cursor(request.headers.get('Last-Event-ID') or request.args.get('cursor'))
+    if not live_feed.subscribe():
+        return Response(f"retry: {LIVE_RETRY_MS * 10}\n\n", status=503, mimetype='text/event-stream')
+    
+    response = Response(stream_with_context(live_feed.stream(cursor, LIVE_STREAM_SECONDS)),
+                        mimetype='text/event-stream', headers={
+                            'Cache-Control': 'no-cache',
+                            'X-Accel-Buffering': 'no'
+                        })
+    # Runs even if the client goes away before the first chunk is sent
+    response.call_on_close(live_feed.unsubscribe)
+    return response
+
+def _collect_live_feed():
+    stats = live_feed.snapshot()
+    return [
+        ('tradepass_live_streams', 'gauge', 'Open /admin/live streams', {}, stats['streams']),
+        ('tradepass_live_events_total', 'counter', 'Visits/clicks published to the live feed', {}, stats['published']),
+        ('tradepass_live_rejected_total', 'counter', 'Live streams refused because the per-process cap was reached', {}, stats['rejected']),
+        ('tradepass_live_resets_total', 'counter', 'Live streams told to reload because they fell too far behind', {}, stats['resets']),
+    ]
+
+metrics.collectors.append(_collect_live_feed)
+
+# ============ DASHBOARD CACHE ============
+# Reloading /admin/dashboard with nothing new written reuses the last build.
+# Everything the dashboard shows moves with the newest visitor row, the
+# newest click row or the latest last_visit, so the stats context is keyed
+# on those three (index lookups, read from the database, so any worker's
+# writes invalidate it). The rendered page is also keyed on admin_email and
+# current_time (to the minute), so those stay right per admin. The short TTL
+# only bounds how old its "2 minutes ago" labels get.
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 5))
+DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 64))
+dashboard_context_cache = LRUCache(DASHBOARD_CACHE_SIZE, DASHBOARD_CACHE_TTL)
+dashboard_page_cache = LRUCache(DASHBOARD_CACHE_SIZE, DASHBOARD_CACHE_TTL)
+
+def dashboard_data_version(engine=None):
+    """(newest visitor id, newest click id, latest last_visit) - changes with any worker's writes"""
+    with (engine or read_engine()).connect() as conn:
+        return tuple(conn.execute(select(
+            select(func.max(Visitor.id)).scalar_subquery(),
+            select(func.max(Click.id)).scalar_subquery(),
+            select(func.max(Visitor.last_visit)).scalar_subquery(),
+        )).one())
+
+def dashboard_page_key(admin_email, now, engine=None):
+    return (dashboard_data_version(engine), admin_email, now.strftime('%H:%M'))
+
+def dashboard_page(admin_email, now=None, engine=None, key=None):
+    """(html, etag) of the dashboard for one admin, rebuilt only after new writes or the TTL"""
+    now = now or datetime.utcnow()
+    key = key or dashboard_page_key(admin_email, now, engine)
+    version, _, current_time = key
+    page = dashboard_page_cache.get(key)
+    if page is not None:
+        return page
+    
+    data = dashboard_context_cache.get(version)
+    if data is None:
+        data = dashboard_stats(now, engine)
+        dashboard_context_cache.put(version, data)
+    
+    html = render_template('admin/dashboard.html',
+                           logged_in=True,
+                           admin_email=admin_email,
+                           current_time=current_time,
+                           stats=data['stats'],
+                           recent_visitors=data['recent_visitors'],
+                           recent_clicks=data['recent_clicks'],
+                           plan_stats=data['plan_stats'],
+                           live_cursor=data['live_cursor'])
+    page = (html, hashlib.blake2b(html.encode('utf-8'), digest_size=16).hexdigest())
+    dashboard_page_cache.put(key, page)
+    return page
+
+def _collect_dashboard_cache():
+    samples = []
+    for view, cache in (('context', dashboard_context_cache), ('page', dashboard_page_cache)):
+        stats = cache.snapshot()
+        samples += [
+            ('tradepass_dashboard_cache_lookups_total', 'counter', 'Admin dashboard cache lookups by view and result', {'view': view, 'result': 'hit'}, stats['hits']),
+            ('tradepass_dashboard_cache_lookups_total', 'counter', 'Admin dashboard cache lookups by view and result', {'view': view, 'result': 'miss'}, stats['misses']),
+        ]
+    return samples
+
+metrics.collectors.append(_collect_dashboard_cache)
+
 # ============ ADMIN ROUTES ============
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
@@ -433,154 +3473,109 @@ def admin_dashboard():
     if not check_admin():
         return redirect('/admin/login')
     
-    # Get REAL stats
-    total_visitors = Visitor.query.count()
-    total_clicks = Click.query.count()
-    
-    # Today's date
-    today = datetime.utcnow().date()
-    
-    # Today's visitors
-    today_visitors = Visitor.query.filter(
-        db.func.date(Visitor.first_visit) == today
-    ).count()
-    
-    # Today's clicks
-    today_clicks = Click.query.filter(
-        db.func.date(Click.timestamp) == today
-    ).count()
-    
-    # Conversion rate
-    conversion_rate = round((total_clicks / total_visitors * 100), 1) if total_visitors > 0 else 0
-    
-    # Top plan
-    from sqlalchemy import func
-    top_plan_data = db.session.query(
-        Click.plan, func.count(Click.id)
-    ).group_by(Click.plan).order_by(func.count(Click.id).desc()).first()
-    
-    top_plan = "No clicks yet"
-    if top_plan_data and top_plan_data[0]:
-        plan_name = top_plan_data[0].replace('plan_', '₹')
-        top_plan = f"{plan_name} ({top_plan_data[1]} clicks)"
-    
-    # Recent visitors (REAL data)
-    recent_visitors_data = Visitor.query.order_by(Visitor.last_visit.desc()).limit(5).all()
-    recent_visitors = []
-    
-    for v in recent_visitors_data:
-        click_count = Click.query.filter_by(visitor_id=v.visitor_id).count()
-        recent_visitors.append({
-            'visitor_id': v.visitor_id,
-            'time': v.last_visit.strftime('%H:%M'),
-            'time_ago': time_ago(v.last_visit),
-            'source': v.source,
-            'clicks': click_count
-        })
-    
-    # Recent clicks (REAL data)
-    recent_clicks_data = Click.query.order_by(Click.timestamp.desc()).limit(5).all()
-    recent_clicks = []
-    
-    for c in recent_clicks_data:
-        recent_clicks.append({
-            'plan': c.plan,
-            'visitor_id': c.visitor_id,
-            'time_ago': time_ago(c.timestamp),
-            'ip_hash': c.ip_hash[:8] + '...'
-        })
-    
-    # Plan breakdown (REAL data)
-    plan_stats = []
-    plans = ['plan_99', 'plan_149', 'plan_199']
-    
-    for plan in plans:
-        count = Click.query.filter_by(plan=plan).count()
-        percentage = round((count / total_clicks * 100), 1) if total_clicks > 0 else 0
-        
-        # Revenue calculation
-        if plan == 'plan_99':
-            revenue = count * 99
-        elif plan == 'plan_149':
-            revenue = count * 149
-        else:
-            revenue = count * 199
-            
-        plan_stats.append({
-            'plan': plan.replace('plan_', '₹'),
-            'count': count,
-            'percentage': percentage,
-            'revenue': f"₹{revenue:,}"
-        })
+    admin_email = session.get('admin_email', 'Admin')
+    now = datetime.utcnow()
+    key = dashboard_page_key(admin_email, now)
+    page = dashboard_page_cache.get(key)
+    if page is None:
+        # Only a rebuild runs the stats queries; cache hits and 304s skip the gate
+        if not take_admin_read_slot():
+            return admin_reads_busy()
+        page = dashboard_page(admin_email, now, key=key)
+    html, etag = page
     
-    # Render dashboard
-    return render_template('admin/dashboard.html',
-                          logged_in=True,
-                          admin_email=session.get('admin_email', 'Admin'),
-                          current_time=datetime.utcnow().strftime('%H:%M'),
-                          stats={
-                              'total_visitors': total_visitors,
-                              'total_clicks': total_clicks,
-                              'today_visitors': today_visitors,
-                              'today_clicks': today_clicks,
-                              'conversion_rate': conversion_rate,
-                              'top_plan': top_plan
-                          },
-                          recent_visitors=recent_visitors,
-                          recent_clicks=recent_clicks,
-                          plan_stats=plan_stats)
+    # Browsers revalidate every load; an unchanged page is a 304
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
 
 @app.route('/admin/visitors')
 def admin_visitors():
-    """All visitors page"""
+    """All visitors page - keyset paginated on last_visit (?cursor=, ?limit=, ?stream=1)"""
     if not check_admin():
         return redirect('/admin/login')
     
-    # Get ALL visitors
-    all_visitors = Visitor.query.order_by(Visitor.last_visit.desc()).all()
-    
-    visitors_data = []
-    for v in all_visitors:
-        click_count = Click.query.filter_by(visitor_id=v.visitor_id).count()
-        visitors_data.append({
-            'id': v.visitor_id,
-            'ip': v.ip_hash[:8] + '...',
-            'source': v.source,
-            'first_visit': v.first_visit.strftime('%Y-%m-%d %H:%M'),
-            'last_visit': time_ago(v.last_visit),
-            'clicks': click_count,
-            'is_returning': click_count > 0
-        })
+    try:
+        cursor, limit, stream = page_args()
+    except ValueError:
+        return "Invalid cursor or limit", 400
     
-    return render_template('admin/visitors.html',
-                          logged_in=True,
-                          admin_email=session.get('admin_email', 'Admin'),
-                          visitors=visitors_data)
+    query = (
+        select(Visitor.id, Visitor.visitor_id, Visitor.ip_hash, Visitor.source,
+               Visitor.first_visit, Visitor.last_visit, visitor_click_count().label('clicks'))
+        .order_by(Visitor.last_visit.desc(), Visitor.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        query = query.where(tuple_(Visitor.last_visit, Visitor.id) < cursor)
+    
+    def rows():
+        with read_engine().connect() as conn:
+            for v in conn.execute(query.execution_options(yield_per=ADMIN_STREAM_CHUNK)):
+                yield v, {
+                    'id': v.visitor_id,
+                    'ip': v.ip_hash[:8] + '...',
+                    'source': v.source,
+                    'first_visit': v.first_visit.strftime('%Y-%m-%d %H:%M'),
+                    'last_visit': time_ago(v.last_visit),
+                    'clicks': v.clicks,
+                    'is_returning': v.clicks > 0
+                }
+    
+    return render_page('admin/visitors.html', 'visitors', rows(), stream, limit,
+                       lambda v: (v.last_visit, v.id))
 
 @app.route('/admin/clicks')
 def admin_clicks():
-    """All clicks page"""
+    """All clicks page - keyset paginated on timestamp (?cursor=, ?limit=, ?stream=1)"""
     if not check_admin():
         return redirect('/admin/login')
     
-    # Get ALL clicks
-    all_clicks = Click.query.order_by(Click.timestamp.desc()).all()
-    
-    clicks_data = []
-    for c in all_clicks:
-        clicks_data.append({
-            'id': c.click_id,
-            'visitor_id': c.visitor_id,
-            'plan': c.plan.replace('plan_', '₹'),
-            'time': c.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'time_ago': time_ago(c.timestamp),
-            'ip': c.ip_hash[:8] + '...'
-        })
+    try:
+        cursor, limit, stream = page_args()
+    except ValueError:
+        return "Invalid cursor or limit", 400
+    
+    query = (
+        select(Click.id, Click.click_id, Click.visitor_id, Click.plan, Click.timestamp, Click.ip_hash)
+        .order_by(Click.timestamp.desc(), Click.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        query = query.where(tuple_(Click.timestamp, Click.id) < cursor)
+    
+    def rows():
+        with read_engine().connect() as conn:
+            for c in conn.execute(query.execution_options(yield_per=ADMIN_STREAM_CHUNK)):
+                yield c, {
+                    'id': c.click_id,
+                    'visitor_id': c.visitor_id,
+                    'plan': c.plan.replace('plan_', '₹'),
+                    'time': c.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                    'time_ago': time_ago(c.timestamp),
+                    'ip': c.ip_hash[:8] + '...'
+                }
+    
+    return render_page('admin/clicks.html', 'clicks', rows(), stream, limit,
+                       lambda c: (c.timestamp, c.id))
+
+@app.route('/admin/ingest')
+def admin_ingest():
+    """Ingest queue depth, flush latency and visitor cache counters"""
+    if not check_admin():
+        return redirect('/admin/login')
+    
+    return jsonify(dict(ingest.snapshot(), visitor_cache=visitor_cache.snapshot()))
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Prometheus metrics (admin session or 'Authorization: Bearer <METRICS_TOKEN>')"""
+    if not check_token_auth(METRICS_TOKEN):
+        return "Unauthorized", 401
     
-    return render_template('admin/clicks.html',
-                          logged_in=True,
-                          admin_email=session.get('admin_email', 'Admin'),
-                          clicks=clicks_data)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/health')
 def health():
@@ -594,11 +3589,198 @@ def root():
 
 
 
+# ============ SCHEMA MIGRATIONS ============
+# create_all() only creates missing tables, so anything that changes an
+# existing table goes here. Each migration runs once, in order, and is
+# recorded in schema_version.
+def create_indexes(conn, *tables):
+    """Create any of the model-declared indexes that don't exist yet.
+    
+    Indexes on columns a later migration adds are left for that migration.
+    """
+    for table in tables:
+        existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+        for index in table.indexes:
+            if all(column.name in existing for column in index.columns):
+                index.create(conn, checkfirst=True)
+
+def _merge_duplicate_ip_hashes(conn):
+    """Collapse visitors sharing an ip_hash into the oldest row"""
+    dupes = conn.execute(text(
+        "SELECT ip_hash, MIN(id) FROM visitor WHERE ip_hash IS NOT NULL "
+        "GROUP BY ip_hash HAVING COUNT(*) > 1"
+    )).all()
+    
+    for ip_hash, keep_id in dupes:
+        params = {'ip_hash': ip_hash, 'keep_id': keep_id}
+        conn.execute(text(
+            "UPDATE visitor SET "
+            "first_visit = (SELECT MIN(first_visit) FROM visitor WHERE ip_hash = :ip_hash), "
+            "last_visit = (SELECT MAX(last_visit) FROM visitor WHERE ip_hash = :ip_hash) "
+            "WHERE id = :keep_id"
+        ), params)
+        conn.execute(text(
+            "UPDATE click SET visitor_id = (SELECT visitor_id FROM visitor WHERE id = :keep_id) "
+            "WHERE ip_hash = :ip_hash"
+        ), params)
+        conn.execute(text("DELETE FROM visitor WHERE ip_hash = :ip_hash AND id != :keep_id"), params)
+        visitor_cache.invalidate(ip_hash)
+    return len(dupes)
+
+def _renumber_duplicate_visitor_ids(conn):
+    """Give every visitor after the first in a duplicated visitor_id a fresh ID"""
+    dupes = conn.execute(text(
+        "SELECT visitor_id FROM visitor WHERE visitor_id IS NOT NULL "
+        "GROUP BY visitor_id HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if not dupes:
+        return 0
+    
+    numbers = [
+        int(vid[1:]) for vid in conn.execute(text("SELECT visitor_id FROM visitor")).scalars()
+        if vid and vid[1:].isdigit()
+    ]
+    next_number = max(numbers) + 1
+    renumbered = 0
+    
+    for visitor_id in dupes:
+        rows = conn.execute(text(
+            "SELECT id, ip_hash FROM visitor WHERE visitor_id = :vid ORDER BY id"
+        ), {'vid': visitor_id}).all()
+        for row_id, ip_hash in rows[1:]:
+            new_id = f"V{next_number}"
+            next_number += 1
+            conn.execute(text("UPDATE visitor SET visitor_id = :new WHERE id = :id"),
+                         {'new': new_id, 'id': row_id})
+            conn.execute(text(
+                "UPDATE click SET visitor_id = :new WHERE visitor_id = :old AND ip_hash = :ip_hash"
+            ), {'new': new_id, 'old': visitor_id, 'ip_hash': ip_hash})
+            visitor_cache.invalidate(ip_hash)
+            renumbered += 1
+    return renumbered
+
+def _migrate_lookup_indexes(conn):
+    """v1: unique visitor_id/ip_hash plus lookup and range indexes"""
+    merged = _merge_duplicate_ip_hashes(conn)
+    renumbered = _renumber_duplicate_visitor_ids(conn)
+    if merged or renumbered:
+        print(f"🔧 Merged {merged} duplicate IP hashes, renumbered {renumbered} visitor IDs")
+    create_indexes(conn, Visitor.__table__, Click.__table__)
+
+def _migrate_visitor_id_sequence(conn):
+    """v2: seed the visitor ID sequence after the highest existing V#### ID"""
+    seq = IdSequence.__table__
+    if conn.execute(select(seq.c.name).where(seq.c.name == 'visitor')).first():
+        return
+    
+    numbers = [
+        int(vid[1:]) for vid in conn.execute(select(Visitor.visitor_id)).scalars()
+        if vid and vid[1:].isdigit()
+    ]
+    next_value = max(numbers) + 1 if numbers else 1001
+    conn.execute(insert(seq).values(name='visitor', next_value=next_value))
+
+def _migrate_daily_rollups(conn):
+    """v3: backfill daily_rollup from existing raw rows"""
+    rebuild_rollups(conn)
+
+def add_missing_columns(conn, table):
+    """ALTER TABLE ADD COLUMN for model columns the table doesn't have yet (nullable only)"""
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def _migrate_click_idempotency_key(conn):
+    """v4: Click.idempotency_key with a unique index"""
+    add_missing_columns(conn, Click.__table__)
+    create_indexes(conn, Click.__table__)
+
+def _migrate_hourly_rollups(conn):
+    """v5: backfill hourly_rollup (daily_rollup is rebuilt alongside it)"""
+    rebuild_rollups(conn)
+
+def _migrate_interned_strings(conn):
+    """v6: move Visitor.user_agent/referrer text into the user_agent/referrer tables"""
+    table = Visitor.__table__
+    add_missing_columns(conn, table)
+    existing = {c['name'] for c in inspect(conn).get_columns('visitor')}
+    if 'user_agent' not in existing:
+        return
+    
+    # Keyset over the old text columns, interning each chunk's strings
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text('SELECT id, user_agent, referrer FROM visitor WHERE id > :last ORDER BY id LIMIT :n'),
+            {'last': last_id, 'n': EXPORT_CHUNK}
+        ).all()
+        if not rows:
+            break
+        agent_ids = user_agents.ids(conn, {row.user_agent for row in rows})
+        referrer_ids = referrers.ids(conn, {row.referrer for row in rows})
+        conn.execute(
+            update(table).where(table.c.id == bindparam('row_id'))
+            .values(user_agent_id=bindparam('agent'), referrer_id=bindparam('ref')),
+            [{'row_id': row.id, 'agent': agent_ids.get(row.user_agent), 'ref': referrer_ids.get(row.referrer)}
+             for row in rows]
+        )
+        last_id = rows[-1].id
+    
+    for column in ('user_agent', 'referrer'):
+        try:
+            with conn.begin_nested():
+                conn.execute(text(f'ALTER TABLE visitor DROP COLUMN {column}'))
+        except Exception:
+            # SQLite before 3.35 can't drop columns; clear them instead
+            conn.execute(text(f'UPDATE visitor SET {column} = NULL'))
+    print("🗜️ Interned visitor user agents and referrers")
+
+MIGRATIONS = [
+    (1, _migrate_lookup_indexes),
+    (2, _migrate_visitor_id_sequence),
+    (3, _migrate_daily_rollups),
+    (4, _migrate_click_idempotency_key),
+    (5, _migrate_hourly_rollups),
+    (6, _migrate_interned_strings),
+]
+
+def schema_head():
+    return MIGRATIONS[-1][0]
+
+def upgrade_schema(engine=None):
+    """Create missing tables and apply pending migrations; returns versions applied"""
+    engine = engine or db.engine
+    applied = []
+    
+    with engine.begin() as conn:
+        db.metadata.create_all(conn)
+        current = conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+        
+        # Migrations are no-ops on a brand new database, so they always run
+        for version, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            migrate(conn)
+            applied.append(version)
+            conn.execute(insert(SchemaVersion).values(version=version, applied_at=datetime.utcnow()))
+    
+    return applied
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Apply pending schema migrations to the configured database"""
+    applied = upgrade_schema()
+    if applied:
+        print(f"✅ Applied migrations: {', '.join(map(str, applied))}")
+    print(f"📐 Schema version: {schema_head()}")
+
 # ============ INITIALIZE DATABASE ============
 def init_db():
-    """Create database tables"""
+    """Create database tables and apply pending migrations"""
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
         print("✅ Database initialized successfully")
         print(f"📊 Current visitors: {Visitor.query.count()}")
         print(f"🖱️ Current clicks: {Click.query.count()}")
@@ -0,0 +1,284 @@
+"""Optional async serving mode for the tracking endpoints.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+
+GET /, POST /track and GET /health are answered on the event loop. They
+only touch in-memory state - the traffic filter, the visitor cache and the
+pre-rendered landing page - and hand events to the same write-behind
+ingest queue the Flask routes use, so an idle or slow client costs a
+coroutine instead of a gunicorn thread. The three steps that can block run
+on a small thread pool: looking up a visitor the cache hasn't seen (one
+indexed SELECT, plus an id block reservation for a new one), the Redis
+rate-limit round trip when RATE_LIMIT_REDIS_URL is set, and the inline
+write when the ingest queue is full. Nothing else on the loop takes a lock
+that is held across I/O.
+
+Every other path (admin pages, exports, /track/batch, the live feed) is
+passed to the unchanged Flask app through a2wsgi. That is also the mode
+the dashboard's live feed is meant for: its long-lived streams wait on
+a2wsgi's thread pool instead of taking threads from the tracking routes.
+Responses match the Flask routes, except that a /track body that isn't a
+JSON object gets a 400 instead of Flask's 415/500. WebSocket connections
+are refused - a2wsgi can't carry them and no route needs one.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags
+
+# Live streams here hold a2wsgi threads, not the ones the tracking routes
+# use, so the dashboard feed can keep more and longer streams open
+os.environ.setdefault('LIVE_MAX_STREAMS', '4')
+os.environ.setdefault('LIVE_STREAM_SECONDS', '300')
+os.environ.setdefault('LIVE_HEARTBEAT', '15')
+
+import app as tp
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # optional - without it only the tracking routes are served
+    WSGIMiddleware = None
+
+ASGI_BLOCKING_THREADS = int(os.environ.get('ASGI_BLOCKING_THREADS', 8))
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 10))
+TRACK_BODY_MAX = int(os.environ.get('TRACK_BODY_MAX', 64 * 1024))
+
+blocking = ThreadPoolExecutor(ASGI_BLOCKING_THREADS, thread_name_prefix='asgi-blocking')
+flask_app = WSGIMiddleware(tp.app, workers=ASGI_WSGI_THREADS) if WSGIMiddleware else None
+
+def header_map(scope):
+    """Lower-case header name -> value, repeated headers joined with ', '"""
+    headers = {}
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return headers
+
+def client_ip(scope, headers):
+    """Client address, trusting PROXY_FIX_HOPS X-Forwarded-For hops like ProxyFix"""
+    if tp.PROXY_FIX_HOPS:
+        hops = [hop.strip() for hop in headers.get('x-forwarded-for', '').split(',') if hop.strip()]
+        if len(hops) >= tp.PROXY_FIX_HOPS:
+            return hops[-tp.PROXY_FIX_HOPS]
+    client = scope.get('client')
+    return client[0] if client else '127.0.0.1'
+
+def json_body(payload):
+    """Serialized the way Flask's jsonify does it (sorted, compact, trailing newline)"""
+    return (json.dumps(payload, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+async def send_response(send, status, body, content_type, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+        ] + [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, payload, status=200):
+    await send_response(send, status, json_body(payload), 'application/json')
+
+async def read_body(receive, limit):
+    """Request body, or None once it grows past limit"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return b''
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def resolve_visitor(ip_hash):
+    """(visitor_id, is_new); only a cache miss leaves the event loop"""
+    visitor_id = tp.cached_visitor(ip_hash)
+    if visitor_id:
+        return visitor_id, False
+    return await asyncio.get_running_loop().run_in_executor(blocking, _resolve_in_context, ip_hash)
+
+def _resolve_in_context(ip_hash):
+    with tp.app.app_context():
+        try:
+            return tp.resolve_visitor(ip_hash)
+        finally:
+            tp.db.session.remove()
+
+async def drop_reason(kind, ip_hash, user_agent, plan=None):
+    """tp.drop_reason(), off the loop when the rate limiter has to ask Redis"""
+    if tp.RATE_LIMIT_REDIS_URL:
+        return await asyncio.get_running_loop().run_in_executor(
+            blocking, tp.drop_reason, kind, ip_hash, user_agent, plan
+        )
+    return tp.drop_reason(kind, ip_hash, user_agent, plan)
+
+async def enqueue(event):
+    """Queue an event; when the queue is full, block a pool thread instead of the loop"""
+    # try_put() doesn't lock once the writer is running (EventIngest.start)
+    if not tp.ingest.try_put(event):
+        await asyncio.get_running_loop().run_in_executor(blocking, tp.ingest.put, event)
+
+def tracked_event(kind, ip_hash, visitor_id, scope, headers, plan=None):
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8', 'replace'))
+    return tp.build_event(
+        kind, ip_hash, visitor_id,
+        headers.get('user-agent', ''), headers.get('referer'), query.get('utm_source', [None])[0],
+        plan=plan
+    )
+
+# ============ ROUTES ============
+def landing_page_response(headers):
+    """(status, body, headers) for the cached landing page, honouring conditional GETs"""
+    page = tp.landing_page
+    if page.variants is None or tp.app.debug:
+        with tp.app.app_context():
+            page.ensure_built()
+    
+    encoding = page.negotiate(parse_accept_header(headers.get('accept-encoding')))
+    etag = f"{page.etag}-{encoding}"
+    response_headers = [
+        ('vary', 'Accept-Encoding'),
+        ('etag', f'"{etag}"'),
+        ('last-modified', http_date(page.last_modified)),
+        ('cache-control', 'no-cache'),
+    ]
+    if encoding != 'identity':
+        response_headers.append(('content-encoding', encoding))
+    
+    if 'if-none-match' in headers:
+        not_modified = parse_etags(headers['if-none-match']).contains_weak(etag)
+    else:
+        since = parse_date(headers.get('if-modified-since'))
+        not_modified = since is not None and page.last_modified <= since.replace(tzinfo=None)
+    if not_modified:
+        return 304, b'', response_headers
+    return 200, page.variants[encoding], response_headers
+
+async def home(scope, receive, send, headers):
+    """Home page - tracks all visitors"""
+    ip_hash = tp.hash_ip(client_ip(scope, headers))
+    
+    # Bots and rapid reloads still get the page, just aren't recorded
+    if not await drop_reason('visit', ip_hash, headers.get('user-agent', '')):
+        visitor_id, is_new = await resolve_visitor(ip_hash)
+        event = tracked_event('visit', ip_hash, visitor_id, scope, headers)
+        await enqueue(event)
+        tp.log.info(f"👤 Visitor tracked: {visitor_id} from {event['source']}")
+    
+    status, body, response_headers = landing_page_response(headers)
+    if scope['method'] == 'HEAD':
+        body = b''
+    await send_response(send, status, body, 'text/html; charset=utf-8', response_headers)
+    return status
+
+async def track_click(scope, receive, send, headers):
+    """Track buy button clicks"""
+    try:
+        body = await read_body(receive, TRACK_BODY_MAX)
+        if body is None:
+            await send_json(send, {'success': False, 'error': 'Request body too large'}, 413)
+            return 413
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        if not data or not isinstance(data, dict):
+            await send_json(send, {'success': False, 'error': 'No data received'}, 400)
+            return 400
+        
+        plan = data.get('plan', 'unknown')
+        ip_hash = tp.hash_ip(client_ip(scope, headers))
+        
+        dropped = await drop_reason('click', ip_hash, headers.get('user-agent', ''), plan)
+        if dropped == 'rate_limit':
+            await send_json(send, {'success': False, 'error': 'Too many requests'}, 429)
+            return 429
+        if dropped:
+            await send_json(send, {'success': True, 'plan': plan, 'message': 'Click ignored'})
+            return 200
+        
+        # Find visitor (or allocate one - the writer creates it with the click)
+        visitor_id, is_new = await resolve_visitor(ip_hash)
+        await enqueue(tracked_event('click', ip_hash, visitor_id, scope, headers, plan=plan))
+        
+        if not is_new:
+            tp.log.info(f"🖱️ Buy click: {visitor_id} -> {plan}")
+            message = 'Click tracked successfully'
+        else:
+            tp.log.info(f"👤➕🖱️ New visitor with click: {visitor_id} -> {plan}")
+            message = 'New visitor and click tracked'
+        await send_json(send, {'success': True, 'visitor_id': visitor_id, 'plan': plan, 'message': message})
+        return 200
+    
+    except Exception as e:
+        tp.log.error(f"❌ Tracking error: {str(e)}")
+        await send_json(send, {'success': False, 'error': str(e)}, 500)
+        return 500
+
+async def health(scope, receive, send, headers):
+    body = b'' if scope['method'] == 'HEAD' else "✅ TradePass is LIVE".encode('utf-8')
+    await send_response(send, 200, body, 'text/html; charset=utf-8')
+    return 200
+
+ROUTES = {
+    '/': (home, ('GET', 'HEAD')),
+    '/track': (track_click, ('POST',)),
+    '/health': (health, ('GET', 'HEAD')),
+}
+
+# ============ APPLICATION ============
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Render the landing page before the first request needs it
+            with tp.app.app_context():
+                tp.landing_page.ensure_built()
+            tp.ingest.start()
+            if flask_app is None:
+                tp.log.warning("⚠️ a2wsgi not installed - only /, /track and /health are served")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            blocking.shutdown(wait=True)
+            tp.ingest.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'websocket':
+        # Closing before accepting makes the server answer the handshake with 403
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 1008})
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+    
+    route = ROUTES.get(scope['path'])
+    if route is None:
+        if flask_app is None:
+            return await send_response(send, 404, b'Not Found', 'text/plain')
+        return await flask_app(scope, receive, send)
+    
+    handler, methods = route
+    started = time.perf_counter()
+    if scope['method'] not in methods:
+        await send_response(send, 405, b'Method Not Allowed', 'text/plain', [('allow', ', '.join(methods))])
+        status = 405
+    else:
+        status = await handler(scope, receive, send, header_map(scope))
+    
+    tp.metrics.inc('tradepass_requests_total', route=scope['path'], method=scope['method'], status=status)
+    tp.metrics.observe('tradepass_request_seconds', time.perf_counter() - started, route=scope['path'])
@@ -0,0 +1,1415 @@
+"""TradePass benchmarks
+
+Run from the project root:
+
+    python bench.py lookups --sizes 10000 100000 1000000
+    python bench.py visitor-ids --processes 4 --threads 8
+    python bench.py export --sizes 100000
+    python bench.py visitor-cache --sizes 100000 1000000
+    python bench.py workers --workers 1 2 4 --clients 8 [--database-url postgresql://...]
+    python bench.py landing
+    python bench.py traffic --sizes 1000000
+    python bench.py referrers
+    python bench.py interning --sizes 100000
+    python bench.py load --sizes 10000 1000000 --workers 2 --clients 8 --json load.json
+    python bench.py load --sizes 10000 --baseline load.json
+    python bench.py visit-log --sizes 100000 1000000
+    python bench.py uniques --sizes 100000 1000000
+    python bench.py attribution --sizes 10000 100000 1000000
+    python bench.py asgi --connections 10 100 1000 --workers 2 --clients 4
+    python bench.py read-isolation --sizes 100000 --workers 2 --clients 4 --readers 4
+    python bench.py dashboard --sizes 10000 1000000
+
+Each benchmark builds its own throwaway SQLite database (or uses
+--database-url), so nothing here touches tradepass.db. These only measure;
+correctness checks live in tests/ (python -m pytest tests).
+"""
+import argparse
+import asyncio
+import gzip
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+
+import app as tp
+from app import Click, Visitor
+
+PLANS = ['plan_99', 'plan_149', 'plan_199']
+SOURCES = ['direct', 'instagram', 'youtube', 'facebook', 'whatsapp', 'telegram', 'other']
+USER_AGENTS = [
+    'Mozilla/5.0 (Linux; Android 13; SM-A536E Build/TP1A.220624.014; wv) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Version/4.0 Chrome/118.0.5993.111 Mobile Safari/537.36 Instagram 307.0.0.34.111 Android (33/13; 450dpi; '
+    '1080x2177; samsung; SM-A536E; a53x; exynos1280; en_IN; 531357553)',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 '
+    '[FBAN/FBIOS;FBAV/437.0.0.38.115;FBBV/542361237;FBDV/iPhone14,5;FBMD/iPhone;FBSN/iOS;FBSV/17.0;FBSS/3;FBLC/en_US]',
+    'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 '
+    'Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:118.0) Gecko/20100101 Firefox/118.0',
+    'Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/22.0 '
+    'Chrome/111.0.5563.116 Mobile Safari/537.36',
+    'Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+]
+REFERRERS = [None, 'https://l.instagram.com/', 'https://m.facebook.com/', 'https://www.youtube.com/',
+             'https://t.me/', 'https://www.google.com/']
+
+
+# ============ HELPERS ============
+def ts(dt):
+    """Format a datetime the way SQLAlchemy stores it in SQLite"""
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+def timed(fn, repeat):
+    """Run fn() `repeat` times, return latency percentiles in ms"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[int(len(samples) * 0.95) - 1], 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+def seed(path, visitors, clicks_per_visitor=1.0, days=90):
+    """Fill a SQLite file with synthetic visitors and clicks using raw executemany"""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+
+    conn.executemany(
+        'INSERT INTO user_agent (id, digest, value, family, device) VALUES (?, ?, ?, ?, ?)',
+        [(i, tp.string_digest(ua), ua, *tp.parse_user_agent(ua)) for i, ua in enumerate(USER_AGENTS, 1)])
+    conn.executemany(
+        'INSERT INTO referrer (id, digest, value) VALUES (?, ?, ?)',
+        [(i, tp.string_digest(ref), ref) for i, ref in enumerate(REFERRERS) if ref])
+
+    def visitor_rows():
+        for i in range(1, visitors + 1):
+            first = now - timedelta(seconds=rng.randrange(days * 86400))
+            yield (
+                i, f"V{1000 + i}", f"{i:016x}", rng.randrange(1, len(USER_AGENTS) + 1),
+                rng.randrange(len(REFERRERS)) or None,
+                rng.choice(SOURCES), ts(first), ts(first + timedelta(seconds=rng.randrange(86400)))
+            )
+
+    def click_rows():
+        for i in range(1, int(visitors * clicks_per_visitor) + 1):
+            v = rng.randrange(1, visitors + 1)
+            yield (
+                f"V{1000 + v}", f"{v:016x}", rng.choice(PLANS),
+                ts(now - timedelta(seconds=rng.randrange(days * 86400))), f"{i:08x}"
+            )
+
+    conn.executemany(
+        'INSERT INTO visitor (id, visitor_id, ip_hash, user_agent_id, referrer_id, source, first_visit, last_visit) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', visitor_rows())
+    conn.executemany(
+        'INSERT INTO click (visitor_id, ip_hash, "plan", timestamp, click_id) VALUES (?, ?, ?, ?, ?)',
+        click_rows())
+    conn.commit()
+    conn.close()
+
+def new_database(indexed=True):
+    """Create an empty SQLite database with the app schema, optionally without indexes"""
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='tradepass-bench-')
+    os.close(fd)
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        tp.db.metadata.create_all(conn)
+        if not indexed:
+            for table in (Visitor.__table__, Click.__table__):
+                for index in table.indexes:
+                    index.drop(conn)
+    # Close the pooled WAL connection so seed() can switch journal modes
+    engine.dispose()
+    return engine, path
+
+def print_table(rows, columns):
+    widths = [max(len(str(c)), *(len(str(r[c])) for r in rows)) for c in columns]
+    print('  '.join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for r in rows:
+        print('  '.join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+# ============ BENCHMARKS ============
+def bench_lookups(args):
+    """Hot-path and admin lookups before and after the v1 index migration"""
+    results = []
+    for size in args.sizes:
+        engine, path = new_database(indexed=False)
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+        rng = random.Random(7)
+        since = datetime.utcnow() - timedelta(days=1)
+
+        def queries(conn):
+            return {
+                'visitor_by_ip_hash': lambda: conn.execute(
+                    select(Visitor.visitor_id).where(Visitor.ip_hash == f"{rng.randrange(1, size + 1):016x}")
+                ).first(),
+                'clicks_per_visitor': lambda: conn.execute(
+                    select(func.count(Click.id)).where(Click.visitor_id == f"V{1000 + rng.randrange(1, size + 1)}")
+                ).scalar(),
+                'recent_visitors': lambda: conn.execute(
+                    select(Visitor.visitor_id).order_by(Visitor.last_visit.desc()).limit(5)
+                ).all(),
+                'plan_clicks_last_day': lambda: conn.execute(
+                    select(func.count(Click.id)).where(Click.plan == 'plan_149', Click.timestamp >= since)
+                ).scalar()
+            }
+
+        for phase in ('before', 'after'):
+            if phase == 'after':
+                started = time.perf_counter()
+                with engine.begin() as conn:
+                    tp._migrate_lookup_indexes(conn)
+                print(f"🔧 Migration took {time.perf_counter() - started:.1f}s")
+            with engine.connect() as conn:
+                for name, fn in queries(conn).items():
+                    # Full scans at 1M rows are slow; keep the run bounded
+                    repeat = args.repeat if phase == 'after' else max(3, args.repeat // 20)
+                    results.append(dict(rows=size, query=name, indexes=phase, **timed(fn, repeat)))
+
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, ['rows', 'query', 'indexes', 'p50_ms', 'p95_ms', 'max_ms'])
+    return results
+
+
+def _allocate_ids(path, threads, per_thread, block_size):
+    """Worker process: allocate visitor IDs from several threads at once"""
+    engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 30})
+    allocator = tp.BlockAllocator('visitor', block_size, engine=engine)
+    ids = []
+    lock = threading.Lock()
+
+    def run():
+        mine = [f"V{allocator.next()}" for _ in range(per_thread)]
+        with lock:
+            ids.extend(mine)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    engine.dispose()
+    return ids
+
+def bench_visitor_ids(args):
+    """Visitor ID allocation rate from many processes and threads (uniqueness: tests/test_visitor_ids.py)"""
+    engine, path = new_database()
+    with engine.begin() as conn:
+        tp._migrate_visitor_id_sequence(conn)
+    engine.dispose()
+
+    results = []
+    for block_size in (1, tp.VISITOR_ID_BLOCK):
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(args.processes) as pool:
+            batches = pool.starmap(_allocate_ids, [
+                (path, args.threads, args.per_thread, block_size)
+            ] * args.processes)
+        elapsed = time.perf_counter() - started
+
+        allocated = sum(len(batch) for batch in batches)
+        results.append({
+            'block_size': block_size,
+            'processes': args.processes,
+            'threads': args.threads,
+            'allocated': allocated,
+            'ids_per_sec': round(allocated / elapsed)
+        })
+
+    os.remove(path)
+    print_table(results, ['block_size', 'processes', 'threads', 'allocated', 'ids_per_sec'])
+    return results
+
+
+def bench_export(args):
+    """Export throughput (rows/sec) and peak Python memory for each table and format"""
+    import tracemalloc
+
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+
+        for kind in ('visitors', 'clicks'):
+            for fmt, (formatter, _) in tp.EXPORT_FORMATS.items():
+                def run():
+                    return sum(len(chunk) for chunk in formatter(kind, tp.export_rows(kind, engine=engine)))
+
+                started = time.perf_counter()
+                out_bytes = run()
+                elapsed = time.perf_counter() - started
+
+                # Separate pass: tracemalloc slows everything down
+                tracemalloc.start()
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results.append({
+                    'rows': size,
+                    'export': kind,
+                    'format': fmt,
+                    'rows_per_sec': round(size / elapsed),
+                    'mb_out': round(out_bytes / 1e6, 1),
+                    'peak_mem_mb': round(peak / 1e6, 2)
+                })
+
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, ['rows', 'export', 'format', 'rows_per_sec', 'mb_out', 'peak_mem_mb'])
+    return results
+
+
+def bench_visitor_cache(args):
+    """ip_hash -> visitor_id resolution for campaign-style returning traffic, with and without the LRU cache"""
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+
+        # 90% of hits come from a hot set of returning visitors, the rest from anywhere
+        rng = random.Random(11)
+        hot = [rng.randrange(1, size + 1) for _ in range(min(size, 5000))]
+        traffic = [
+            f"{rng.choice(hot) if rng.random() < 0.9 else rng.randrange(1, size + 1):016x}"
+            for _ in range(args.repeat * 250)
+        ]
+
+        with engine.connect() as conn:
+            def lookup(ip_hash):
+                return conn.execute(select(Visitor.visitor_id).where(Visitor.ip_hash == ip_hash)).scalar()
+
+            def cached_lookup(ip_hash):
+                visitor_id = cache.get(ip_hash)
+                if visitor_id is None:
+                    visitor_id = lookup(ip_hash)
+                    cache.put(ip_hash, visitor_id)
+                return visitor_id
+
+            for mode, fn in (('database', lookup), ('lru_cache', cached_lookup)):
+                cache = tp.LRUCache(tp.VISITOR_CACHE_SIZE, tp.VISITOR_CACHE_TTL)
+                hits = iter(traffic)
+                results.append(dict(
+                    rows=size, mode=mode,
+                    **timed(lambda: fn(next(hits)), len(traffic)),
+                    hit_rate=cache.snapshot()['hit_rate'] if mode == 'lru_cache' else '-',
+                    evictions=cache.stats['evictions'] if mode == 'lru_cache' else '-'
+                ))
+
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, ['rows', 'mode', 'p50_ms', 'p95_ms', 'max_ms', 'hit_rate', 'evictions'])
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _request(port, method, path, body=None, ip='127.0.0.1', headers=None):
+    """One request on a fresh localhost connection; returns (status, latency ms)"""
+    # A browser User-Agent, or the bot filter drops the traffic
+    headers = dict({'User-Agent': USER_AGENTS[2]}, **(headers or {}), **{'X-Forwarded-For': ip})
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+        body = json.dumps(body)
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        status = conn.getresponse().status
+    except OSError:
+        status = 0
+    finally:
+        conn.close()
+    return status, (time.perf_counter() - started) * 1000
+
+def _drive_clicks(port, client, duration, returning_ips):
+    """Client process: POST /track in a loop; returns (ok count, errors, latencies)"""
+    rng = random.Random(client)
+    ok, errors, latencies = 0, 0, []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        # Mostly returning visitors, some brand new ones
+        if rng.random() < 0.8:
+            ip = f"10.0.{rng.randrange(returning_ips) // 250}.{rng.randrange(250)}"
+        else:
+            ip = f"10.{client + 1}.{rng.randrange(250)}.{rng.randrange(250)}"
+        status, ms = _request(port, 'POST', '/track', {'plan': rng.choice(PLANS)}, ip)
+        if status == 200:
+            ok += 1
+            latencies.append(ms)
+        else:
+            errors += 1
+    return ok, errors, latencies
+
+class GunicornServer:
+    """The real app under gunicorn on a throwaway database"""
+    name = 'gunicorn'
+
+    def command(self, workers, threads):
+        return [
+            sys.executable, '-m', 'gunicorn', 'bench:served_app()',
+            '--bind', f'127.0.0.1:{self.port}',
+            '--workers', str(workers), '--threads', str(threads),
+            '--log-level', 'warning'
+        ]
+
+    def __init__(self, database_url, workers, threads, extra_env=None):
+        self.port = _free_port()
+        env = dict(os.environ, DATABASE_URL=database_url, PROXY_FIX_HOPS='1', LOG_LEVEL='WARNING',
+                   **(extra_env or {}))
+        # Server output goes to a file so a chatty server can't fill a pipe and stall
+        self.output = tempfile.TemporaryFile(mode='w+')
+        self.proc = subprocess.Popen(self.command(workers, threads), cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=self.output, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + 30
+        while _request(self.port, 'GET', '/health')[0] != 200:
+            if time.monotonic() > deadline or self.proc.poll() is not None:
+                raise SystemExit(f"❌ {self.name} did not start: {self.stop()[-2000:]}")
+            time.sleep(0.2)
+
+    def stop(self):
+        """Graceful shutdown - workers flush their ingest queues on exit; returns server output"""
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGTERM)
+            self.proc.wait(60)
+        self.output.seek(0)
+        return self.output.read()
+
+class UvicornServer(GunicornServer):
+    """The async serving mode (asgi.py) under uvicorn"""
+    name = 'uvicorn'
+
+    def command(self, workers, threads):
+        return [
+            sys.executable, '-m', 'uvicorn', 'bench:served_asgi', '--factory',
+            '--host', '127.0.0.1', '--port', str(self.port),
+            '--workers', str(workers), '--log-level', 'warning', '--no-access-log'
+        ]
+
+def _temp_database_url(args):
+    if args.database_url:
+        return args.database_url, None
+    engine, path = new_database()
+    engine.dispose()
+    return f'sqlite:///{path}', path
+
+def bench_workers(args):
+    """/track throughput under gunicorn as the worker count grows; checks every click is stored"""
+    results = []
+    for workers in args.workers:
+        url, path = _temp_database_url(args)
+        engine = create_engine(url)
+        tp.upgrade_schema(engine)
+        with engine.connect() as conn:
+            clicks_before = conn.execute(select(func.count(Click.id))).scalar()
+
+        # Every click must be stored to count losses, so turn off dedupe and rate limits
+        server = GunicornServer(url, workers, args.threads, {'CLICK_DEDUPE_SECONDS': '0', 'CLICK_RATE_BURST': '1e9'})
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(args.clients) as pool:
+            runs = pool.starmap(_drive_clicks, [
+                (server.port, client, args.duration, 2000) for client in range(args.clients)
+            ])
+        elapsed = time.perf_counter() - started
+        stderr = server.stop()
+
+        ok = sum(r[0] for r in runs)
+        _fail_on_dead_routes({'POST /track': (ok + sum(r[1] for r in runs), sum(r[1] for r in runs))}, stderr)
+        latencies = sorted(ms for r in runs for ms in r[2])
+        with engine.connect() as conn:
+            stored = conn.execute(select(func.count(Click.id))).scalar() - clicks_before
+            duplicate_visitors = conn.execute(select(func.count(Visitor.id) - func.count(Visitor.ip_hash.distinct()))).scalar()
+        engine.dispose()
+        if path:
+            os.remove(path)
+
+        results.append({
+            'backend': url.split(':')[0],
+            'workers': workers,
+            'threads': args.threads,
+            'clients': args.clients,
+            'requests_per_sec': round(ok / elapsed),
+            'p50_ms': round(latencies[len(latencies) // 2], 2) if latencies else None,
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 2) if latencies else None,
+            'errors': sum(r[1] for r in runs),
+            'clicks_lost': ok - stored,
+            'duplicate_visitors': duplicate_visitors,
+            'locked_errors': stderr.count('database is locked')
+        })
+
+    print_table(results, list(results[0]))
+    return results
+
+
+# The repo doesn't ship the visitors/clicks list pages; these stand-ins render
+# every field of every row, so the benchmarks still pay for the full page
+LIST_PAGE_STANDINS = {
+    'admin/visitors.html': (
+        '<table>{% for v in visitors %}<tr><td>{{ v.id }}</td><td>{{ v.ip }}</td><td>{{ v.source }}</td>'
+        '<td>{{ v.first_visit }}</td><td>{{ v.last_visit }}</td><td>{{ v.clicks }}</td>'
+        '<td>{{ v.is_returning }}</td></tr>{% endfor %}</table>{{ next_cursor or "" }}'
+    ),
+    'admin/clicks.html': (
+        '<table>{% for c in clicks %}<tr><td>{{ c.id }}</td><td>{{ c.visitor_id }}</td><td>{{ c.plan }}</td>'
+        '<td>{{ c.time }}</td><td>{{ c.time_ago }}</td><td>{{ c.ip }}</td></tr>{% endfor %}</table>'
+        '{{ next_cursor or "" }}'
+    ),
+}
+
+def _use_repo_templates():
+    """Serve the templates kept at the repo root under the names the app renders"""
+    from jinja2 import ChoiceLoader, DictLoader
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    pages = {}
+    for name, filename in (('public/home.html', 'home.html'), ('admin/dashboard.html', 'dashboard.html')):
+        with open(os.path.join(root, filename), encoding='utf-8') as f:
+            pages[name] = f.read()
+    tp.app.jinja_loader = ChoiceLoader([DictLoader(pages), tp.app.jinja_loader, DictLoader(LIST_PAGE_STANDINS)])
+
+def served_app():
+    """gunicorn entry point for the server benchmarks: the app, rendering the repo's templates"""
+    _use_repo_templates()
+    return tp.app
+
+def served_asgi():
+    """uvicorn --factory entry point: asgi.py's app, rendering the repo's templates"""
+    import asgi
+
+    _use_repo_templates()
+    return asgi.app
+
+def _route_counts(samples):
+    """{route: (requests, errors)} from (route, status, ms) samples; 2xx/3xx count as success"""
+    counts = {}
+    for route, status, ms in samples:
+        requests, errors = counts.get(route, (0, 0))
+        counts[route] = (requests + 1, errors + (not 200 <= status < 400))
+    return counts
+
+def _fail_on_dead_routes(counts, output=''):
+    """Exit if any route failed every request - its latency columns would be all None"""
+    dead = sorted(route for route, (requests, errors) in counts.items() if requests and errors == requests)
+    if dead:
+        raise SystemExit(f"❌ Every request failed for {', '.join(dead)}; server output:\n{output[-2000:]}")
+
+def bench_landing(args):
+    """Landing page response cost: render per request vs the precompressed cached page"""
+    from flask import Response, render_template
+
+    _use_repo_templates()
+    page = tp.CachedPage('public/home.html')
+    browser = 'gzip, deflate, br'
+
+    def render():
+        return Response(render_template('public/home.html'), mimetype='text/html')
+
+    def render_gzip():
+        # What on-the-fly compression middleware would do per request
+        return Response(gzip.compress(render_template('public/home.html').encode('utf-8'), 6),
+                        mimetype='text/html', headers={'Content-Encoding': 'gzip'})
+
+    cases = [
+        ('render_template', {}, render),
+        ('render + gzip', {'Accept-Encoding': 'gzip'}, render_gzip),
+        ('cached identity', {}, page.response),
+        ('cached gzip', {'Accept-Encoding': 'gzip'}, page.response),
+        ('cached br', {'Accept-Encoding': browser}, page.response),
+    ]
+    with tp.app.test_request_context('/', headers={'Accept-Encoding': browser}):
+        etag = page.response().headers['ETag']
+    cases.append(('conditional 304', {'Accept-Encoding': browser, 'If-None-Match': etag}, page.response))
+
+    results = []
+    for name, headers, fn in cases:
+        with tp.app.test_request_context('/', headers=headers):
+            resp = fn()
+            # A 304 goes out without its body
+            sent = 0 if resp.status_code == 304 else len(resp.get_data())
+            results.append(dict(
+                response=name, status=resp.status_code,
+                bytes=sent, **timed(fn, args.repeat * 10)
+            ))
+
+    print_table(results, ['response', 'status', 'bytes', 'p50_ms', 'p95_ms', 'max_ms'])
+    return results
+
+
+def bench_traffic(args):
+    """90-day traffic API queries: raw GROUP BY vs rollups, cold and with the closed-bucket cache"""
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+        with engine.begin() as conn:
+            tp.rebuild_rollups(conn)
+
+        end = datetime.utcnow()
+        start = end - timedelta(days=90)
+        repeat = max(args.repeat // 20, 3)
+
+        with engine.connect() as conn:
+            for bucket in ('hour', 'day'):
+                def raw():
+                    # What the API would cost without rollups: bucket raw clicks in SQL
+                    col = tp.hour_bucket(Click.timestamp, conn) if bucket == 'hour' else func.date(Click.timestamp)
+                    return conn.execute(
+                        select(col, Visitor.source, Click.plan, func.count(Click.id))
+                        .select_from(Click)
+                        .outerjoin(Visitor, Visitor.visitor_id == Click.visitor_id)
+                        .where(Click.timestamp >= start)
+                        .group_by(col, Visitor.source, Click.plan)
+                    ).all()
+
+                results.append(dict(rows=size, bucket=bucket, mode='raw clicks', points='-', **timed(raw, repeat)))
+
+                for dims in ((), ('source', 'plan')):
+                    def cold():
+                        tp.traffic_cache.clear()
+                        return tp.traffic_series(start, end, bucket, dims, engine=engine)
+
+                    def warm():
+                        return tp.traffic_series(start, end, bucket, dims, engine=engine)
+
+                    points = len(cold())
+                    label = '+'.join(dims) or 'total'
+                    results.append(dict(rows=size, bucket=bucket, mode=f'rollups {label}', points=points, **timed(cold, repeat)))
+                    results.append(dict(rows=size, bucket=bucket, mode=f'cached {label}', points=points, **timed(warm, repeat)))
+
+        tp.traffic_cache.clear()
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, ['rows', 'bucket', 'mode', 'points', 'p50_ms', 'p95_ms', 'max_ms'])
+    return results
+
+
+def legacy_detect_source(referrer):
+    """The substring chain detect_source() used to be, for comparison"""
+    if not referrer:
+        return 'direct'
+    ref = referrer.lower()
+    if 'instagram' in ref:
+        return 'instagram'
+    elif 'youtube.com' in ref or 'youtu.be' in ref:
+        return 'youtube'
+    elif 'facebook.com' in ref or 'fb.com' in ref:
+        return 'facebook'
+    elif 'whatsapp' in ref:
+        return 'whatsapp'
+    elif 'tiktok' in ref:
+        return 'tiktok'
+    elif 'telegram' in ref or 't.me' in ref:
+        return 'telegram'
+    return 'other'
+
+def bench_referrers(args):
+    """Referrer classification cost: legacy vs parsed vs memoized (correctness: tests/test_referrers.py)"""
+    # Campaign-shaped traffic: a few hundred distinct referrer URLs, heavily repeated
+    rng = random.Random(5)
+    referrers = [r for r in REFERRERS if r] + [
+        f"https://l.instagram.com/?u=https%3A%2F%2Ftradepass.in%2F&e={i}" for i in range(300)
+    ]
+    traffic = [rng.choice(referrers) for _ in range(args.repeat * 500)]
+
+    def uncached(referrer):
+        return tp.classify_referrer.__wrapped__(referrer)
+
+    # Per-call cost is a few hundred ns, below timed()'s resolution: time whole passes
+    results = []
+    for name, fn in (('legacy substring', legacy_detect_source),
+                     ('parsed, no cache', uncached),
+                     ('parsed + lru_cache', tp.detect_source)):
+        tp.classify_referrer.cache_clear()
+        started = time.perf_counter()
+        for referrer in traffic:
+            fn(referrer)
+        elapsed = time.perf_counter() - started
+        results.append({'classifier': name, 'ns_per_call': round(elapsed / len(traffic) * 1e9)})
+    info = tp.classify_referrer.cache_info()
+
+    print_table(results, ['classifier', 'ns_per_call'])
+    print(f"cache: {info.hits} hits, {info.misses} misses, {info.currsize}/{info.maxsize} entries")
+    return results
+
+
+def bench_interning(args):
+    """Visitor storage with user agent/referrer as inline text vs interned ids: size, inserts, family scan"""
+    from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, insert
+
+    legacy = Table(
+        'visitor', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('visitor_id', String(20), unique=True, index=True),
+        Column('ip_hash', String(64), unique=True, index=True),
+        Column('user_agent', Text), Column('referrer', Text), Column('source', String(50)),
+        Column('first_visit', DateTime, index=True), Column('last_visit', DateTime, index=True)
+    )
+
+    results = []
+    for size in args.sizes:
+        rng = random.Random(3)
+        now = datetime.utcnow()
+        # Referrers carry per-click tracking parameters, so they repeat less than user agents
+        referrers = [None] + [f"{rng.choice(REFERRERS[1:])}?fbclid={i:x}" for i in range(500)]
+        events = [{
+            'visitor_id': f"V{1000 + i}", 'ip_hash': f"{i:016x}", 'user_agent': rng.choice(USER_AGENTS),
+            'referrer': rng.choice(referrers), 'source': rng.choice(SOURCES), 'first_visit': now, 'last_visit': now
+        } for i in range(size)]
+
+        for mode in ('text columns', 'interned'):
+            if mode == 'interned':
+                engine, path = new_database()
+            else:
+                fd, path = tempfile.mkstemp(suffix='.db', prefix='tradepass-bench-')
+                os.close(fd)
+                engine = create_engine(f'sqlite:///{path}')
+                legacy.metadata.create_all(engine)
+            interners = (tp.StringInterner(tp.UserAgent, tp._describe_user_agent), tp.StringInterner(tp.Referrer))
+
+            started = time.perf_counter()
+            for i in range(0, size, tp.INGEST_BATCH_SIZE):
+                batch = [dict(e) for e in events[i:i + tp.INGEST_BATCH_SIZE]]
+                with engine.begin() as conn:
+                    if mode == 'interned':
+                        agent_ids = interners[0].ids(conn, {e['user_agent'] for e in batch})
+                        referrer_ids = interners[1].ids(conn, {e['referrer'] for e in batch})
+                        for e in batch:
+                            e['user_agent_id'] = agent_ids.get(e.pop('user_agent'))
+                            e['referrer_id'] = referrer_ids.get(e.pop('referrer'))
+                        conn.execute(insert(Visitor.__table__), batch)
+                    else:
+                        conn.execute(insert(legacy), batch)
+            insert_secs = time.perf_counter() - started
+
+            # Visitors per browser family: parse every row vs GROUP BY over the ids
+            with engine.connect() as conn:
+                started = time.perf_counter()
+                if mode == 'interned':
+                    conn.execute(
+                        select(tp.UserAgent.family, func.count(Visitor.id))
+                        .join(tp.UserAgent, tp.UserAgent.id == Visitor.user_agent_id)
+                        .group_by(tp.UserAgent.family)
+                    ).all()
+                else:
+                    families = {}
+                    for (ua,) in conn.execute(select(legacy.c.user_agent)):
+                        family = tp.parse_user_agent(ua)[0]
+                        families[family] = families.get(family, 0) + 1
+                scan_ms = (time.perf_counter() - started) * 1000
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+            engine.dispose()
+
+            results.append({
+                'rows': size, 'storage': mode,
+                'db_mb': round(os.path.getsize(path) / 1e6, 2),
+                'inserts_per_sec': round(size / insert_secs),
+                'family_scan_ms': round(scan_ms, 1)
+            })
+            os.remove(path)
+
+    print_table(results, ['rows', 'storage', 'db_mb', 'inserts_per_sec', 'family_scan_ms'])
+    return results
+
+
+def bench_visit_log(args):
+    """Returning visits: last_visit UPDATEs vs visit log appends; expiring and counting days: one table vs partitions"""
+    from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, bindparam, insert, update
+
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+        tp.upgrade_schema(engine)
+        tp.known_partitions.clear()
+        with engine.connect() as conn:
+            visitors = conn.execute(select(Visitor.visitor_id, Visitor.ip_hash)).all()
+
+        rng = random.Random(size)
+        batch_size = min(500, len(visitors))
+        now = datetime.utcnow()
+        table = Visitor.__table__
+        repeat = max(args.repeat // 10, 5)
+
+        def update_batch():
+            # The old write path: one coalesced UPDATE per returning visitor
+            with engine.begin() as conn:
+                conn.execute(
+                    update(table).where(table.c.ip_hash == bindparam('h')).values(last_visit=bindparam('at')),
+                    [{'h': v.ip_hash, 'at': now} for v in rng.sample(visitors, batch_size)]
+                )
+
+        def append_batch():
+            with engine.begin() as conn:
+                tp.append_visits(conn, [{'visitor_id': v.visitor_id, 'source': 'direct', 'at': now}
+                                        for v in rng.sample(visitors, batch_size)])
+
+        tp.ensure_visit_partitions({now.date()}, engine)
+        results.append(dict(rows=size, operation=f'{batch_size} visits: UPDATE last_visit', **timed(update_batch, repeat)))
+        results.append(dict(rows=size, operation=f'{batch_size} visits: append to log', **timed(append_batch, repeat)))
+        with engine.begin() as conn:
+            started = time.perf_counter()
+            tp.refresh_visitor_profiles(conn)
+            ms = round((time.perf_counter() - started) * 1000, 3)
+        results.append(dict(rows=size, operation=f'fold {repeat * batch_size} visits into profiles',
+                            p50_ms=ms, p95_ms=ms, max_ms=ms))
+
+        # Ten days of history, once in a single indexed table and once partitioned
+        days = [now.date() - timedelta(days=d) for d in range(10, 0, -1)]
+        per_day = max(size // 10, 1)
+        flat = Table('visit_flat', MetaData(), Column('id', Integer, primary_key=True),
+                     Column('visitor_id', String(20)), Column('source', String(50)), Column('at', DateTime),
+                     Index('ix_visit_flat_at', 'at'))
+        tp.ensure_visit_partitions(days, engine)
+        with engine.begin() as conn:
+            flat.create(conn)
+            for day in days:
+                start = datetime.combine(day, datetime.min.time())
+                rows = [{'visitor_id': visitors[rng.randrange(len(visitors))].visitor_id,
+                         'source': rng.choice(SOURCES), 'at': start + timedelta(seconds=i * 86400 // per_day)}
+                        for i in range(per_day)]
+                conn.execute(insert(flat), rows)
+                tp.append_visits(conn, rows)
+
+        week_start = datetime.combine(days[3], datetime.min.time())
+        with engine.connect() as conn:
+            def flat_per_day():
+                conn.execute(select(func.date(flat.c.at), func.count(), func.count(flat.c.visitor_id.distinct()))
+                             .where(flat.c.at >= week_start).group_by(func.date(flat.c.at))).all()
+
+            def partitioned_per_day():
+                tp.visits_per_day(conn, days[3], days[-1])
+
+            results.append(dict(rows=size, operation='7 days per day: one table', **timed(flat_per_day, 5)))
+            results.append(dict(rows=size, operation='7 days per day: partitions', **timed(partitioned_per_day, 5)))
+
+        expire = datetime.combine(days[1], datetime.min.time())
+        with engine.begin() as conn:
+            started = time.perf_counter()
+            deleted = conn.execute(flat.delete().where(flat.c.at < expire)).rowcount
+            ms = round((time.perf_counter() - started) * 1000, 3)
+        results.append(dict(rows=size, operation=f'expire a day: DELETE {deleted} rows', p50_ms=ms, p95_ms=ms, max_ms=ms))
+        with engine.begin() as conn:
+            started = time.perf_counter()
+            tp.drop_visit_partitions(conn, days[1])
+            ms = round((time.perf_counter() - started) * 1000, 3)
+        results.append(dict(rows=size, operation='expire a day: DROP TABLE', p50_ms=ms, p95_ms=ms, max_ms=ms))
+
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, ['rows', 'operation', 'p50_ms', 'p95_ms', 'max_ms'])
+    return results
+
+
+def bench_uniques(args):
+    """Per-plan/source clickers on seeded clicks: exact COUNT(DISTINCT) vs stored sketches (accuracy: tests/test_uniques.py)"""
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+        tp.upgrade_schema(engine)
+        end = datetime.utcnow().date()
+        start = end - timedelta(days=89)
+        click_rows = (select(Click.visitor_id, Click.plan, Click.timestamp, Visitor.source)
+                      .join(Visitor, Visitor.visitor_id == Click.visitor_id))
+
+        # The write path's own sketch code, fed the seeded clicks a day at a time
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            sketches = {}
+            for row in conn.execute(click_rows.order_by(Click.timestamp)):
+                tp.add_to_sketch(sketches, 'clickers', row.timestamp, row.source, row.plan, row.visitor_id)
+            tp.merge_sketches(conn, sketches)
+            stored_bytes = conn.execute(select(func.sum(func.length(tp.UniqueSketch.registers)))).scalar()
+        build_s = time.perf_counter() - started
+
+        with engine.connect() as conn:
+            for by, column in (('plan', Click.plan), ('source', Visitor.source)):
+                def exact():
+                    return dict(conn.execute(
+                        select(column, func.count(Click.visitor_id.distinct()))
+                        .join(Visitor, Visitor.visitor_id == Click.visitor_id)
+                        .where(Click.timestamp >= datetime.combine(start, datetime.min.time()))
+                        .group_by(column)
+                    ).all())
+
+                def estimated():
+                    return tp.unique_counts(conn, 'clickers', start, end, by=by)
+
+                truth, estimate = exact(), estimated()
+                exact_ms = timed(exact, 3)['p50_ms']
+                sketch_ms = timed(estimated, 3)['p50_ms']
+                for key in sorted(truth):
+                    error = estimate.get(key, 0) / truth[key] - 1
+                    results.append({
+                        'rows': size, 'by': by, 'value': key, 'exact': truth[key], 'estimate': estimate.get(key, 0),
+                        'error': f"{error:+.2%}",
+                        'exact_ms': exact_ms, 'sketch_ms': sketch_ms
+                    })
+        print(f"Sketches built in {build_s:.1f} s, {len(sketches)} stored in {stored_bytes:,} bytes")
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, list(results[0]))
+    return results
+
+
+def _naive_attribution(conn, start, end):
+    """Reference answer the slow way: every visitor's clicks fetched one visitor at a time"""
+    window = timedelta(days=tp.ATTRIBUTION_WINDOW_DAYS)
+    visitors = clickers = clicks = revenue = 0
+    for visitor_id, first_visit in conn.execute(
+        select(Visitor.visitor_id, Visitor.first_visit)
+        .where(Visitor.first_visit >= datetime.combine(start, datetime.min.time()),
+               Visitor.first_visit < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    ):
+        visitors += 1
+        plans = [plan for plan, at in conn.execute(
+            select(Click.plan, Click.timestamp).where(Click.visitor_id == visitor_id)
+        ) if timedelta(0) <= at - first_visit < window]
+        clickers += bool(plans)
+        clicks += len(plans)
+        revenue += sum(tp.PLAN_PRICES.get(plan, 0) for plan in plans)
+    return {'visitors': visitors, 'clickers': clickers, 'clicks': clicks, 'revenue': revenue}
+
+def bench_attribution(args):
+    """90-day source -> plan attribution: per-visitor queries vs the grouped join, cold and with closed days cached"""
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        # Several clicks per visitor, so the window and multi-plan clickers matter
+        seed(path, size, clicks_per_visitor=3.0)
+        tp.upgrade_schema(engine)
+        end = datetime.utcnow().date()
+        start = end - timedelta(days=89)
+
+        def cold():
+            tp.attribution_cache.clear()
+            return tp.attribution_report(start, end, engine=engine)
+
+        def warm():
+            return tp.attribution_report(start, end, engine=engine)
+
+        report = cold()
+        timings = [('grouped join, cold', timed(cold, 3)), ('grouped join, closed days cached', timed(warm, 10))]
+
+        check = '-'
+        if size <= 100000:
+            with engine.connect() as conn:
+                started = time.perf_counter()
+                expected = _naive_attribution(conn, start, end)
+                ms = round((time.perf_counter() - started) * 1000, 3)
+            timings.insert(0, ('per-visitor queries', {'p50_ms': ms, 'p95_ms': ms, 'max_ms': ms}))
+            got = {k: report['totals'][k] for k in expected}
+            check = '✅' if got == expected else f"❌ {got} != {expected}"
+
+        for method, timing in timings:
+            results.append(dict(rows=size, clicks=size * 3, method=method, **timing,
+                                visitors=report['totals']['visitors'], clickers=report['totals']['clickers'],
+                                revenue=report['totals']['revenue'], matches_naive=check))
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, ['rows', 'clicks', 'method', 'p50_ms', 'p95_ms', 'max_ms',
+                          'visitors', 'clickers', 'revenue', 'matches_naive'])
+    return results
+
+def bench_dashboard(args):
+    """/admin/dashboard build: from scratch, with the stats context cached, and with the rendered page cached"""
+    _use_repo_templates()
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+        tp.upgrade_schema(engine)
+        now = datetime.utcnow()
+
+        def rebuild():
+            # What every load cost before the cache
+            tp.dashboard_page_cache.clear()
+            tp.dashboard_context_cache.clear()
+            return tp.dashboard_page('bench@example.com', now, engine)
+
+        emails = iter(range(10 ** 9))
+
+        def context_hit():
+            # Another admin (or a new minute): stats reused, page rendered
+            return tp.dashboard_page(f'admin{next(emails)}@example.com', now, engine)
+
+        def page_hit():
+            return tp.dashboard_page('bench@example.com', now, engine)
+
+        with tp.app.test_request_context():
+            fresh = rebuild()
+            timings = [
+                ('rebuilt every load', timed(rebuild, args.repeat // 10 or 1)),
+                ('stats cached, page rendered', timed(context_hit, args.repeat)),
+                ('page cached', timed(page_hit, args.repeat)),
+            ]
+            cached = page_hit()
+            tp.dashboard_page_cache.clear()
+            tp.dashboard_context_cache.clear()
+            check = '✅' if cached == fresh == tp.dashboard_page('bench@example.com', now, engine) else '❌'
+
+        for method, timing in timings:
+            results.append(dict(rows=size, method=method, **timing, same_page=check))
+        engine.dispose()
+        os.remove(path)
+
+    print_table(results, list(results[0]))
+    return results
+
+
+async def _read_response(reader):
+    """(status, keep_alive) for one HTTP/1.1 response, body discarded"""
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    headers = dict(line.lower().split(': ', 1) for line in head[1:] if ': ' in line)
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(head[0].split()[1]), headers.get('connection') != 'close'
+
+async def _hold_connection(port, client, deadline, samples):
+    """One keep-alive client alternating GET / and POST /track until the deadline"""
+    ip = f"10.{client // 62500}.{client // 250 % 250}.{client % 250}"
+    headers = f"Host: 127.0.0.1\r\nUser-Agent: {USER_AGENTS[2]}\r\nX-Forwarded-For: {ip}\r\n"
+    body = json.dumps({'plan': PLANS[client % len(PLANS)]})
+    requests = [
+        ('GET /', f"GET / HTTP/1.1\r\n{headers}Accept-Encoding: gzip\r\n\r\n".encode()),
+        ('POST /track', (f"POST /track HTTP/1.1\r\n{headers}Content-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n{body}").encode()),
+    ]
+    reader = writer = None
+    sent = 0
+    while time.monotonic() < deadline:
+        route, raw = requests[sent % 2]
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 30)
+            writer.write(raw)
+            status, keep_alive = await asyncio.wait_for(_read_response(reader), 30)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            status, keep_alive = 0, False
+        samples.append((route, status, (time.perf_counter() - started) * 1000))
+        sent += 1
+        if not keep_alive and writer is not None:
+            writer.close()
+            writer = None
+        if status == 0:
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+def _drive_connections(port, first, count, duration):
+    """Client process: count concurrent connections on one event loop; returns [(route, status, ms)]"""
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    async def run():
+        samples = []
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(
+            _hold_connection(port, client, deadline, samples) for client in range(first, first + count)
+        ))
+        return samples
+    return asyncio.run(run())
+
+def bench_asgi(args):
+    """/ and /track as concurrent connections grow: gunicorn (sync Flask) vs uvicorn (asgi.py)"""
+    results = []
+    for connections in args.connections:
+        for server_class in (GunicornServer, UvicornServer):
+            url, path = _temp_database_url(args)
+            engine = create_engine(url)
+            tp.upgrade_schema(engine)
+            with engine.connect() as conn:
+                clicks_before = conn.execute(select(func.count(Click.id))).scalar()
+
+            # Each connection is its own visitor hitting / and /track back to back
+            server = server_class(url, args.workers[0], args.threads, {
+                'CLICK_DEDUPE_SECONDS': '0', 'CLICK_RATE_BURST': '1e9', 'VISIT_RATE_BURST': '1e9'
+            })
+            clients = min(args.clients, connections)
+            bounds = [client * connections // clients for client in range(clients + 1)]
+            started = time.perf_counter()
+            with multiprocessing.get_context('fork').Pool(clients) as pool:
+                runs = pool.starmap(_drive_connections, [
+                    (server.port, bounds[i], bounds[i + 1] - bounds[i], args.duration) for i in range(clients)
+                ])
+            elapsed = time.perf_counter() - started
+            output = server.stop()
+
+            samples = [sample for run in runs for sample in run]
+            _fail_on_dead_routes(_route_counts(samples), output)
+            ok_clicks = sum(1 for route, status, ms in samples if route == 'POST /track' and status == 200)
+            latencies = sorted(ms for route, status, ms in samples if status == 200)
+            with engine.connect() as conn:
+                stored = conn.execute(select(func.count(Click.id))).scalar() - clicks_before
+            engine.dispose()
+            if path:
+                os.remove(path)
+
+            results.append({
+                'server': server.name,
+                'connections': connections,
+                'requests_per_sec': round(len(latencies) / elapsed),
+                'p50_ms': _percentile(latencies, 0.50),
+                'p99_ms': _percentile(latencies, 0.99),
+                'errors': len(samples) - len(latencies),
+                'clicks_lost': ok_clicks - stored,
+                'locked_errors': output.count('database is locked')
+            })
+
+    print_table(results, list(results[0]))
+    return results
+
+
+# Load mix: (weight, route label). Each client process picks from it per request.
+LOAD_MIX = [
+    (30, 'GET / (new)'),
+    (35, 'GET / (returning)'),
+    (15, 'POST /track (burst)'),
+    (5, 'POST /track/batch'),
+    (8, 'GET /admin/dashboard'),
+    (4, 'GET /admin/visitors'),
+    (3, 'GET /admin/api/traffic'),
+]
+LOAD_ADMIN = {'ADMIN_EMAIL': 'bench@example.com', 'ADMIN_PASSWORD': 'bench-password'}
+LOAD_METRICS_TOKEN = 'bench-metrics-token'
+# Which Flask url_rule each load route is reported under in /admin/metrics
+LOAD_RULES = {
+    'GET / (new)': '/', 'GET / (returning)': '/', 'POST /track (burst)': '/track',
+    'POST /track/batch': '/track/batch', 'GET /admin/dashboard': '/admin/dashboard',
+    'GET /admin/visitors': '/admin/visitors', 'GET /admin/api/traffic': '/admin/api/traffic',
+}
+
+def _admin_cookie(port):
+    """Log in once and return the session cookie for admin requests"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    body = f"email={LOAD_ADMIN['ADMIN_EMAIL']}&password={LOAD_ADMIN['ADMIN_PASSWORD']}"
+    conn.request('POST', '/admin/login', body=body,
+                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    cookie = conn.getresponse().getheader('Set-Cookie', '').split(';')[0]
+    conn.close()
+    if not cookie:
+        raise SystemExit('❌ admin login failed')
+    return cookie
+
+def _drive_mix(port, client, duration, returning_ips, cookie):
+    """Client process: weighted mix of public and admin requests; returns [(route, status, ms)]"""
+    rng = random.Random(client)
+    routes = [route for weight, route in LOAD_MIX for _ in range(weight)]
+    admin = {'Cookie': cookie}
+    samples = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        route = rng.choice(routes)
+        returning = f"10.0.{rng.randrange(returning_ips) // 250}.{rng.randrange(250)}"
+        if route == 'GET / (new)':
+            ip = f"10.{client + 1}.{rng.randrange(250)}.{rng.randrange(250)}"
+            samples.append((route, *_request(port, 'GET', '/', ip=ip)))
+        elif route == 'GET / (returning)':
+            samples.append((route, *_request(port, 'GET', '/', ip=returning)))
+        elif route == 'POST /track (burst)':
+            # A visitor hammering the buy buttons
+            for _ in range(rng.randint(2, 5)):
+                samples.append((route, *_request(port, 'POST', '/track', {'plan': rng.choice(PLANS)}, returning)))
+        elif route == 'POST /track/batch':
+            events = [{'type': 'click', 'plan': rng.choice(PLANS), 'id': f"{client}-{rng.getrandbits(64):x}"}
+                      for _ in range(rng.randint(1, 4))]
+            samples.append((route, *_request(port, 'POST', '/track/batch', {'events': events}, returning)))
+        elif route == 'GET /admin/dashboard':
+            samples.append((route, *_request(port, 'GET', '/admin/dashboard', headers=admin)))
+        elif route == 'GET /admin/visitors':
+            samples.append((route, *_request(port, 'GET', '/admin/visitors?limit=100', headers=admin)))
+        else:
+            samples.append((route, *_request(port, 'GET', '/admin/api/traffic?bucket=hour&by=source', headers=admin)))
+    return samples
+
+def _route_metrics(port):
+    """{url_rule: (requests, sql queries)} from the /admin/metrics worker that answers the scrape"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', '/admin/metrics', headers={'Authorization': f'Bearer {LOAD_METRICS_TOKEN}'})
+    text = conn.getresponse().read().decode()
+    conn.close()
+    totals = {}
+    for line in text.splitlines():
+        for suffix, slot in (('_count', 0), ('_sum', 1)):
+            prefix = f'tradepass_request_sql_queries{suffix}{{route="'
+            if line.startswith(prefix):
+                rule, value = line[len(prefix):].split('"}')
+                totals.setdefault(rule, [0, 0])[slot] = float(value)
+    return totals
+
+def _percentile(samples, q):
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))], 2) if samples else None
+
+def _compare_to_baseline(results, path, tolerance):
+    """Print p95/rps changes against an earlier --json run; returns the routes that regressed"""
+    with open(path) as f:
+        baseline = {(r['rows'], r['route']): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"\n📏 Against {path} (tolerance {tolerance:.0%}):")
+    for r in results:
+        before = baseline.get((r['rows'], r['route']))
+        if not before or not before['p95_ms'] or not r['p95_ms']:
+            continue
+        change = r['p95_ms'] / before['p95_ms'] - 1
+        flag = '❌' if change > tolerance else '✅'
+        print(f"{flag} {r['rows']:>8} {r['route']:<24} p95 {before['p95_ms']} -> {r['p95_ms']} ms ({change:+.0%}), "
+              f"rps {before['requests_per_sec']} -> {r['requests_per_sec']}")
+        if change > tolerance:
+            regressions.append(r['route'])
+    return regressions
+
+def bench_load(args):
+    """Mixed public/admin traffic against gunicorn on seeded databases: latency, rps and queries per request"""
+    results = []
+    for size in args.sizes:
+        if args.database_url:
+            url, path = args.database_url, None
+            engine = create_engine(url)
+        else:
+            engine, path = new_database()
+            print(f"🌱 Seeding {size:,} visitors / clicks...")
+            seed(path, size)
+            url = f'sqlite:///{path}'
+        # Records the schema version and builds the rollups for the seeded rows
+        tp.upgrade_schema(engine)
+        engine.dispose()
+
+        server = GunicornServer(url, args.workers[0], args.threads, dict(LOAD_ADMIN, METRICS_TOKEN=LOAD_METRICS_TOKEN))
+        cookie = _admin_cookie(server.port)
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(args.clients) as pool:
+            runs = pool.starmap(_drive_mix, [
+                (server.port, client, args.duration, min(size, 20000), cookie) for client in range(args.clients)
+            ])
+        elapsed = time.perf_counter() - started
+        queries = _route_metrics(server.port)
+        output = server.stop()
+        if path:
+            os.remove(path)
+
+        samples = [sample for run in runs for sample in run]
+        _fail_on_dead_routes(_route_counts(samples), output)
+        by_route = {}
+        for route, status, ms in samples:
+            by_route.setdefault(route, []).append((status, ms))
+        by_route['all'] = [sample for samples in by_route.values() for sample in samples]
+        for route, samples in by_route.items():
+            latencies = sorted(ms for status, ms in samples if 200 <= status < 400)
+            requests, sql = queries.get(LOAD_RULES.get(route), (0, 0))
+            results.append({
+                'rows': size,
+                'route': route,
+                'requests': len(samples),
+                'errors': sum(1 for status, ms in samples if not 200 <= status < 400),
+                'requests_per_sec': round(len(samples) / elapsed, 1),
+                'p50_ms': _percentile(latencies, 0.50),
+                'p95_ms': _percentile(latencies, 0.95),
+                'p99_ms': _percentile(latencies, 0.99),
+                'queries_per_request': round(sql / requests, 2) if requests else '-'
+            })
+
+    print_table(results, ['rows', 'route', 'requests', 'errors', 'requests_per_sec',
+                          'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'])
+    # A regressed run exits before --json is written, so it can't become the next baseline
+    if args.baseline and _compare_to_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+    return results
+
+
+# Heavy admin reads: whole-table streams and exports plus the dashboard
+ADMIN_READS = [
+    '/admin/visitors?stream=1&limit=100000',
+    '/admin/clicks?stream=1&limit=100000',
+    '/admin/export/visitors?format=csv',
+    '/admin/dashboard',
+]
+
+def _drive_admin_reads(port, reader, duration, cookie):
+    """Reader process: fetch ADMIN_READS in turn, reading every body to the end; returns (done, errors, throttled, samples)"""
+    done = errors = throttled = 0
+    samples = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        path = ADMIN_READS[(reader + done + errors) % len(ADMIN_READS)]
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        try:
+            conn.request('GET', path, headers={'Cookie': cookie})
+            response = conn.getresponse()
+            while response.read(65536):
+                pass
+            if response.status != 503:
+                samples.append((path, response.status, 0))
+            if response.status == 200:
+                done += 1
+            elif response.status == 503 and response.getheader('Retry-After'):
+                # Turned away by ADMIN_READ_SLOTS; back off like a well-behaved client
+                throttled += 1
+                time.sleep(float(response.getheader('Retry-After')))
+            else:
+                errors += 1
+        except OSError:
+            errors += 1
+            samples.append((path, 0, 0))
+        finally:
+            conn.close()
+    return done, errors, throttled, samples
+
+class NiceGunicornServer(GunicornServer):
+    """A second gunicorn at lower CPU priority, serving only the admin readers"""
+    name = 'gunicorn (nice)'
+
+    def command(self, workers, threads):
+        return ['nice', '-n', '10'] + super().command(workers, threads)
+
+# (label, READ_SEPARATE, ADMIN_READ_SLOTS, admin reads go to a separate niced server)
+READ_ISOLATION_SETUPS = [
+    ('primary engine', '0', '0', False),
+    ('read engine', '1', '0', False),
+    ('read engine + 1 slot', '1', '1', False),
+    ('read engine + 2 slots', '1', '2', False),
+    ('admin server (nice 10)', '1', '0', True),
+]
+
+def bench_read_isolation(args):
+    """/track latency with and without heavy admin reads: shared engine, read engine, capped admin slots, separate admin server"""
+    results = []
+    for size in args.sizes:
+        engine, path = new_database()
+        print(f"🌱 Seeding {size:,} visitors / clicks...")
+        seed(path, size)
+        tp.upgrade_schema(engine)
+        engine.dispose()
+        url = f'sqlite:///{path}'
+
+        for reads, separate, slots, own_server in READ_ISOLATION_SETUPS:
+            env = dict(LOAD_ADMIN, READ_SEPARATE=separate, ADMIN_READ_SLOTS=slots,
+                       CLICK_DEDUPE_SECONDS='0', CLICK_RATE_BURST='1e9')
+            server = GunicornServer(url, args.workers[0], args.threads, env)
+            admin_server = NiceGunicornServer(url, 1, args.threads, env) if own_server else server
+            cookie = _admin_cookie(admin_server.port)
+            samples = []
+            for readers in (0, args.readers):
+                context = multiprocessing.get_context('fork')
+                with context.Pool(args.clients + readers) as pool:
+                    admin = [pool.apply_async(_drive_admin_reads, (admin_server.port, r, args.duration, cookie))
+                             for r in range(readers)]
+                    runs = pool.starmap(_drive_clicks, [
+                        (server.port, client, args.duration, min(size, 20000)) for client in range(args.clients)
+                    ])
+                    admin = [a.get() for a in admin]
+                latencies = sorted(ms for r in runs for ms in r[2])
+                results.append({
+                    'rows': size,
+                    'admin_reads': reads,
+                    'readers': readers,
+                    'track_per_sec': round(sum(r[0] for r in runs) / args.duration),
+                    'p50_ms': _percentile(latencies, 0.50),
+                    'p99_ms': _percentile(latencies, 0.99),
+                    'track_errors': sum(r[1] for r in runs),
+                    'admin_pages': sum(a[0] for a in admin),
+                    'admin_errors': sum(a[1] for a in admin),
+                    'admin_throttled': sum(a[2] for a in admin),
+                })
+                samples += [sample for a in admin for sample in a[3]]
+                samples += [('POST /track', 200, 0)] * sum(r[0] for r in runs)
+                samples += [('POST /track', 0, 0)] * sum(r[1] for r in runs)
+            output = server.stop() + (admin_server.stop() if own_server else '')
+            _fail_on_dead_routes(_route_counts(samples), output)
+            results[-1]['locked_errors'] = results[-2]['locked_errors'] = output.count('database is locked')
+        os.remove(path)
+
+    print_table(results, list(results[0]))
+    return results
+
+
+BENCHMARKS = {
+    'lookups': bench_lookups,
+    'visitor-ids': bench_visitor_ids,
+    'export': bench_export,
+    'visitor-cache': bench_visitor_cache,
+    'workers': bench_workers,
+    'landing': bench_landing,
+    'traffic': bench_traffic,
+    'referrers': bench_referrers,
+    'interning': bench_interning,
+    'load': bench_load,
+    'visit-log': bench_visit_log,
+    'uniques': bench_uniques,
+    'attribution': bench_attribution,
+    'asgi': bench_asgi,
+    'read-isolation': bench_read_isolation,
+    'dashboard': bench_dashboard,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='TradePass benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--per-thread', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--connections', type=int, nargs='+', default=[10, 100, 1000],
+                        help='asgi: concurrent keep-alive connections per run')
+    parser.add_argument('--readers', type=int, default=4, help='read-isolation: concurrent admin reader processes')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--database-url', help='run server benchmarks against this database instead of a temp SQLite file')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--baseline', help='load: compare p95 latency against an earlier --json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='load: allowed p95 regression before exiting 1')
+    args = parser.parse_args()
+
+    results = BENCHMARKS[args.benchmark](args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': args.benchmark, 'results': results}, f, indent=2, default=str)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""Shared fixtures: import the app against a throwaway database, never tradepass.db"""
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix='tradepass-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(SCRATCH, 'app.db')}"
+os.environ['METRICS_DIR'] = os.path.join(SCRATCH, 'metrics')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, ROOT)
+
+import app as tp  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """An empty SQLite file with the app schema; yields (engine, path)"""
+    path = str(tmp_path / 'tradepass.db')
+    engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 30})
+    with engine.begin() as conn:
+        tp.db.metadata.create_all(conn)
+    yield engine, path
+    engine.dispose()
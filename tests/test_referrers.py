@@ -0,0 +1,62 @@
+"""Referrer/UTM source classification against a corpus of real-world referrers"""
+import pytest
+
+import app as tp
+
+# (referrer, landing page utm_source, expected source)
+REFERRER_CORPUS = [
+    (None, None, 'direct'),
+    ('', None, 'direct'),
+    ('https://www.instagram.com/', None, 'instagram'),
+    ('https://l.instagram.com/?u=https%3A%2F%2Ftradepass.in%2F&e=AT0', None, 'instagram'),
+    ('android-app://com.instagram.android/', None, 'instagram'),
+    ('instagram.com', None, 'instagram'),
+    ('https://www.youtube.com/watch?v=abc123', None, 'youtube'),
+    ('https://m.youtube.com/', None, 'youtube'),
+    ('https://youtu.be/abc123', None, 'youtube'),
+    ('android-app://com.google.android.youtube/', None, 'youtube'),
+    ('https://m.facebook.com/', None, 'facebook'),
+    ('https://lm.facebook.com/l.php?u=https%3A%2F%2Ftradepass.in', None, 'facebook'),
+    ('https://fb.com/groups/traders', None, 'facebook'),
+    ('https://web.whatsapp.com/', None, 'whatsapp'),
+    ('https://wa.me/919999999999', None, 'whatsapp'),
+    ('https://www.tiktok.com/@trader', None, 'tiktok'),
+    ('https://t.me/tradepass_channel', None, 'telegram'),
+    ('https://web.telegram.org/k/', None, 'telegram'),
+    ('HTTPS://WWW.INSTAGRAM.COM/', None, 'instagram'),
+    ('https://www.instagram.com./', None, 'instagram'),
+    # Substring matches the old chain got wrong
+    ('https://blog.example.com/posts/t.me-links', None, 'other'),
+    ('https://news.example.com/?ref=fb.com', None, 'other'),
+    ('https://notfacebook.com/', None, 'other'),
+    ('https://example.com/how-to-use-instagram', None, 'other'),
+    ('https://watch.youtube.com.evil.example/', None, 'other'),
+    ('https://www.google.com/', None, 'other'),
+    ('https://tradepass.in/', None, 'other'),
+    ('not a url at all', None, 'other'),
+    ('https://[broken', None, 'other'),
+    # UTM tags win over the referrer host
+    ('https://www.google.com/', 'instagram', 'instagram'),
+    (None, 'ig', 'instagram'),
+    (None, 'YouTube', 'youtube'),
+    (None, 'wa.me', 'whatsapp'),
+    ('https://t.me/x', 'made-up-campaign', 'telegram'),
+    (None, 'made-up-campaign', 'direct'),
+    ('https://tradepass.in/?utm_source=fb&utm_medium=paid', None, 'facebook'),
+    ('https://tradepass.in/?utm_source=unknown', None, 'other'),
+]
+
+
+@pytest.mark.parametrize('referrer, utm_source, expected', REFERRER_CORPUS)
+def test_detect_source(referrer, utm_source, expected):
+    assert tp.detect_source(referrer, utm_source) == expected
+
+
+def test_memoized_matches_uncached():
+    for referrer, utm_source, expected in REFERRER_CORPUS:
+        if not referrer:
+            continue
+        memoized = tp.classify_referrer(referrer)
+        assert memoized == tp.classify_referrer.__wrapped__(referrer)
+        if not utm_source:
+            assert memoized == expected
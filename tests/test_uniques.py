@@ -0,0 +1,83 @@
+"""HyperLogLog unique counts: estimates stay within the documented error bound"""
+import statistics
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import app as tp
+
+STANDARD_ERROR = tp.HLL_STANDARD_ERROR
+BOUND = 2 * STANDARD_ERROR  # the error_bound /admin/api/uniques reports, ~95% of estimates
+TRIALS = {100: 20, 1000: 20, 10000: 10, 100000: 3}
+
+
+def sketch_of(values):
+    sketch = tp.HyperLogLog()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+@pytest.fixture(scope='module')
+def relative_errors():
+    """count() / true count - 1 for several independent sketches at each cardinality"""
+    return {
+        n: [sketch_of(f"V{n}-{trial}-{i}" for i in range(n)).count() / n - 1 for trial in range(trials)]
+        for n, trials in TRIALS.items()
+    }
+
+
+def test_estimates_within_documented_bound(relative_errors):
+    errors = [abs(e) for trials in relative_errors.values() for e in trials]
+    assert sum(e <= BOUND for e in errors) / len(errors) >= 0.9
+    assert statistics.mean(errors) <= STANDARD_ERROR
+    # 99.7% should be inside 3 standard errors; 4 leaves room for an unlucky hash, not for a bias
+    assert max(errors) <= 4 * STANDARD_ERROR
+
+
+@pytest.mark.parametrize('n', sorted(TRIALS))
+def test_no_bias_at_any_cardinality(relative_errors, n):
+    assert abs(statistics.mean(relative_errors[n])) <= BOUND
+
+
+def test_small_counts():
+    assert tp.HyperLogLog().count() == 0
+    for n in (1, 2, 5, 10):
+        assert sketch_of(f"V{i}" for i in range(n)).count() == n
+    assert sketch_of(['V1'] * 1000).count() == 1
+
+
+def test_merge_is_sketch_of_union():
+    a = sketch_of(f"V{i}" for i in range(0, 6000))
+    b = sketch_of(f"V{i}" for i in range(4000, 10000))
+    union = sketch_of(f"V{i}" for i in range(0, 10000))
+    assert tp.HyperLogLog.union([a, b]).registers == union.registers
+    assert a.merge(b).registers == union.registers
+    assert tp.HyperLogLog.from_bytes(union.to_bytes()).registers == union.registers
+
+
+def test_unique_counts_from_stored_sketches(database):
+    engine, path = database
+    start = date(2024, 1, 1)
+    days = [datetime.combine(start + timedelta(days=d), datetime.min.time()) for d in range(3)]
+
+    # Clickers repeat across days and plans; exact answers kept alongside
+    exact = {'plan_99': set(), 'plan_149': set()}
+    with engine.begin() as conn:
+        for day in days:
+            sketches = {}
+            for i in range(4000):
+                plan = 'plan_99' if i % 3 else 'plan_149'
+                visitor_id = f"V{1000 + (i * 7 + day.day) % 5000}"
+                tp.add_to_sketch(sketches, 'clickers', day, 'instagram', plan, visitor_id)
+                exact[plan].add(visitor_id)
+            tp.merge_sketches(conn, sketches)
+
+    with engine.connect() as conn:
+        by_plan = tp.unique_counts(conn, 'clickers', start, start + timedelta(days=2), by='plan')
+        total = tp.unique_counts(conn, 'clickers', start, start + timedelta(days=2))
+
+    for plan, visitors in exact.items():
+        assert abs(by_plan[plan] / len(visitors) - 1) <= BOUND
+    everyone = exact['plan_99'] | exact['plan_149']
+    assert abs(total[None] / len(everyone) - 1) <= BOUND
@@ -0,0 +1,50 @@
+"""Visitor ID allocation: no duplicates across processes and threads"""
+import multiprocessing
+
+import pytest
+
+import app as tp
+from bench import _allocate_ids
+
+PROCESSES = 4
+THREADS = 8
+PER_THREAD = 200
+
+
+@pytest.fixture
+def sequence(database):
+    engine, path = database
+    with engine.begin() as conn:
+        tp._migrate_visitor_id_sequence(conn)
+    engine.dispose()
+    return path
+
+
+@pytest.mark.parametrize('block_size', [1, tp.VISITOR_ID_BLOCK])
+def test_no_duplicate_ids_across_processes_and_threads(sequence, block_size):
+    with multiprocessing.get_context('fork').Pool(PROCESSES) as pool:
+        batches = pool.starmap(_allocate_ids, [(sequence, THREADS, PER_THREAD, block_size)] * PROCESSES)
+    ids = [vid for batch in batches for vid in batch]
+
+    assert len(ids) == PROCESSES * THREADS * PER_THREAD
+    assert len(ids) - len(set(ids)) == 0
+    assert all(vid[0] == 'V' and vid[1:].isdigit() for vid in ids)
+    assert min(int(vid[1:]) for vid in ids) >= 1001
+
+
+def test_sequence_continues_after_existing_ids(database):
+    engine, path = database
+    with engine.begin() as conn:
+        conn.execute(tp.Visitor.__table__.insert(), [{'visitor_id': 'V1500', 'ip_hash': 'a'},
+                                                     {'visitor_id': 'legacy', 'ip_hash': 'b'}])
+        tp._migrate_visitor_id_sequence(conn)
+
+    allocator = tp.BlockAllocator('visitor', tp.VISITOR_ID_BLOCK, engine=engine)
+    assert [allocator.next() for _ in range(3)] == [1501, 1502, 1503]
+
+
+def test_uninitialized_sequence_raises(database):
+    engine, path = database
+    allocator = tp.BlockAllocator('visitor', 10, engine=engine)
+    with pytest.raises(RuntimeError, match='upgrade-db'):
+        allocator.next()